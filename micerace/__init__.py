@@ -1,2 +1 @@
 from .mice import *
-from .race import *
\ No newline at end of file
@@ -0,0 +1,53 @@
+import argparse
+
+from micerace.config import DEFAULT_HOST, DEFAULT_PORT, POLL_SECONDS
+
+
+def predict(args):
+    from micerace.race import predict_current_race
+    predict_current_race()
+
+
+def build(args):
+    from micerace.race import build_training_data
+    build_training_data(num_workers=args.workers, resume=args.resume, output_format=args.format)
+
+
+def stats(args):
+    from micerace.race import eyeball_current_race_stats
+    eyeball_current_race_stats()
+
+
+def serve(args):
+    from micerace.serve import serve as serve_predictions
+    serve_predictions(host=args.host, port=args.port, poll_seconds=args.poll_seconds)
+
+
+def main(argv=None):
+    """python -m micerace {predict,build,stats,serve}. Each command imports what it needs when it runs, so only
+    predicting with a Keras model loads TensorFlow."""
+    parser = argparse.ArgumentParser(prog='micerace', description='Mice race stats, training data and predictions.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('predict', help="predict the current race's winner").set_defaults(run=predict)
+
+    build_parser = commands.add_parser('build', help='build the training data')
+    build_parser.add_argument('--workers', type=int, default=1)
+    build_parser.add_argument('--resume', action='store_true', help='continue an interrupted build')
+    build_parser.add_argument('--format', choices=('csv', 'npy'), default='csv')
+    build_parser.set_defaults(run=build)
+
+    commands.add_parser('stats', help="print the current race's mice stats").set_defaults(run=stats)
+
+    serve_parser = commands.add_parser('serve', help='serve predictions over HTTP')
+    serve_parser.add_argument('--host', default=DEFAULT_HOST)
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument('--poll-seconds', type=float, default=POLL_SECONDS)
+    serve_parser.set_defaults(run=serve)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import itertools
+from multiprocessing import Pool
+
+import numpy as np
+
+from micerace.feature_store import FeatureStore
+from micerace.inference import load_predictor, score_store
+
+# The race data has no odds, so by default every lane pays the decimal odds of a fair four-mouse race.
+DEFAULT_ODDS = 4.0
+DEFAULT_BANKROLL = 100.0
+STAKE_METHODS = ('flat', 'kelly')
+SWEEP_CHUNKSIZE = 16
+
+
+class RaceBets:
+    """Per race, the lane with the largest expected return and its probability, decimal odds, edge (expected return
+    per unit staked) and whether it won. Shared by every strategy over the same races, so it is computed once.
+
+    `probabilities` is the model's (races, 4) lane probabilities, `winners` the winning lane per race (-1 or any other
+    out-of-range value for races without a winner, which lose the stake) and `odds` decimal odds, a scalar or
+    broadcastable to (races, 4).
+    """
+
+    def __init__(self, probabilities, winners, odds=DEFAULT_ODDS):
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+        odds = np.broadcast_to(np.asarray(odds, dtype=np.float64), probabilities.shape)
+        edges = probabilities * odds - 1
+        self.lanes = edges.argmax(axis=1)
+        rows = np.arange(len(probabilities))
+        self.prob = probabilities[rows, self.lanes]
+        self.odds = odds[rows, self.lanes]
+        self.edge = edges[rows, self.lanes]
+        self.hit = self.lanes == np.asarray(winners)
+        self.kelly = np.clip(self.edge / np.maximum(self.odds - 1, 1e-12), 0, 1)
+
+    def __len__(self):
+        return len(self.prob)
+
+
+def simulate(bets, stake='flat', stake_size=1.0, kelly_fraction=0.5, min_prob=0.0, min_edge=0.0,
+             bankroll=DEFAULT_BANKROLL, curve=False):
+    """Replay a betting strategy over RaceBets in time order, vectorized over the races.
+
+    A race is bet on if its probability and edge clear `min_prob` and `min_edge`. With `stake` 'flat' every bet is
+    `stake_size`; with 'kelly' it is `kelly_fraction` of the Kelly stake as a share of the current bankroll. Betting
+    stops once the bankroll cannot cover a flat stake.
+    """
+    if stake not in STAKE_METHODS:
+        raise Exception(f"Unknown stake method {stake}!")
+    place = (bets.prob >= min_prob) & (bets.edge >= min_edge)
+    won = place & bets.hit
+
+    if stake == 'flat':
+        returns = np.where(won, stake_size * (bets.odds - 1), -stake_size * place)
+        path = bankroll + np.cumsum(returns)
+        # The path is exact up to the first race the bankroll before it cannot cover; nothing is bet after that.
+        before = np.concatenate(([bankroll], path[:-1]))
+        broke = np.flatnonzero(place & (before < stake_size))
+        if len(broke):
+            place[broke[0]:] = False
+            won &= place
+            path[broke[0]:] = before[broke[0]]
+        total_staked = stake_size * float(place.sum())
+    else:
+        # Never more than the whole bankroll, whatever the fraction.
+        kelly = np.minimum(bets.kelly * kelly_fraction, 1) * place
+        growth = np.where(won, 1 + kelly * (bets.odds - 1), 1 - kelly)
+        path = bankroll * np.cumprod(growth)
+        total_staked = float(kelly @ np.concatenate(([bankroll], path[:-1])))
+
+    final_bankroll = float(path[-1]) if len(path) else float(bankroll)
+    num_bets = int(place.sum())
+    path_from_start = np.concatenate(([bankroll], path))
+    result = {
+        'final_bankroll': final_bankroll,
+        'profit': final_bankroll - bankroll,
+        'roi': (final_bankroll - bankroll) / total_staked if total_staked else 0.0,
+        'num_bets': num_bets,
+        'hit_rate': float(won.sum()) / num_bets if num_bets else 0.0,
+        'total_staked': total_staked,
+        'max_drawdown': float((1 - path_from_start / np.maximum.accumulate(path_from_start)).max()),
+    }
+    if curve:
+        result['bankroll_curve'] = path
+    return result
+
+
+def backtest(probabilities, winners, odds=DEFAULT_ODDS, **strategy):
+    """simulate() one strategy straight from the model's probabilities and the winners."""
+    return simulate(RaceBets(probabilities, winners, odds), **strategy)
+
+
+def strategy_grid(**params):
+    """Every combination of the simulate keyword arguments given as lists, e.g.
+    strategy_grid(stake=['flat', 'kelly'], min_edge=[0, 0.05, 0.1])."""
+    names = list(params)
+    return [dict(zip(names, values)) for values in itertools.product(*(params[name] for name in names))]
+
+
+_sweep_worker_kwargs = {}
+
+
+def _init_sweep_worker(probabilities, winners, odds):
+    _sweep_worker_kwargs['bets'] = RaceBets(probabilities, winners, odds)
+
+
+def _run_strategy(strategy):
+    return {**strategy, **simulate(_sweep_worker_kwargs['bets'], **strategy)}
+
+
+def sweep(probabilities, winners, strategies, odds=DEFAULT_ODDS, num_workers=1):
+    """simulate() every strategy (a dict of its keyword arguments, see strategy_grid), sorted by final bankroll.
+
+    The race arrays are sent to each worker once, when the pool starts, and turned into RaceBets there; strategies
+    are handed out in chunks.
+    """
+    initargs = (np.asarray(probabilities, dtype=np.float64), np.asarray(winners), odds)
+    if num_workers <= 1:
+        _init_sweep_worker(*initargs)
+        results = [_run_strategy(strategy) for strategy in strategies]
+    else:
+        with Pool(num_workers, initializer=_init_sweep_worker, initargs=initargs) as pool:
+            results = pool.map(_run_strategy, strategies, chunksize=SWEEP_CHUNKSIZE)
+    return sorted(results, key=lambda result: result['final_bankroll'], reverse=True)
+
+
+def load_history(store_path='training_data/training-latest', model_path='models/model-latest.npz'):
+    """(probabilities, winners) for every race in the columnar feature store, scored with the model."""
+    store = FeatureStore(store_path)
+    return score_store(store, load_predictor(model_path)), store.labels()
@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+from contextlib import contextmanager
+
+import numpy as np
+
+from micerace import util
+from micerace.fetch import LocalRaceServer
+from micerace.race import Race, HistoricalMiceRaceSystem, StatsAgent
+from micerace.synthetic import generate_leaderboard, generate_races, DEFAULT_SEED
+
+BENCH_RESULTS_FILE = 'bench/results.jsonl'
+# A timing this much slower than the previous run at the same scale is reported as a regression.
+REGRESSION_RATIO = 1.10
+DEFAULT_NUM_RACES = 10000
+DEFAULT_NUM_ROWS = 500
+DEFAULT_NUM_PREDICTIONS = 200
+NUM_REFRESH_RACES = 100
+
+
+@contextmanager
+def _workspace():
+    """Run in a scratch directory laid out like the repo's (pickles/, training_data/), so nothing real is touched."""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='micerace-bench-') as workdir:
+        os.makedirs(os.path.join(workdir, 'pickles'))
+        os.makedirs(os.path.join(workdir, 'training_data'))
+        open(os.path.join(workdir, 'training_data', 'training-latest.csv'), 'w').close()
+        os.chdir(workdir)
+        try:
+            yield workdir
+        finally:
+            os.chdir(cwd)
+
+
+def _timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - started
+
+
+def _replay_system(races, leaderboard, num_primer_races):
+    return HistoricalMiceRaceSystem(num_primer_races=num_primer_races, mice_metadata=leaderboard, races=races)
+
+
+def bench_get_all_races(race_dicts):
+    """A full fetch and an incremental refresh against a local stand-in for the races endpoint."""
+    newest_first = list(reversed(race_dicts))
+    with _workspace(), LocalRaceServer(newest_first[NUM_REFRESH_RACES:]) as server:
+        full_s = _timed(util.get_all_races, use_cache=False, url=server.url)
+        server.races = newest_first
+        refresh_s = _timed(util.get_all_races, use_cache=True, url=server.url)
+    return {'get_all_races_full_s': full_s, 'get_all_races_refresh_s': refresh_s}
+
+
+def bench_get_mice_stats(races, leaderboard, num_rows):
+    """get_mice_stats for the latest race's mice, over the last `num_rows` races of the replay."""
+    replay_started = time.perf_counter()
+    stats_agent = StatsAgent(system=_replay_system(races, leaderboard, len(races) - num_rows), model_path=None)
+    replay_s = time.perf_counter() - replay_started
+
+    timings = []
+    for _ in range(num_rows - 1):
+        stats_agent.system.ingest_new_race()
+        timings.append(_timed(stats_agent.get_mice_stats, stats_agent.system.latest_race.mice_names))
+    return {'replay_s': replay_s, 'get_mice_stats_ms': 1000 * float(np.mean(timings))}
+
+
+def bench_build_training_data(races, leaderboard, num_rows, num_workers=1):
+    """build_training_data for the last `num_rows` races, as CSV and as the columnar store."""
+    results = {}
+    for output_format in ('csv', 'npy'):
+        with _workspace():
+            stats_agent = StatsAgent(system=_replay_system(races, leaderboard, len(races) - num_rows),
+                                     model_path=None)
+            elapsed = _timed(stats_agent.build_training_data, num_workers=num_workers, output_format=output_format)
+        results[f'build_training_data_{output_format}_row_ms'] = 1000 * elapsed / num_rows
+    return results
+
+
+def bench_predict(races, leaderboard, num_predictions, model_path):
+    """Latency of predicting the latest race right after it is ingested. Without a model file only the feature
+    vector is timed."""
+    has_model = model_path is not None and os.path.exists(model_path)
+    stats_agent = StatsAgent(system=_replay_system(races, leaderboard, len(races) - num_predictions),
+                             model_path=model_path if has_model else None)
+    predict = stats_agent.predict_latest_race if has_model else stats_agent.get_race_features
+
+    timings = []
+    for _ in range(num_predictions - 1):
+        stats_agent.system.ingest_new_race()
+        timings.append(1000 * _timed(predict))
+    name = 'predict' if has_model else 'race_features'
+    return {f'{name}_p50_ms': float(np.percentile(timings, 50)), f'{name}_p95_ms': float(np.percentile(timings, 95))}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def load_results(results_file=BENCH_RESULTS_FILE):
+    if not os.path.exists(results_file):
+        return []
+    with open(results_file) as infile:
+        return [json.loads(line) for line in infile if line.strip()]
+
+
+def compare(previous, current):
+    """Lines comparing two runs' results, flagging timings that got slower by more than REGRESSION_RATIO."""
+    lines = []
+    for name, value in current['results'].items():
+        before = previous['results'].get(name) if previous else None
+        if before is None:
+            lines.append(f'{name:40s} {value:12.4f}')
+            continue
+        change = value / before if before else float('inf')
+        flag = '  REGRESSION' if change > REGRESSION_RATIO else ''
+        lines.append(f'{name:40s} {value:12.4f} {before:12.4f} {100 * (change - 1):+8.1f}%{flag}')
+    return lines
+
+
+def run(num_races=DEFAULT_NUM_RACES, num_rows=DEFAULT_NUM_ROWS, num_predictions=DEFAULT_NUM_PREDICTIONS,
+        seed=DEFAULT_SEED, model_path='models/model-latest.h5', num_workers=1, results_file=BENCH_RESULTS_FILE,
+        skip=()):
+    """Run every benchmark on a synthetic history of `num_races` races, append the results to `results_file` and
+    print them next to the previous run with the same parameters."""
+    results_file = os.path.abspath(results_file)
+    model_path = os.path.abspath(model_path) if model_path else None
+    leaderboard = generate_leaderboard(seed=seed)
+    race_dicts = generate_races(num_races, leaderboard, seed=seed)
+    races = HistoricalMiceRaceSystem.replay_races(Race.from_dicts(race_dicts))
+    num_rows = min(num_rows, len(races) - 1)
+    num_predictions = min(num_predictions, len(races) - 1)
+
+    results = {'race_from_dicts_s': _timed(Race.from_dicts, race_dicts)}
+    if 'get_all_races' not in skip:
+        results.update(bench_get_all_races(race_dicts))
+    if 'get_mice_stats' not in skip:
+        results.update(bench_get_mice_stats(races, leaderboard, num_rows))
+    if 'build_training_data' not in skip:
+        results.update(bench_build_training_data(races, leaderboard, num_rows, num_workers=num_workers))
+    if 'predict' not in skip:
+        results.update(bench_predict(races, leaderboard, num_predictions, model_path))
+
+    record = {
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'params': {'num_races': num_races, 'num_rows': num_rows, 'num_predictions': num_predictions,
+                   'seed': seed, 'num_workers': num_workers},
+        'results': results,
+    }
+    previous = [r for r in load_results(results_file) if r['params'] == record['params']]
+    os.makedirs(os.path.dirname(results_file), exist_ok=True)
+    with open(results_file, 'a') as outfile:
+        outfile.write(json.dumps(record) + '\n')
+
+    print(f"{'benchmark':40s} {'now':>12s} {'previous':>12s} {'change':>9s}")
+    for line in compare(previous[-1] if previous else None, record):
+        print(line)
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark micerace on a synthetic race history.')
+    parser.add_argument('--races', type=int, default=DEFAULT_NUM_RACES)
+    parser.add_argument('--rows', type=int, default=DEFAULT_NUM_ROWS)
+    parser.add_argument('--predictions', type=int, default=DEFAULT_NUM_PREDICTIONS)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--model', default='models/model-latest.h5')
+    parser.add_argument('--results', default=BENCH_RESULTS_FILE)
+    parser.add_argument('--skip', nargs='*', default=(),
+                        choices=('get_all_races', 'get_mice_stats', 'build_training_data', 'predict'))
+    args = parser.parse_args()
+    run(num_races=args.races, num_rows=args.rows, num_predictions=args.predictions, seed=args.seed,
+        model_path=args.model, num_workers=args.workers, results_file=args.results, skip=args.skip)
+
+
+if __name__ == '__main__':
+    main()
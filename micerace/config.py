@@ -0,0 +1,5 @@
+# Defaults shared by the command line and the modules that use them, kept here so parsing arguments imports nothing
+# heavy.
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+POLL_SECONDS = 2
@@ -0,0 +1,99 @@
+import os
+import zlib
+import sqlite3
+import hashlib
+
+import numpy as np
+
+FEATURE_CACHE_FILE = 'training_data/feature-cache.sqlite3'
+# Modules whose code decides what a feature row holds -- the feature code itself, plus race parsing and elapsed
+# times (util.py) and Race construction, lane win ratios and row assembly (race.py); any change to them is a new
+# feature-set version.
+FEATURE_SOURCES = ('features.py', 'history.py', 'mice.py', 'ratings.py', 'util.py', 'race.py')
+ROW_DTYPE = np.float64
+FLUSH_EVERY = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS features (
+    race_id TEXT NOT NULL,
+    version TEXT NOT NULL,
+    inputs TEXT NOT NULL,
+    row BLOB NOT NULL,
+    PRIMARY KEY (race_id, version)
+);
+"""
+
+
+def feature_set_version(columns):
+    """Hash of the schema's columns and the source of FEATURE_SOURCES."""
+    digest = hashlib.sha1('\n'.join(columns).encode())
+    for source in FEATURE_SOURCES:
+        with open(os.path.join(os.path.dirname(__file__), source), 'rb') as infile:
+            digest.update(infile.read())
+    return digest.hexdigest()
+
+
+def race_inputs(mice, history_digest):
+    """Digest of everything a row is computed from besides the code: the replayed history up to and including the
+    race (the system's history_digest) and the mice in row order with their site ratings."""
+    inputs = [history_digest, *((mouse.name, mouse.site_rating) for mouse in mice)]
+    return hashlib.sha1(repr(inputs).encode()).hexdigest()
+
+
+class FeatureCache:
+    """Computed feature rows, keyed by (race id, feature-set version), in a SQLite file.
+
+    A race's row only depends on the history up to it, so a rebuild can reuse every row it has already computed.
+    Rows written under other versions are dropped when the cache is opened, and a row whose `inputs` digest no
+    longer matches (an earlier race was corrected, dropped or arrived late, or a mouse's site rating changed) is
+    recomputed. Writes are batched.
+    """
+
+    def __init__(self, columns, path=FEATURE_CACHE_FILE):
+        self.path = path
+        self.version = feature_set_version(columns)
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(_SCHEMA)
+        with self.conn:
+            self.conn.execute('DELETE FROM features WHERE version != ?', (self.version,))
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM features').fetchone()[0]
+
+    def get_many(self, race_ids):
+        """{race id: (inputs digest, row)} for the races of `race_ids` that are cached."""
+        race_ids = list(race_ids)
+        rows = {}
+        for offset in range(0, len(race_ids), 500):
+            chunk = race_ids[offset:offset + 500]
+            for race_id, inputs, row in self.conn.execute(
+                    f"SELECT race_id, inputs, row FROM features WHERE version = ? "
+                    f"AND race_id IN ({','.join('?' * len(chunk))})", [self.version, *chunk]):
+                rows[race_id] = inputs, np.frombuffer(zlib.decompress(row), dtype=ROW_DTYPE)
+        return rows
+
+    def put(self, race_id, inputs, row):
+        self._pending.append((race_id, self.version, inputs,
+                              zlib.compress(np.asarray(row, dtype=ROW_DTYPE).tobytes(), 1)))
+        if len(self._pending) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            with self.conn:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO features (race_id, version, inputs, row) VALUES (?, ?, ?, ?)',
+                    self._pending)
+            self._pending = []
@@ -0,0 +1,163 @@
+import os
+import json
+from glob import glob
+
+import numpy as np
+
+MANIFEST_FILE = 'manifest.json'
+FEATURE_DTYPE = np.float32
+LABEL_DTYPE = np.int8
+RACE_ID_DTYPE = 'U24'
+DEFAULT_BLOCK_ROWS = 4096
+
+
+class FeatureStoreWriter:
+    """Columnar training table: float32 feature blocks plus a JSON manifest.
+
+    Every block is three uncompressed .npy files (features, labels, race ids) holding `block_rows` rows, and the
+    manifest lists the feature columns and the blocks in row order. The manifest is rewritten after each block, so
+    an interrupted build leaves every listed block complete.
+    """
+
+    def __init__(self, path, columns, block_rows=DEFAULT_BLOCK_ROWS, append=False):
+        self.path = path
+        self.block_rows = block_rows
+        self._buffer = []
+        self._buffered_rows = 0
+
+        os.makedirs(self.path, exist_ok=True)
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        if append and os.path.exists(manifest_path):
+            with open(manifest_path) as infile:
+                self.manifest = json.load(infile)
+            if self.manifest['columns'] != list(columns):
+                raise Exception(f"Feature store {self.path} has different columns, cannot append to it!")
+        else:
+            for block_file in glob(os.path.join(self.path, '*.npy')):
+                os.remove(block_file)
+            self.manifest = {
+                'columns': list(columns),
+                'feature_dtype': np.dtype(FEATURE_DTYPE).name,
+                'label_dtype': np.dtype(LABEL_DTYPE).name,
+                'blocks': [],
+            }
+            self._write_manifest()
+
+    @property
+    def num_rows(self):
+        return sum(block['rows'] for block in self.manifest['blocks']) + self._buffered_rows
+
+    def _block_files(self, block_num):
+        return {kind: f'{kind}-{block_num:05d}.npy' for kind in ('features', 'labels', 'race_ids')}
+
+    def _load_block(self, block, kind):
+        return np.load(os.path.join(self.path, block[kind]))
+
+    def _write_manifest(self):
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        with open(manifest_path + '.tmp', 'w') as outfile:
+            json.dump(self.manifest, outfile)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+    def race_ids(self):
+        """Race id of every row written so far, in row order."""
+        blocks = [self._load_block(block, 'race_ids') for block in self.manifest['blocks']]
+        blocks += [race_ids for _, _, race_ids in self._buffer]
+        return np.concatenate(blocks).tolist() if blocks else []
+
+    def truncate(self, num_rows):
+        """Drop every row from `num_rows` on."""
+        self.flush(final=True)
+        kept_rows = 0
+        for block_num, block in enumerate(self.manifest['blocks']):
+            if kept_rows + block['rows'] > num_rows:
+                keep = num_rows - kept_rows
+                tail = [self._load_block(block, kind)[:keep] for kind in ('features', 'labels', 'race_ids')]
+                self.manifest['blocks'] = self.manifest['blocks'][:block_num]
+                self._write_manifest()
+                self.write(*tail)
+                return
+            kept_rows += block['rows']
+
+    def write(self, features, labels, race_ids):
+        """Append rows; full blocks go to disk as soon as they fill up."""
+        if not len(features):
+            return
+        self._buffer.append((np.asarray(features, dtype=FEATURE_DTYPE),
+                             np.asarray(labels, dtype=LABEL_DTYPE),
+                             np.asarray(race_ids, dtype=RACE_ID_DTYPE)))
+        self._buffered_rows += len(features)
+        self.flush()
+
+    def flush(self, final=False):
+        if not self._buffer:
+            return
+        features, labels, race_ids = (np.concatenate(part) for part in zip(*self._buffer))
+        self._buffer, self._buffered_rows = [], 0
+
+        while len(features) >= self.block_rows or (final and len(features)):
+            block_num = len(self.manifest['blocks'])
+            block = {**self._block_files(block_num), 'rows': min(len(features), self.block_rows)}
+            for kind, values in (('features', features), ('labels', labels), ('race_ids', race_ids)):
+                np.save(os.path.join(self.path, block[kind]), values[:self.block_rows])
+            self.manifest['blocks'].append(block)
+            self._write_manifest()
+            features, labels, race_ids = (v[self.block_rows:] for v in (features, labels, race_ids))
+
+        if len(features):
+            self._buffer, self._buffered_rows = [(features, labels, race_ids)], len(features)
+
+    def close(self):
+        self.flush(final=True)
+
+
+class FeatureStore:
+    """Read side of a FeatureStoreWriter directory. Feature blocks are memory-mapped, so rows are only paged in when
+    they are gathered and resident memory stays bounded by the batches in flight, not by the size of the store."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(self.path, MANIFEST_FILE)) as infile:
+            self.manifest = json.load(infile)
+        self.columns = self.manifest['columns']
+        self.blocks = [np.load(os.path.join(self.path, block['features']), mmap_mode='r')
+                       for block in self.manifest['blocks']]
+        self.block_starts = np.cumsum([0] + [block['rows'] for block in self.manifest['blocks']])
+        self.num_rows = int(self.block_starts[-1])
+
+    def __len__(self):
+        return self.num_rows
+
+    def labels(self):
+        return np.concatenate([np.load(os.path.join(self.path, block['labels']))
+                               for block in self.manifest['blocks']]) if self.blocks else np.empty(0, LABEL_DTYPE)
+
+    def race_ids(self):
+        return np.concatenate([np.load(os.path.join(self.path, block['race_ids']))
+                               for block in self.manifest['blocks']]) if self.blocks else np.empty(0, RACE_ID_DTYPE)
+
+    def take(self, indices):
+        """Gather the feature rows at `indices` (any order) into a new float32 array."""
+        indices = np.asarray(indices, dtype=np.int64)
+        out = np.empty((len(indices), len(self.columns)), dtype=FEATURE_DTYPE)
+        block_nums = np.searchsorted(self.block_starts, indices, side='right') - 1
+        for block_num in np.unique(block_nums):
+            selected = np.flatnonzero(block_nums == block_num)
+            rows = indices[selected] - self.block_starts[block_num]
+            order = np.argsort(rows)
+            # Reading each block's rows in ascending order keeps the page faults sequential.
+            out[selected[order]] = self.blocks[block_num][rows[order]]
+        return out
+
+
+def store_from_csv(csv_path, store_path, columns, label_column='winner_position_ndx', chunk_rows=DEFAULT_BLOCK_ROWS):
+    """Convert a training CSV into a feature store, reading it `chunk_rows` rows at a time."""
+    import pandas as pd
+
+    store = FeatureStoreWriter(store_path, columns, block_rows=chunk_rows)
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_rows, usecols=list(columns) + [label_column, 'race_id'],
+                             dtype={'race_id': str}):
+        store.write(chunk[list(columns)].to_numpy(dtype=FEATURE_DTYPE), chunk[label_column].to_numpy(),
+                    chunk['race_id'].to_numpy(dtype=str))
+    store.close()
+    return FeatureStore(store_path)
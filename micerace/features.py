@@ -0,0 +1,189 @@
+import os
+import re
+import json
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from .history import GLOBAL_FEATURES, INTERVAL_FEATURES, FEATURE_FAMILIES, LANE_COLORS
+from .profiling import timed
+
+TRAIN_COLUMNS_FILE = os.path.join(os.path.dirname(__file__), 'training_data', 'train_columns.txt')
+
+# Columns of the training table that are labels rather than model inputs (see the drop list in train.py).
+LABEL_COLUMNS = ('winner_name_id',)
+# What missing (NaN) features are filled with before they reach the model, in training and in prediction alike.
+MISSING_VALUE = -1.0
+NUM_MICE = 4
+
+_MOUSE_COLUMN = re.compile(r'^mouse_(\d+)_(.+)$')
+_NUM_RACES_COLUMN = re.compile(r'^(\d+)_race_win_ratio$')
+_LANE_NUM_RACES_COLUMN = re.compile(r'^(\d+)_race_lane_win_ratio$')
+_INTERVAL_COLUMN = re.compile(r'^(\d+)([hd])_(.+)$')
+# Point-in-time Elo strength from ratings.RatingEngine: the rating and win probability from before the race.
+RATING_FEATURES = ('elo_rating', 'elo_win_prob')
+
+# Every per-mouse column suffix a schema may hold, with the N-race count written {n} and the time window {interval},
+# mapped to the family of computations that produces it.
+MOUSE_FEATURE_REGISTRY = {
+    'name_id': 'mouse',
+    'site_rating': 'mouse',
+    **{name: FEATURE_FAMILIES[name] for name in GLOBAL_FEATURES},
+    '{n}_race_win_ratio': 'last_n',
+    '{n}_race_lane_win_ratio': 'lane_last_n',
+    **{f'{{interval}}_{name}': FEATURE_FAMILIES[name] for name in INTERVAL_FEATURES},
+    **{color: 'lane_win_ratios' for color in LANE_COLORS},
+    **{name: 'ratings' for name in RATING_FEATURES},
+}
+
+
+def parse_interval(label):
+    """'6h' -> timedelta(hours=6), '10d' -> timedelta(days=10)."""
+    match = re.match(r'^(\d+)([hd])$', label)
+    if match is None:
+        raise Exception(f"Cannot parse interval label {label}!")
+    amount, unit = int(match.group(1)), match.group(2)
+    return timedelta(hours=amount) if unit == 'h' else timedelta(days=amount)
+
+
+def mouse_feature_names(num_races, lane_num_races, interval_labels):
+    """Per-mouse column suffixes, in the order FeatureSchema.mouse_vector assembles them."""
+    return [
+        'name_id',
+        'site_rating',
+        *GLOBAL_FEATURES,
+        *[f'{n}_race_win_ratio' for n in num_races],
+        *[f'{n}_race_lane_win_ratio' for n in lane_num_races],
+        *[f'{label}_{name}' for label in interval_labels for name in INTERVAL_FEATURES],
+        *LANE_COLORS,
+        *RATING_FEATURES,
+    ]
+
+
+def mouse_feature_family(suffix):
+    """Registry family of a per-mouse column suffix, e.g. '6h_min_t' -> 'win_times'."""
+    template = re.sub(r'^\d+_race_', '{n}_race_', suffix)
+    template = re.sub(r'^\d+[hd]_', '{interval}_', template)
+    family = MOUSE_FEATURE_REGISTRY.get(template)
+    if family is None:
+        raise Exception(f"Unknown mouse column {suffix} in feature schema!")
+    return family
+
+
+def model_manifest_path(model_path):
+    """'models/model-latest.h5' -> 'models/model-latest.json', the columns the model was trained on."""
+    return os.path.splitext(model_path)[0] + '.json'
+
+
+def _race_timestamp(race):
+    return race.completed_at if race.completed_at is not None else datetime.utcnow()
+
+
+RACE_FEATURES = {
+    'winner_name_id': lambda race: getattr(race, 'winner_name_id', np.nan),
+    'completed_at_year': lambda race: _race_timestamp(race).year,
+    'completed_at_month': lambda race: _race_timestamp(race).month,
+    'completed_at_day': lambda race: _race_timestamp(race).day,
+    'completed_at_weekday': lambda race: _race_timestamp(race).weekday(),
+    'completed_at_hour': lambda race: _race_timestamp(race).hour,
+    'completed_at_minute': lambda race: _race_timestamp(race).minute,
+}
+
+
+class FeatureSchema:
+    """Column layout of a training table, as listed in training_data/train_columns.txt.
+
+    The N-race and time-window horizons are read off the column names, so a race's whole row is computed with one
+    RaceHistory.window_features call per mouse and then permuted into column order. That call is the execution
+    plan: only the horizons and the MOUSE_FEATURE_REGISTRY families the columns need are computed.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.race_columns = [c for c in self.columns if not _MOUSE_COLUMN.match(c)]
+        self.mouse_columns = [c[len('mouse_0_'):] for c in self.columns if c.startswith('mouse_0_')]
+
+        for column in self.race_columns:
+            if column not in RACE_FEATURES:
+                raise Exception(f"Unknown race column {column} in feature schema!")
+
+        self.num_races = self._horizons(_NUM_RACES_COLUMN)
+        self.lane_num_races = self._horizons(_LANE_NUM_RACES_COLUMN)
+        self.interval_labels = []
+        for suffix in self.mouse_columns:
+            match = _INTERVAL_COLUMN.match(suffix)
+            if match and match.group(3) in INTERVAL_FEATURES:
+                label = match.group(1) + match.group(2)
+                if label not in self.interval_labels:
+                    self.interval_labels.append(label)
+        self.time_deltas = [parse_interval(label) for label in self.interval_labels]
+        self.families = frozenset(mouse_feature_family(suffix) for suffix in self.mouse_columns)
+
+        names = {name: ndx for ndx, name in
+                 enumerate(mouse_feature_names(self.num_races, self.lane_num_races, self.interval_labels))}
+        missing = [suffix for suffix in self.mouse_columns if suffix not in names]
+        if missing:
+            raise Exception(f"Cannot compute mouse columns {missing}!")
+        self._mouse_take = np.array([names[suffix] for suffix in self.mouse_columns], dtype=np.int64)
+
+        # Where each column of the row comes from: the race-level values, or mouse N's permuted vector.
+        mouse_positions = {f'mouse_{num}_{suffix}': num * len(self.mouse_columns) + ndx
+                           for num in range(NUM_MICE) for ndx, suffix in enumerate(self.mouse_columns)}
+        race_positions = {c: NUM_MICE * len(self.mouse_columns) + ndx for ndx, c in enumerate(self.race_columns)}
+        self._row_take = np.array([mouse_positions[c] if c in mouse_positions else race_positions[c]
+                                   for c in self.columns], dtype=np.int64)
+
+        self.feature_columns = [c for c in self.columns if c not in LABEL_COLUMNS]
+        self._feature_take = np.array([ndx for ndx, c in enumerate(self.columns) if c not in LABEL_COLUMNS],
+                                      dtype=np.int64)
+
+    @classmethod
+    def from_file(cls, path=TRAIN_COLUMNS_FILE):
+        with open(path) as infile:
+            return cls([line.strip() for line in infile if line.strip()])
+
+    @classmethod
+    def for_model(cls, model_path):
+        """The schema of the model's input manifest (see model_manifest_path), else of train_columns.txt."""
+        manifest_path = model_manifest_path(model_path) if model_path is not None else None
+        if manifest_path is None or not os.path.exists(manifest_path):
+            return cls.from_file()
+        with open(manifest_path) as infile:
+            return cls(json.load(infile)['columns'])
+
+    @property
+    def uses_lane_win_ratios(self):
+        return 'lane_win_ratios' in self.families
+
+    @property
+    def uses_ratings(self):
+        return 'ratings' in self.families
+
+    def _horizons(self, pattern):
+        return [int(m.group(1)) for m in map(pattern.match, self.mouse_columns) if m]
+
+    def mouse_vector(self, mouse, lane_ratios, race_ratings=None):
+        """The mouse_N_* columns for the mouse's latest race, in schema order. `race_ratings` is the race's
+        RatingEngine.latest(), needed if the schema uses ratings."""
+        latest_race = mouse.all_races[-1]
+        history_features = mouse.history.window_features(
+            latest_race._event_starts_at, mouse.current_lane, self.num_races, self.lane_num_races,
+            self.time_deltas, self.families)
+        vector = np.concatenate([
+            [mouse.name_id, mouse.site_rating],
+            history_features,
+            [lane_ratios.get(color, np.nan) for color in LANE_COLORS],
+            race_ratings[:, mouse.current_lane] if race_ratings is not None else [np.nan] * len(RATING_FEATURES),
+        ])
+        return vector[self._mouse_take]
+
+    @timed('race_features')
+    def row(self, race, mice, lane_ratios, race_ratings=None):
+        """The full row for `race`, with `mice` already in mouse_0..mouse_3 order."""
+        parts = [self.mouse_vector(mouse, lane_ratios, race_ratings) for mouse in mice]
+        parts.append(np.array([RACE_FEATURES[c](race) for c in self.race_columns], dtype=np.float64))
+        return np.concatenate(parts)[self._row_take]
+
+    def model_input(self, row):
+        """Drop the label columns from a row (or a 2D block of rows)."""
+        return np.asarray(row)[..., self._feature_take]
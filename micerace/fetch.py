@@ -0,0 +1,189 @@
+import json
+import math
+import time
+import random
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import requests
+from requests.adapters import HTTPAdapter
+
+LOGGER = logging.getLogger('micerace_logger')
+
+DEFAULT_CONCURRENCY = 8
+MAX_TRIES = 3
+BACKOFF_SECONDS = 0.5
+TIMEOUT_SECONDS = 30
+
+
+class RaceFetcher:
+    """Pages through the historical races endpoint with asyncio.
+
+    Requests go through one keep-alive `requests.Session` whose connection pool is as large as the concurrency
+    limit; a semaphore bounds the pages in flight, and failed pages are retried with exponential backoff and jitter.
+    """
+
+    def __init__(self, url, concurrency=DEFAULT_CONCURRENCY, tries=MAX_TRIES, backoff_seconds=BACKOFF_SECONDS,
+                 timeout=TIMEOUT_SECONDS):
+        self.url = url
+        self.concurrency = concurrency
+        self.tries = tries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(concurrency, thread_name_prefix='race-fetch')
+        self._semaphore = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+    def _get_page(self, page_num):
+        resp = self.session.get(self.url, params={'pageIndex': page_num}, timeout=self.timeout)
+        resp.raise_for_status()
+        data = json.loads(resp.content.decode('utf-8'))
+        return data['games'], data['total']
+
+    async def fetch_page(self, page_num):
+        """(races, total number of races) for a page; pages are numbered from 1, newest races first."""
+        loop = asyncio.get_running_loop()
+        async with self._semaphore:
+            for attempt in range(self.tries):
+                try:
+                    return await loop.run_in_executor(self._executor, self._get_page, page_num)
+                except requests.RequestException:
+                    if attempt == self.tries - 1:
+                        raise
+                    delay = self.backoff_seconds * 2 ** attempt * (1 + random.random())
+                    LOGGER.info(f"Retrying page {page_num} in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+
+    async def fetch_all(self):
+        """Every race on the site."""
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        races, total = await self.fetch_page(1)
+        if not races:
+            return []
+        num_pages = int(math.ceil(total / len(races)))
+        pages = await asyncio.gather(*(self.fetch_page(page_num) for page_num in range(2, num_pages + 1)))
+        for page_races, _ in pages:
+            races.extend(page_races)
+        return races
+
+    async def fetch_pages(self, page_nums):
+        """The races of the pages in `page_nums`, in that order."""
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        pages = await asyncio.gather(*(self.fetch_page(page_num) for page_num in page_nums))
+        return [race for page_races, _ in pages for race in page_races]
+
+    async def fetch_new(self, known_ids, max_pages=None):
+        """Races from the newest page down to, and including, the first page holding only known races.
+
+        `known_ids(race_ids)` returns the subset of `race_ids` already stored. The first request is for page 1 alone
+        and each later batch is twice the size of the previous one, so a refresh that only finds a page or two of new
+        races makes about as many requests as pages, while a long catch-up still runs concurrently. Pages are looked
+        at in order and paging stops at the first fully known (or empty) page, or after `max_pages` pages.
+        """
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        races = []
+        page_num, batch_size = 1, 1
+        while max_pages is None or page_num <= max_pages:
+            stop = page_num + batch_size if max_pages is None else min(page_num + batch_size, max_pages + 1)
+            pages = await asyncio.gather(*(self.fetch_page(num) for num in range(page_num, stop)))
+            for page_races, _ in pages:
+                races.extend(page_races)
+                page_ids = [race['_id'] for race in page_races]
+                if not page_races or len(known_ids(page_ids)) == len(page_ids):
+                    return races
+            page_num, batch_size = stop, min(batch_size * 2, self.concurrency)
+        return races
+
+
+def fetch_all_races(url, concurrency=DEFAULT_CONCURRENCY):
+    with RaceFetcher(url, concurrency=concurrency) as fetcher:
+        return asyncio.run(fetcher.fetch_all())
+
+
+def fetch_new_races(url, known_ids, max_pages=None, concurrency=DEFAULT_CONCURRENCY):
+    with RaceFetcher(url, concurrency=concurrency) as fetcher:
+        return asyncio.run(fetcher.fetch_new(known_ids, max_pages=max_pages))
+
+
+class LocalRaceServer:
+    """Stand-in for the historical races endpoint, serving `races` (newest first) from a local HTTP server.
+
+    For offline runs: pass `.url` wherever the real endpoint goes. `latency` adds a delay per request,
+    `failures` maps a page number to how many of its requests answer 503 before it is served, and `num_requests`
+    counts the requests.
+    """
+
+    def __init__(self, races, page_size=50, latency=0.0, failures=None, host='127.0.0.1', port=0):
+        self.races = races
+        self.page_size = page_size
+        self.latency = latency
+        self.failures = dict(failures or {})
+        self.num_requests = 0
+        self._lock = threading.Lock()
+
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                page_num = int(parse_qs(urlparse(self.path).query).get('pageIndex', ['1'])[0])
+                with stand_in._lock:
+                    stand_in.num_requests += 1
+                    fail = stand_in.failures.get(page_num, 0) > 0
+                    if fail:
+                        stand_in.failures[page_num] -= 1
+                if stand_in.latency:
+                    time.sleep(stand_in.latency)
+                if fail:
+                    self.send_response(503)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                start = (max(page_num, 1) - 1) * stand_in.page_size
+                body = json.dumps({'games': stand_in.races[start:start + stand_in.page_size],
+                                   'total': len(stand_in.races)}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/games/allgames'
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,553 @@
+import statistics
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from .util import to_epoch_us
+from .profiling import timed
+
+NUM_LANES = 4
+LANE_COLORS = ('blue', 'red', 'green', 'yellow')
+HOUR_US = 3600 * 10**6
+OLDEST_RACE_US = to_epoch_us(datetime(year=2017, month=1, day=1))
+LANE_ROWS = np.eye(NUM_LANES, dtype=np.int64)
+
+# Layout of RaceHistory.window_features: the all-time stats, then one value per N-race window, one per N-race
+# current-lane window, and INTERVAL_FEATURES for every time window.
+GLOBAL_FEATURES = (
+    'lifetime_win_ratio', 'blue_lane_ratio', 'red_lane_ratio', 'green_lane_ratio', 'yellow_lane_ratio',
+    'current_lane_ratio', 'win_loss_current_lane', 'curr_repeat_wins', 'average_repeat_wins', 'max_repeat_wins',
+)
+INTERVAL_FEATURES = (
+    'win_ratio', 'wins', 'losses', 'win_loss_current_lane', 'current_repeat_wins', 'avg_repeat_w',
+    'median_repeat_w', 'max_repeat_w', 'min_t', 'max_t', 'mean_t', 'median_t', 'blue_lane_ratio',
+    'red_lane_ratio', 'green_lane_ratio', 'yellow_lane_ratio', 'current_lane_ratio',
+)
+# The computation behind each of those stats; window_features can skip the families a schema does not use.
+FEATURE_FAMILIES = {
+    'lifetime_win_ratio': 'win_counts', 'win_ratio': 'win_counts', 'wins': 'win_counts', 'losses': 'win_counts',
+    'blue_lane_ratio': 'lane_ratios', 'red_lane_ratio': 'lane_ratios', 'green_lane_ratio': 'lane_ratios',
+    'yellow_lane_ratio': 'lane_ratios', 'current_lane_ratio': 'lane_ratios',
+    'win_loss_current_lane': 'lane_counts',
+    'curr_repeat_wins': 'repeat_wins', 'average_repeat_wins': 'repeat_wins', 'max_repeat_wins': 'repeat_wins',
+    'current_repeat_wins': 'repeat_wins', 'avg_repeat_w': 'repeat_wins', 'median_repeat_w': 'repeat_wins',
+    'max_repeat_w': 'repeat_wins',
+    'min_t': 'win_times', 'max_t': 'win_times', 'mean_t': 'win_times', 'median_t': 'win_times',
+}
+HISTORY_FAMILIES = frozenset(FEATURE_FAMILIES.values())
+
+
+class Column:
+    """A NumPy array that grows by doubling, so appends are amortized O(1) and `values` is a view, not a copy."""
+
+    def __init__(self, dtype, width=None, initial=None, capacity=64):
+        self._data = np.zeros((capacity,) if width is None else (capacity, width), dtype=dtype)
+        self._size = 0
+        if initial is not None:
+            self.append(initial)
+
+    def __len__(self):
+        return self._size
+
+    def __getstate__(self):
+        # Checkpoints only need the filled part, not the spare capacity.
+        return {'_data': self._data[:max(self._size, 1)].copy(), '_size': self._size}
+
+    def append(self, value):
+        if self._size == len(self._data):
+            self._data = np.concatenate([self._data, np.zeros_like(self._data)])
+        self._data[self._size] = value
+        self._size += 1
+
+    def pop(self):
+        self._size -= 1
+        return self._data[self._size]
+
+    def truncate(self, size):
+        self._size = min(self._size, size)
+
+    @property
+    def last(self):
+        return self._data[self._size - 1]
+
+    @property
+    def values(self):
+        return self._data[:self._size]
+
+
+def ratio(numerator, denominator):
+    """Element-wise numerator / denominator, 0.0 where the denominator is 0."""
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+
+
+class RaceHistory:
+    """Columnar, append-only race history of a single mouse.
+
+    Completed races are kept as parallel arrays -- completion time in epoch micros, lane index and won flag -- next
+    to prefix sums of wins and per-lane tallies. Completed races must be added in completion order, so a time window
+    is always a suffix found with `searchsorted`, and every count over it is a difference of two prefix sums.
+
+    The elapsed times of the wins get their own column, so the wins of a window are the suffix starting at the
+    window's prefix win count, with prefix sums for the mean. Win streaks are run-length encoded as they happen --
+    first and last completed race of each streak, its length and prefix sums of the lengths -- so streak stats over
+    a window only look at the streaks that end in it.
+    """
+
+    def __init__(self):
+        # Prefix count of wins over every race the mouse was entered in, completed or not.
+        self.all_race_wins = Column(np.int64, initial=0)
+
+        self.completed_at = Column(np.int64)
+        self.lane = Column(np.int8)
+        self.won = Column(np.bool_)
+        self.decided = Column(np.bool_)
+
+        # Prefix sums over the completed races.
+        self.wins = Column(np.int64, initial=0)
+        self.lane_wins = Column(np.int64, width=NUM_LANES, initial=0)
+        self.lane_decided = Column(np.int64, width=NUM_LANES, initial=0)
+
+        # Elapsed time of every completed win (NaN if unknown), with prefix sums of the known ones in whole
+        # milliseconds -- the resolution of the API's timestamps, so the sums are exact -- and a prefix count of the
+        # unknown ones.
+        self.win_time = Column(np.float64)
+        self.win_time_ms_sum = Column(np.int64, initial=0)
+        self.win_time_missing = Column(np.int64, initial=0)
+
+        # Win streak index, one entry per streak, the latest still open while `streak` > 0. Races without a winner
+        # neither extend nor break a streak.
+        self.streak_first = Column(np.int64)
+        self.streak_last = Column(np.int64)
+        self.streak_length = Column(np.int64)
+        self.streak_length_sum = Column(np.int64, initial=0)
+        # All-time streak state: the open streak and the sorted lengths of the closed ones.
+        self.streak = 0
+        self.streak_lengths = []
+        self.streak_total = 0
+
+    @property
+    def num_races(self):
+        return len(self.all_race_wins) - 1
+
+    @property
+    def num_completed(self):
+        return len(self.completed_at)
+
+    def add_race(self, race, lane, won):
+        self.all_race_wins.append(self.all_race_wins.last + won)
+        if not race.completed:
+            return
+
+        decided = race.winner_name is not None
+        self.completed_at.append(to_epoch_us(race.completed_at))
+        self.lane.append(lane)
+        self.won.append(won)
+        self.decided.append(decided)
+        self.wins.append(self.wins.last + won)
+        if won:
+            self.lane_wins.append(self.lane_wins.last + LANE_ROWS[lane])
+            missing = race.elapsed_time is None
+            self.win_time.append(np.nan if missing else race.elapsed_time)
+            self.win_time_ms_sum.append(self.win_time_ms_sum.last + (0 if missing else round(race.elapsed_time * 1000)))
+            self.win_time_missing.append(self.win_time_missing.last + missing)
+        else:
+            self.lane_wins.append(self.lane_wins.last)
+        if decided:
+            self.lane_decided.append(self.lane_decided.last + LANE_ROWS[lane])
+        else:
+            self.lane_decided.append(self.lane_decided.last)
+
+        if won:
+            position = self.num_completed - 1
+            if self.streak:
+                self.streak_last.values[-1] = position
+                self.streak_length.values[-1] += 1
+                self.streak_length_sum.values[-1] += 1
+            else:
+                self.streak_first.append(position)
+                self.streak_last.append(position)
+                self.streak_length.append(1)
+                self.streak_length_sum.append(self.streak_length_sum.last + 1)
+            self.streak += 1
+        elif decided and self.streak > 0:
+            insort(self.streak_lengths, self.streak)
+            self.streak_total += self.streak
+            self.streak = 0
+
+    def truncate(self, num_races, num_completed):
+        """Undo add_race for every race after the first `num_races`, of which `num_completed` were completed.
+
+        Only the removed races are touched: the streaks that started after them are dropped from the streak index and
+        the all-time lengths, and the streak they cut into is shortened.
+        """
+        num_streaks = len(self.streak_length)
+        was_open = self.streak > 0
+        kept = int(np.searchsorted(self.streak_first.values, num_completed, side='left'))
+        # The closed streaks from the possibly shortened one on leave the sorted all-time lengths.
+        for ndx in range(max(kept - 1, 0), num_streaks - was_open):
+            length = int(self.streak_length.values[ndx])
+            del self.streak_lengths[bisect_left(self.streak_lengths, length)]
+            self.streak_total -= length
+
+        self.all_race_wins.truncate(num_races + 1)
+        for column in (self.completed_at, self.lane, self.won, self.decided):
+            column.truncate(num_completed)
+        for column in (self.wins, self.lane_wins, self.lane_decided):
+            column.truncate(num_completed + 1)
+        num_wins = int(self.wins.last)
+        self.win_time.truncate(num_wins)
+        self.win_time_ms_sum.truncate(num_wins + 1)
+        self.win_time_missing.truncate(num_wins + 1)
+
+        for column in (self.streak_first, self.streak_last, self.streak_length):
+            column.truncate(kept)
+        self.streak_length_sum.truncate(kept + 1)
+        self.streak = 0
+        if not kept:
+            return
+        if self.streak_last.last >= num_completed:
+            wins = self.wins.values
+            length = int(wins[-1] - wins[self.streak_first.last])
+            self.streak_last.values[-1] = np.searchsorted(wins, wins[-1]) - 1
+            self.streak_length_sum.values[-1] += length - self.streak_length.last
+            self.streak_length.values[-1] = length
+
+        # The last streak is still open if no decided race came after its last win.
+        lane_decided = self.lane_decided.values
+        if lane_decided[-1].sum() == lane_decided[self.streak_last.last + 1].sum():
+            self.streak = int(self.streak_length.last)
+        else:
+            insort(self.streak_lengths, int(self.streak_length.last))
+            self.streak_total += int(self.streak_length.last)
+
+    def window_start(self, max_race_age_us):
+        """Index of the first completed race that finished at or after max_race_age_us (scalar or array)."""
+        return np.searchsorted(self.completed_at.values, max_race_age_us, side='left')
+
+    def last_n_counts(self, n):
+        n = max(0, min(n, self.num_races))
+        prefix = self.all_race_wins.values
+        races_won = int(prefix[-1] - prefix[-1 - n])
+        return races_won, n - races_won
+
+    def win_counts(self, start):
+        races_won = int(self.wins.last - self.wins.values[start])
+        return races_won, self.num_completed - int(start) - races_won
+
+    def lane_counts(self, start, lane):
+        wins_in_lane = int(self.lane_wins.last[lane] - self.lane_wins.values[start, lane])
+        decided_in_lane = int(self.lane_decided.last[lane] - self.lane_decided.values[start, lane])
+        return wins_in_lane, decided_in_lane - wins_in_lane
+
+    def lane_win_ratios(self, start, lane):
+        lane_ctr = (self.lane_wins.last - self.lane_wins.values[start]).tolist()
+        total = float(max(sum(lane_ctr), 1))
+        return {
+            'blue_lane_ratio': lane_ctr[0] / total,
+            'red_lane_ratio': lane_ctr[1] / total,
+            'green_lane_ratio': lane_ctr[2] / total,
+            'yellow_lane_ratio': lane_ctr[3] / total,
+            'current_lane_ratio': lane_ctr[lane] / total,
+        }
+
+    @timed('repeat_wins')
+    def global_repeat_wins(self):
+        """(current, average, median, max) win streak over the whole history, from the running streak state."""
+        lengths = self.streak_lengths
+        num_streaks = len(lengths) + (self.streak > 0)
+        if not num_streaks:
+            return self.streak, 0.0, 0.0, 0.0
+
+        average_repeat_wins = (self.streak_total + self.streak) / float(num_streaks)
+        max_repeat_wins = max(lengths[-1] if lengths else 0, self.streak)
+        median_repeat_wins = _sorted_median(lengths, self.streak if self.streak > 0 else None)
+        return self.streak, average_repeat_wins, median_repeat_wins, max_repeat_wins
+
+    def repeat_wins(self, start):
+        """(current, average, median, max) win streak over the completed races from `start` on."""
+        curr_repeat_wins, average_repeat_wins, median_repeat_wins, max_repeat_wins = \
+            self._windowed_repeat_wins(np.array([start])).tolist()[0]
+        return int(curr_repeat_wins), average_repeat_wins, median_repeat_wins, int(max_repeat_wins)
+
+    def streaks(self, start=0):
+        """(started_at, ended_at, length) arrays of the win streaks that end at or after completed race `start`,
+        timestamps in epoch micros. The first one only counts its wins from `start` on."""
+        first = int(np.searchsorted(self.streak_last.values, start, side='left'))
+        started_at = self.completed_at.values[np.maximum(self.streak_first.values[first:], start)]
+        ended_at = self.completed_at.values[self.streak_last.values[first:]]
+        return started_at, ended_at, self._clipped_lengths(first, start)
+
+    def win_time_starts(self, cutoffs):
+        """Index into `win_time` of the first win since each cutoff (epoch micros).
+
+        A window without wins is widened by whole hours until it reaches the latest win, found in one step from the
+        latest win's completion time; for a mouse that never won every window stays empty.
+        """
+        cutoffs = np.asarray(cutoffs, dtype=np.int64)
+        wins = self.wins.values
+        starts = self.window_start(cutoffs)
+        empty = wins[starts] == wins[-1]
+        if wins[-1] and empty.any():
+            latest_win = np.searchsorted(wins, wins[-1]) - 1
+            latest_win_us = int(self.completed_at.values[latest_win])
+            hours = -(-(cutoffs[empty] - latest_win_us) // HOUR_US)
+            starts[empty] = self.window_start(cutoffs[empty] - hours * HOUR_US)
+        return wins[starts]
+
+    @timed('win_times_since')
+    def windowed_win_time_stats(self, cutoffs):
+        """(min, max, mean, median) elapsed time of the wins since each cutoff, as a (cutoffs, 4) array.
+
+        Every window is a suffix of `win_time`, so min and max are read off one running minimum and maximum over the
+        widest window, and the mean off the exact millisecond prefix sums. A mean exactly halfway between two
+        hundredths is settled like statistics.mean over the float times settles it, which takes a pass over that
+        window. The median is not incremental: np.median copies and partitions each window's times. Windows with no
+        wins, or with a win of unknown elapsed time, are NaN. The mean and median are rounded to 2 places.
+        """
+        win_starts = self.win_time_starts(cutoffs)
+        stats = np.full((len(win_starts), 4), np.nan)
+        num_wins = len(self.win_time)
+        has_wins = win_starts < num_wins
+        if not has_wins.any():
+            return stats
+
+        first = int(win_starts.min())
+        times = self.win_time.values[first:]
+        offsets = win_starts[has_wins] - first
+        stats[has_wins, 0] = np.minimum.accumulate(times[::-1])[::-1][offsets]
+        stats[has_wins, 1] = np.maximum.accumulate(times[::-1])[::-1][offsets]
+        counts = num_wins - win_starts[has_wins]
+        totals_ms = self.win_time_ms_sum.last - self.win_time_ms_sum.values[win_starts[has_wins]]
+        missing = self.win_time_missing.last - self.win_time_missing.values[win_starts[has_wins]]
+        means = []
+        for offset, total_ms, count, num_missing in zip(offsets.tolist(), totals_ms.tolist(), counts.tolist(),
+                                                        missing.tolist()):
+            if num_missing:
+                means.append(np.nan)
+            # In hundredths the mean is total_ms / (10 * count); it is a tie if twice that is an odd integer.
+            elif (2 * total_ms) % (10 * count) == 0 and (2 * total_ms) // (10 * count) % 2:
+                means.append(round(statistics.mean(times[offset:].tolist()), 2))
+            else:
+                means.append(round(total_ms / (count * 1000), 2))
+        stats[has_wins, 2] = means
+        stats[has_wins, 3] = [round(float(np.median(times[offset:])), 2) for offset in offsets.tolist()]
+        return stats
+
+    def win_time_stats(self, max_race_age_us):
+        """{min_t, max_t, mean_t, median_t} of the wins since max_race_age_us, None for a mouse that never won."""
+        if not self.wins.last:
+            return {'min_t': None, 'max_t': None, 'mean_t': None, 'median_t': None}
+        min_t, max_t, mean_t, median_t = self.windowed_win_time_stats([max_race_age_us])[0].tolist()
+        return {'min_t': min_t, 'max_t': max_t, 'mean_t': mean_t, 'median_t': median_t}
+
+    @timed('interval_stats')
+    def interval_stats(self, now, time_delta, lane):
+        """Same dict as Mouse.interval_stats, for the window of `time_delta` before `now` and the current lane."""
+        max_race_age_us = to_epoch_us(now - time_delta)
+        start = self.window_start(max_race_age_us)
+        races_won, races_lost = self.win_counts(start)
+        wins_in_lane, losses_in_lane = self.lane_counts(start, lane)
+        _, average_repeat_wins, median_repeat_wins, max_repeat_wins = self.repeat_wins(start)
+
+        return {
+            'win_ratio': races_won / float(races_won + races_lost) if races_won else 0.0,
+            'wins': races_won,
+            'losses': races_lost,
+            'wins_in_lane': wins_in_lane,
+            'losses_in_lane': losses_in_lane,
+            'average_repeat_wins': average_repeat_wins,
+            'lane_win_ratio_vs_others': self.lane_win_ratios(start, lane),
+            'avg_repeat_w': average_repeat_wins,
+            'median_repeat_w': median_repeat_wins,
+            'max_repeat_w': max_repeat_wins,
+            **self.win_time_stats(max_race_age_us),
+        }
+
+    @timed('window_features')
+    def window_features(self, now, lane, num_races, lane_num_races, time_deltas, families=HISTORY_FAMILIES):
+        """Every windowed stat of the mouse as one float vector, laid out as described next to GLOBAL_FEATURES.
+
+        All windows are read off the same prefix sums: the N-race windows by offset, the time windows with a single
+        searchsorted over all cutoffs. Stats of a FEATURE_FAMILIES family not in `families` are left NaN without
+        being computed, as are missing race-time stats.
+        """
+        num_completed = self.num_completed
+        wins = self.wins.values
+        lane_wins = self.lane_wins.values
+
+        # All-time stats.
+        global_features = np.full(len(GLOBAL_FEATURES), np.nan)
+        start = self.window_start(OLDEST_RACE_US)
+        if 'win_counts' in families:
+            global_features[0] = ratio(wins[-1], num_completed)
+        if 'lane_ratios' in families:
+            global_features[1:6] = list(self.lane_win_ratios(start, lane).values())
+        if 'lane_counts' in families:
+            global_features[6] = ratio(*self._lane_wins_decided(np.array([start]), lane))[0]
+        if 'repeat_wins' in families:
+            curr_repeat_wins, average_repeat_wins, _, max_repeat_wins = self.global_repeat_wins()
+            global_features[7:10] = [curr_repeat_wins, average_repeat_wins, max_repeat_wins]
+
+        # N-race windows.
+        num_races = np.clip(np.asarray(num_races, dtype=np.int64), 0, self.num_races)
+        prefix = self.all_race_wins.values
+        last_n_ratios = ratio(prefix[-1] - prefix[self.num_races - num_races], num_races)
+
+        lane_starts = np.maximum(num_completed - np.asarray(lane_num_races, dtype=np.int64), 0)
+        last_n_lane_ratios = ratio(*self._lane_wins_decided(lane_starts, lane))
+
+        # Time windows.
+        now_us = to_epoch_us(now)
+        cutoffs = np.array([now_us - td // timedelta(microseconds=1) for td in time_deltas], dtype=np.int64)
+        starts = self.window_start(cutoffs)
+        interval_features = np.full((len(starts), len(INTERVAL_FEATURES)), np.nan)
+
+        if 'win_counts' in families:
+            races_won = wins[-1] - wins[starts]
+            races_lost = num_completed - starts - races_won
+            interval_features[:, 0] = ratio(races_won, races_won + races_lost)
+            interval_features[:, 1] = races_won
+            interval_features[:, 2] = races_lost
+        if 'lane_counts' in families:
+            interval_features[:, 3] = ratio(*self._lane_wins_decided(starts, lane))
+        if 'repeat_wins' in families:
+            interval_features[:, 4:8] = self._windowed_repeat_wins(starts)
+        if 'win_times' in families:
+            interval_features[:, 8:12] = self.windowed_win_time_stats(cutoffs)
+        if 'lane_ratios' in families:
+            lane_ctr = lane_wins[-1] - lane_wins[starts]
+            lane_ratios = lane_ctr / np.maximum(lane_ctr.sum(axis=1, keepdims=True), 1).astype(np.float64)
+            interval_features[:, 12:16] = lane_ratios
+            interval_features[:, 16] = lane_ratios[:, lane]
+
+        return np.concatenate([global_features, last_n_ratios, last_n_lane_ratios, interval_features.ravel()])
+
+    def _lane_wins_decided(self, starts, lane):
+        wins_in_lane = self.lane_wins.last[lane] - self.lane_wins.values[starts, lane]
+        decided_in_lane = self.lane_decided.last[lane] - self.lane_decided.values[starts, lane]
+        return wins_in_lane, decided_in_lane
+
+    def _clipped_lengths(self, first, start):
+        """Lengths of the streaks from index `first` on, counting only the wins from completed race `start` on."""
+        lengths = self.streak_length.values[first:].copy()
+        if len(lengths):
+            lengths[0] = self.wins.values[self.streak_last.values[first] + 1] - \
+                self.wins.values[max(int(self.streak_first.values[first]), start)]
+        return lengths
+
+    @timed('repeat_wins')
+    def _windowed_repeat_wins(self, starts):
+        """(current, average, median, max) win streak for each window start, as range queries over the streak index.
+
+        A window holds the streaks that end in it, found with one searchsorted; the oldest may have started before
+        the window and only counts its wins inside it. Sums come from the prefix sums of the streak lengths, maxima
+        from one running maximum over the streaks of the widest window.
+        """
+        stats = np.zeros((len(starts), 4))
+        num_streaks = len(self.streak_length)
+        firsts = np.searchsorted(self.streak_last.values, starts, side='left')
+        if not len(starts) or firsts.min() == num_streaks:
+            return stats
+
+        lengths = self.streak_length.values
+        lengths_sum = self.streak_length_sum.values
+        widest = int(firsts.min())
+        later_max = np.maximum.accumulate(lengths[widest:][::-1])[::-1]
+        for ndx, (first, start) in enumerate(zip(firsts.tolist(), np.asarray(starts).tolist())):
+            if first == num_streaks:
+                continue
+            window_lengths = self._clipped_lengths(first, start)
+            clipped = int(window_lengths[0])
+            total = int(lengths_sum[-1] - lengths_sum[first + 1]) + clipped
+            longest = max(clipped, int(later_max[first + 1 - widest])) if first + 1 < num_streaks else clipped
+            current = int(window_lengths[-1]) if self.streak else 0
+            stats[ndx] = [current, total / len(window_lengths), np.median(window_lengths), longest]
+        return stats
+
+
+def _sorted_median(values, extra=None):
+    """statistics.median of an already sorted list plus an optional extra value, without copying the list."""
+    pos = len(values) if extra is None else bisect_left(values, extra)
+    size = len(values) + (extra is not None)
+
+    def nth(ndx):
+        if ndx < pos:
+            return values[ndx]
+        return extra if ndx == pos else values[ndx - 1]
+
+    mid = size // 2
+    if size % 2:
+        return nth(mid)
+    return (nth(mid - 1) + nth(mid)) / 2
+
+
+class LaneTally:
+    """Which lane won, over every decided race a system has ingested, as prefix sums.
+
+    Backs StatsAgent.lane_win_ratios: the all-time tally is the last prefix row, and the last-N-races or
+    last-T-hours variants are one subtraction away. Races are keyed by completion time, clamped to be
+    non-decreasing so a time window is always a suffix found with `searchsorted`.
+    """
+
+    def __init__(self):
+        self.completed_at = Column(np.int64)
+        self.winner_lane = Column(np.int8)
+        self.lane_wins = Column(np.int64, width=NUM_LANES, initial=0)
+
+    def __len__(self):
+        return len(self.winner_lane)
+
+    def add_race(self, race):
+        if not self.counts_race(race):
+            return
+        completed_at = to_epoch_us(race.completed_at)
+        if len(self.completed_at):
+            completed_at = max(completed_at, int(self.completed_at.last))
+        self.completed_at.append(completed_at)
+        self.winner_lane.append(race.winner_position_ndx)
+        self.lane_wins.append(self.lane_wins.last + LANE_ROWS[race.winner_position_ndx])
+
+    def truncate(self, num_races):
+        """Forget every race after the first `num_races` tallied."""
+        self.completed_at.truncate(num_races)
+        self.winner_lane.truncate(num_races)
+        self.lane_wins.truncate(num_races + 1)
+
+    @staticmethod
+    def counts_race(race):
+        return bool(race.completed and race.winner_name is not None)
+
+    def window_start(self, num_races=None, since_us=None):
+        """Index of the first race in the window of the last `num_races` races and/or those completed at or after
+        `since_us`."""
+        start = 0
+        if num_races is not None:
+            start = max(start, len(self) - num_races)
+        if since_us is not None:
+            start = max(start, int(np.searchsorted(self.completed_at.values, since_us, side='left')))
+        return start
+
+    def counts(self, start=0):
+        return self.lane_wins.last - self.lane_wins.values[start]
+
+    def ratios(self, start=0):
+        """{color: share of wins, rounded to 5 places} for the lanes that won at least once since `start`, in the
+        order each lane first won."""
+        counts = self.counts(start).tolist()
+        total = float(sum(counts))
+        if not total:
+            return {}
+
+        # Lanes in first-win order; at most a handful of races in before every winning lane has shown up.
+        order = []
+        num_winning_lanes = sum(1 for count in counts if count)
+        winner_lanes = self.winner_lane.values
+        for lane in winner_lanes[start:]:
+            if lane not in order:
+                order.append(int(lane))
+                if len(order) == num_winning_lanes:
+                    break
+        return {LANE_COLORS[lane]: round(counts[lane] / total, 5) for lane in order}
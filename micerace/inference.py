@@ -0,0 +1,164 @@
+import os
+import json
+
+import numpy as np
+
+from micerace.features import MISSING_VALUE
+
+DEFAULT_BATCH_SIZE = 1024
+PARITY_ATOL = 1e-5
+NUM_PARITY_SAMPLES = 256
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+    'tanh': np.tanh,
+    'softmax': lambda x: _softmax(x),
+}
+# Layers that only matter while training.
+IDENTITY_LAYERS = ('Dropout', 'SpatialDropout1D', 'InputLayer')
+
+
+def _softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+def runtime_path(model_path):
+    """'models/model-latest.h5' -> 'models/model-latest.npz'."""
+    return os.path.splitext(model_path)[0] + '.npz'
+
+
+def _layer_spec(layer):
+    name = type(layer).__name__
+    config = layer.get_config()
+    spec = {'type': name, 'num_weights': len(layer.get_weights())}
+    if name == 'Conv1D':
+        if config['padding'] != 'valid' or tuple(config['strides']) != (1,) or tuple(config['dilation_rate']) != (1,):
+            raise Exception(f"Only valid, stride 1, undilated Conv1D layers can be exported, not {config}!")
+        spec['activation'] = config['activation']
+    elif name == 'Dense':
+        spec['activation'] = config['activation']
+    elif name == 'Activation':
+        spec['activation'] = config['activation']
+    elif name == 'LeakyReLU':
+        spec['alpha'] = float(config.get('alpha', config.get('negative_slope', 0.3)))
+    elif name == 'MaxPooling1D':
+        if config['padding'] != 'valid':
+            raise Exception(f"Only valid MaxPooling1D layers can be exported, not {config}!")
+        spec['pool_size'] = int(np.ravel(config['pool_size'])[0])
+        spec['strides'] = int(np.ravel(config['strides'] or config['pool_size'])[0])
+    elif name not in IDENTITY_LAYERS and name != 'Flatten':
+        raise Exception(f"Cannot export {name} layers to the NumPy runtime!")
+    if spec.get('activation', 'linear') not in ACTIVATIONS:
+        raise Exception(f"Cannot export the {spec['activation']} activation to the NumPy runtime!")
+    return spec
+
+
+def export_model(model_path='models/model-latest.h5', out_path=None):
+    """Write the Keras model's layer specs and weights to an .npz file NumpyModel can run without TensorFlow."""
+    from tensorflow.keras.models import load_model
+
+    model = load_model(model_path)
+    out_path = out_path or runtime_path(model_path)
+    specs, arrays = [], {}
+    for ndx, layer in enumerate(model.layers):
+        specs.append(_layer_spec(layer))
+        for weight_ndx, weight in enumerate(layer.get_weights()):
+            arrays[f'{ndx}_{weight_ndx}'] = weight.astype(np.float32)
+    np.savez(out_path, layers=json.dumps(specs), input_shape=np.array(model.input_shape[1:]), **arrays)
+    return out_path
+
+
+class NumpyModel:
+    """CPU forward pass of an exported Sequential Conv1D/Dense model (see export_model), in float32 NumPy.
+
+    Conv1D is computed as one matrix product over the whole batch per kernel offset, shifted and summed, so there
+    is no im2col copy; rows are scored `batch_size` at a time to bound memory.
+    """
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.layers = json.loads(str(data['layers']))
+            self.input_shape = tuple(int(d) for d in data['input_shape'])
+            self.weights = [[data[f'{ndx}_{weight_ndx}'] for weight_ndx in range(spec['num_weights'])]
+                            for ndx, spec in enumerate(self.layers)]
+
+    def predict(self, x, batch_size=DEFAULT_BATCH_SIZE, verbose=0):
+        """Class probabilities for `x`, shaped (rows, features) or (rows, features, 1) like the Keras input."""
+        x = np.asarray(x, dtype=np.float32)
+        if x.ndim == 2:
+            x = x[:, :, np.newaxis]
+        if x.shape[1:] != self.input_shape:
+            raise Exception(f"Expected input of shape {self.input_shape}, got {x.shape[1:]}!")
+        return np.concatenate([self._forward(x[start:start + batch_size])
+                               for start in range(0, max(len(x), 1), batch_size)])
+
+    def _forward(self, x):
+        for spec, weights in zip(self.layers, self.weights):
+            layer_type = spec['type']
+            if layer_type == 'Conv1D':
+                kernel, bias = weights
+                num_rows, in_len, in_channels = x.shape
+                out_len = in_len - kernel.shape[0] + 1
+                flat = np.ascontiguousarray(x).reshape(-1, in_channels)
+                out = np.zeros((num_rows, out_len, kernel.shape[2]), dtype=np.float32)
+                for offset in range(kernel.shape[0]):
+                    out += (flat @ kernel[offset]).reshape(num_rows, in_len, -1)[:, offset:offset + out_len]
+                x = ACTIVATIONS[spec['activation']](out + bias)
+            elif layer_type == 'Dense':
+                kernel, bias = weights
+                x = ACTIVATIONS[spec['activation']](x @ kernel + bias)
+            elif layer_type == 'Activation':
+                x = ACTIVATIONS[spec['activation']](x)
+            elif layer_type == 'LeakyReLU':
+                x = np.where(x > 0, x, x * spec['alpha'])
+            elif layer_type == 'MaxPooling1D':
+                pool_size, strides = spec['pool_size'], spec['strides']
+                num_pools = (x.shape[1] - pool_size) // strides + 1
+                if pool_size == strides:
+                    x = x[:, :num_pools * pool_size].reshape(len(x), num_pools, pool_size, -1).max(axis=2)
+                else:
+                    x = np.stack([x[:, ndx * strides:ndx * strides + pool_size].max(axis=1)
+                                  for ndx in range(num_pools)], axis=1)
+            elif layer_type == 'Flatten':
+                x = x.reshape(len(x), -1)
+        return x
+
+
+def load_predictor(model_path):
+    """The model at `model_path`: a NumpyModel for an exported .npz, otherwise the Keras model."""
+    if model_path.endswith('.npz'):
+        return NumpyModel(model_path)
+    from tensorflow.keras.models import load_model
+    return load_model(model_path)
+
+
+def check_parity(model_path='models/model-latest.h5', runtime_model_path=None, x=None, atol=PARITY_ATOL):
+    """Largest absolute difference between the Keras and NumPy runtime probabilities over `x` (random rows
+    in [-1, 1] by default). Raises if it exceeds `atol`."""
+    from tensorflow.keras.models import load_model
+
+    keras_model = load_model(model_path)
+    numpy_model = NumpyModel(runtime_model_path or runtime_path(model_path))
+    if x is None:
+        x = np.random.default_rng(0).uniform(-1, 1, (NUM_PARITY_SAMPLES, *numpy_model.input_shape))
+    x = np.asarray(x, dtype=np.float32)
+    if x.ndim == 2:
+        x = x[:, :, np.newaxis]
+
+    max_diff = float(np.abs(keras_model.predict(x, verbose=0) - numpy_model.predict(x)).max())
+    if max_diff > atol:
+        raise Exception(f"NumPy runtime differs from the Keras model by {max_diff}!")
+    return max_diff
+
+
+def score_store(store, model, batch_size=DEFAULT_BATCH_SIZE):
+    """Class probabilities for every row of a FeatureStore, scored `batch_size` rows at a time."""
+    probabilities = []
+    for start in range(0, len(store), batch_size):
+        x_data = store.take(np.arange(start, min(start + batch_size, len(store))))
+        x_data[np.isnan(x_data)] = MISSING_VALUE
+        probabilities.append(model.predict(x_data[:, :, np.newaxis], verbose=0))
+    return np.concatenate(probabilities) if probabilities else np.empty((0, 0), dtype=np.float32)
@@ -1,7 +1,9 @@
-import statistics
 from datetime import datetime
 
-from .util import MouseNames, MouseColors
+import numpy as np
+
+from .history import RaceHistory
+from .util import MouseNames, MouseColors, to_epoch_us
 from datetime import timedelta
 
 
@@ -28,6 +30,9 @@ class Mouse:
         self.median_repeat_wins = 0
         self.current_repeat_wins = 0
 
+        # Columnar copy of the races above; the stats below are answered from its prefix sums.
+        self.history = RaceHistory()
+
         self.__validate_data_integrity()
 
     @property
@@ -60,12 +65,34 @@ class Mouse:
         if not all([c.isdigit() for c in self.kwargs['family']]):
             raise Exception("Family value is not a number! Modify logic in code!")
 
-    def add_race(self, race):
-        self.all_races.append(race)
+    def add_race(self, race, lane=None):
+        won = race.winner_name == self.name
+        self.history.add_race(race, race.lanes[self.name] if lane is None else lane, won)
+        self._file_race(race, won)
 
+        if self.total_races_lost + self.total_races_won != self.total_races_completed:
+            raise Exception(
+                f"total_races_won ({self.total_races_won}) + total_races_lost ({self.total_races_lost}) "
+                f"!= completed_races ({self.total_races_completed}) for {self.name}!")
+
+    def remove_races(self, num_races):
+        """Take back the latest `num_races` races, e.g. to re-add them after their status changed."""
+        for race in reversed(self.all_races[len(self.all_races) - num_races:]):
+            self.all_races.pop()
+            if race.completed:
+                self.completed_races.pop()
+                (self.winning_races if race.winner_name == self.name else self.losing_races).pop()
+            if race.reset:
+                self.reset_races.pop()
+            if race.cancelled:
+                self.cancelled_races.pop()
+        self.history.truncate(len(self.all_races), len(self.completed_races))
+
+    def _file_race(self, race, won):
+        self.all_races.append(race)
         if race.completed:
             self.completed_races.append(race)
-            if race.winner_name == self.name:
+            if won:
                 self.winning_races.append(race)
             else:
                 self.losing_races.append(race)
@@ -76,85 +103,57 @@ class Mouse:
             if race.cancelled:
                 self.cancelled_races.append(race.cancelled)
 
-        if self.total_races_lost + self.total_races_won != self.total_races_completed:
-            raise Exception(
-                f"total_races_won ({self.total_races_won}) + total_races_lost ({self.total_races_lost}) "
-                f"!= completed_races ({self.total_races_completed}) for {self.name}!")
-
-    def win_ratio_last_n_races(self, n):
-        races_won = races_lost = 0
-        for race in self.all_races[::-1]:
-            if n > 0:
-                if race.winner_name == self.name:
-                    races_won += 1
-                else:
-                    races_lost += 1
-            n -= 1
-
-        return races_won, races_lost
+    def checkpoint_state(self, race_offsets):
+        """Compact state for a replay checkpoint; races are stored as offsets (see `race_offsets`, keyed by id()).
 
-    def lane_win_vs_other_lane_ratio(self, time_delta=None):
-        now = self.all_races[-1]._event_starts_at
-        if time_delta is None:
-            max_race_age = datetime(year=2017, month=1, day=1)
-        else:
-            max_race_age = now - time_delta
-
-        lane_ctr = [0, 0, 0, 0]
-        for race in self.winning_races[::-1]:
-            if race.completed_at >= max_race_age:
-                lane_ctr[race.mice_names.index(self.name)] += 1
-
-        ratios = {
-            'blue_lane_ratio': lane_ctr[0] / float(max(sum(lane_ctr), 1)),
-            'red_lane_ratio': lane_ctr[1] / float(max(sum(lane_ctr), 1)),
-            'green_lane_ratio': lane_ctr[2] / float(max(sum(lane_ctr), 1)),
-            'yellow_lane_ratio': lane_ctr[3] / float(max(sum(lane_ctr), 1)),
+        The leaderboard fields are not stored: a restored mouse takes them from the current leaderboard."""
+        return {
+            'race_offsets': np.array([race_offsets[id(race)] for race in self.all_races], dtype=np.int32),
+            'history': self.history,
         }
-        current_race_lane = self.all_races[-1].mice_names.index(self.name)
-        ratios.update({'current_lane_ratio': lane_ctr[current_race_lane] / float(max(sum(lane_ctr), 1))})
-        return ratios
 
-
-
-    def current_lane_total_win_ratio(self, time_delta=None, num_races=99999999):
-        """In the current lane, what is the wins/total_races ratio?"""
-        now = self.all_races[-1]._event_starts_at
+    @classmethod
+    def from_checkpoint_state(cls, mouse_meta, state, races):
+        """The mouse of leaderboard entry `mouse_meta` with the race history of a checkpoint_state."""
+        mouse = cls(**mouse_meta)
+        mouse.history = state['history']
+        for race in map(races.__getitem__, state['race_offsets'].tolist()):
+            mouse._file_race(race, race.winner_name == mouse.name)
+        mouse.populate_global_stats()
+        return mouse
+
+    def _max_race_age(self, time_delta):
         if time_delta is None:
-            max_race_age = datetime(year=2017, month=1, day=1)
-        else:
-            max_race_age = now - time_delta
+            return datetime(year=2017, month=1, day=1)
+        return self.all_races[-1]._event_starts_at - time_delta
 
-        wins_in_lane = losses_in_lane = 0
-        current_race_lane = self.all_races[-1].mice_names.index(self.name)
+    def _completed_since(self, max_race_age):
+        """Index of the first completed race that finished at or after max_race_age."""
+        return self.history.window_start(to_epoch_us(max_race_age))
 
-        for race in self.completed_races[::-1]:
-            if num_races == 0:
-                break
-            if race.completed_at >= max_race_age and race.winner_name is not None:
-                if race.mice_names.index(self.name) == current_race_lane:
-                    if race.winner_name == self.name:
-                        wins_in_lane += 1
-                    else:
-                        losses_in_lane += 1
-            num_races -= 1
+    @property
+    def current_lane(self):
+        return self.all_races[-1].lanes[self.name]
 
-        return (wins_in_lane, losses_in_lane)
+    def win_ratio_last_n_races(self, n):
+        return self.history.last_n_counts(n)
 
+    def lane_win_vs_other_lane_ratio(self, time_delta=None):
+        start = self._completed_since(self._max_race_age(time_delta))
+        return self.history.lane_win_ratios(start, self.current_lane)
 
-    def win_ratio_since(self, time_delta):
-        now = self.all_races[-1]._event_starts_at
-        max_race_age = now - time_delta
 
-        races_won, races_lost = 0, 0
 
-        for race in self.winning_races[::-1]:
-            if race.completed_at >= max_race_age:
-                races_won += 1
+    def current_lane_total_win_ratio(self, time_delta=None, num_races=99999999):
+        """In the current lane, what is the wins/total_races ratio?"""
+        start = self._completed_since(self._max_race_age(time_delta))
+        start = max(start, self.history.num_completed - num_races)
+        return self.history.lane_counts(start, self.current_lane)
+
 
-        for race in self.losing_races[::-1]:
-            if race.completed_at >= max_race_age:
-                races_lost += 1
+    def win_ratio_since(self, time_delta):
+        start = self._completed_since(self._max_race_age(time_delta))
+        races_won, races_lost = self.history.win_counts(start)
 
         if races_won == 0:
             return 0.0, races_won, races_lost
@@ -164,74 +163,21 @@ class Mouse:
         return ratio, races_won, races_lost
 
     def win_times_since(self, time_delta: timedelta):
-        now = self.all_races[-1]._event_starts_at
-        max_race_age = now - time_delta
-
-        times = []
-
-        while True:
-            for race in self.winning_races[::-1]:
-                if race.completed_at >= max_race_age:
-                    times.append(race.elapsed_time)
-            else:
-                if not len(times):
-                    max_race_age = (max_race_age - timedelta(hours=1))
-                else:
-                    break
-
-        stats = {
-            'min_t': min(times) if len(times) else None,
-            'max_t': max(times) if len(times) else None,
-            'mean_t': round(statistics.mean(times), 2) if len(times) else None,
-            'median_t': round(statistics.median(times), 2) if len(times) else None,
-        }
-
-        return stats
+        return self.history.win_time_stats(to_epoch_us(self._max_race_age(time_delta)))
 
     def repeat_wins(self, time_delta=None):
-        now = self.all_races[-1]._event_starts_at
         if time_delta is None:
-            max_race_age = datetime(year=2017, month=1, day=1)
-        else:
-            max_race_age = now - time_delta
-
-        curr_repeat_wins = 0
-        repeat_win_ctr = 0
-        repeat_win_counts = []
-        races_lost = 0
-
-        for ctr, race in enumerate(self.completed_races[::-1]):
-            if race.completed_at >= max_race_age and race.winner_name is not None:
-                if race.winner_name == self.name:
-                    repeat_win_ctr += 1
-                    if races_lost == 0:
-                        curr_repeat_wins += 1
-                # If mouse lost
-                else:
-                    # If mouse on a repeat win streak, reset repeat wins and add repeat win count to the list.
-                    if repeat_win_ctr > 0:
-                        repeat_win_counts.append(repeat_win_ctr)
-                        repeat_win_ctr = 0
-                    races_lost += 1
-        else:
-            if repeat_win_ctr > 0:
-                repeat_win_counts.append(repeat_win_ctr)
-
-        if not len(repeat_win_counts):
-            average_repeat_wins = 0.0
-            median_repeat_wins = 0.0
-            max_repeat_wins = 0.0
-        else:
-            average_repeat_wins = sum(repeat_win_counts) / float(len(repeat_win_counts))
-            median_repeat_wins = statistics.median(repeat_win_counts)
-            max_repeat_wins = max(repeat_win_counts)
+            curr_repeat_wins, average_repeat_wins, median_repeat_wins, max_repeat_wins = \
+                self.history.global_repeat_wins()
 
-        # Add global stats (all races) to the mouse
-        if time_delta is None:
+            # Add global stats (all races) to the mouse
             self.current_repeat_wins = curr_repeat_wins
             self.average_repeat_wins = average_repeat_wins
             self.median_repeat_wins = median_repeat_wins
             self.max_repeat_wins = max_repeat_wins
+        else:
+            start = self._completed_since(self._max_race_age(time_delta))
+            _, average_repeat_wins, median_repeat_wins, max_repeat_wins = self.history.repeat_wins(start)
 
         return {
             #'current_repeat_wins': self.current_repeat_wins,
@@ -240,24 +186,13 @@ class Mouse:
             'max_repeat_w': max_repeat_wins,
         }
 
+    def populate_global_stats(self):
+        """Refresh the all-time repeat win attributes (current/average/median/max) on the mouse."""
+        self.repeat_wins()
+
     def get_average_repeat_wins(self, time_delta):
         return self.repeat_wins(time_delta)['avg_repeat_w']
 
 
     def interval_stats(self, time_delta):
-        win_ratio, races_won, races_lost = self.win_ratio_since(time_delta)
-        wins_in_lane, losses_in_lane = self.current_lane_total_win_ratio(time_delta)
-        stats = {
-            'win_ratio': win_ratio,
-            'wins': races_won,
-            'losses': races_lost,
-            'wins_in_lane': wins_in_lane,
-            'losses_in_lane': losses_in_lane,
-            'average_repeat_wins': self.get_average_repeat_wins(time_delta),
-            'lane_win_ratio_vs_others': self.lane_win_vs_other_lane_ratio(time_delta),
-            **self.repeat_wins(time_delta),
-            **self.win_times_since(time_delta),
-        }
-
-        return stats
-
+        return self.history.interval_stats(self.all_races[-1]._event_starts_at, time_delta, self.current_lane)
@@ -0,0 +1,92 @@
+import os
+import json
+import time
+from collections import defaultdict
+from functools import wraps
+
+PROFILE_ENV_VAR = 'MICERACE_PROFILE'
+PROFILE_FILE = 'training_data/feature-profile.json'
+PREDICTION_PROFILE_FILE = 'prediction-profile.json'
+
+
+class FeatureProfiler:
+    """Call counts and wall time per feature family, in aggregate and per race.
+
+    Times are inclusive, so a family timed inside another (repeat_wins inside interval_stats) counts toward both.
+    Off unless enabled, in which case every @timed call costs one attribute check.
+    """
+
+    def __init__(self, enabled=False, keep_per_race=True):
+        self.enabled = enabled
+        self.keep_per_race = keep_per_race
+        self.reset()
+
+    def reset(self):
+        self.calls = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.races = []
+        self._race = None
+
+    def enable(self, keep_per_race=True):
+        self.enabled = True
+        self.keep_per_race = keep_per_race
+
+    def disable(self):
+        self.enabled = False
+        self._race = None
+
+    def begin_race(self, race_id):
+        """Attribute the following calls to `race_id` in the per-race breakdown."""
+        if self.enabled and self.keep_per_race:
+            self._race = {'race_id': race_id}
+            self.races.append(self._race)
+
+    def record(self, family, seconds):
+        self.calls[family] += 1
+        self.seconds[family] += seconds
+        if self._race is not None:
+            self._race[family] = self._race.get(family, 0.0) + seconds
+
+    def merge(self, report):
+        """Fold in another profiler's report(), e.g. from a build_training_data worker."""
+        for family, stats in report['aggregate'].items():
+            self.calls[family] += stats['calls']
+            self.seconds[family] += stats['total_s']
+        self.races.extend(report['races'])
+
+    def report(self):
+        num_races = len(self.races)
+        return {
+            'num_races': num_races,
+            'aggregate': {family: {
+                'calls': self.calls[family],
+                'total_s': self.seconds[family],
+                'mean_call_ms': 1000 * self.seconds[family] / self.calls[family],
+                'mean_race_ms': 1000 * self.seconds[family] / num_races if num_races else None,
+            } for family in sorted(self.seconds, key=self.seconds.get, reverse=True)},
+            'races': self.races,
+        }
+
+    def dump(self, path=PROFILE_FILE):
+        with open(path, 'w+') as outfile:
+            json.dump(self.report(), outfile, indent=2)
+        return path
+
+
+PROFILER = FeatureProfiler(enabled=bool(os.environ.get(PROFILE_ENV_VAR)))
+
+
+def timed(family):
+    """Time every call of the decorated function under `family` while PROFILER is enabled."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return fn(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                PROFILER.record(family, time.perf_counter() - started)
+        return wrapper
+    return decorator
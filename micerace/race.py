@@ -1,58 +1,131 @@
+import io
+import os
+import csv
 import sys
 import random
 import shutil
 import json
-from datetime import datetime
+import pickle
+import hashlib
+import tempfile
+from glob import glob
 from csv import DictWriter
 from collections import OrderedDict, defaultdict
 from datetime import timedelta
+from multiprocessing import Pool
 from lazy import lazy
 
 import numpy as np
-import pandas as pd
-from tensorflow.keras.models import load_model
 
 from micerace.mice import Mouse
+from micerace.history import LaneTally
+from micerace.ratings import RatingEngine
+from micerace.profiling import PROFILER, PROFILE_FILE, PREDICTION_PROFILE_FILE, timed
+from micerace.features import FeatureSchema, MISSING_VALUE
+from micerace.inference import load_predictor
+from micerace.feature_store import FeatureStoreWriter, FEATURE_DTYPE, DEFAULT_BLOCK_ROWS
+from micerace.feature_cache import FeatureCache, FEATURE_CACHE_FILE, race_inputs
 from micerace import util
 
 NUM_SKIP_INITIAL_RACES = 2000
+TRAINING_SHARDS_PER_WORKER = 4
+CHECKPOINT_DIR = 'checkpoints'
+CHECKPOINT_EVERY = 5000
+CHECKPOINT_VERSION = 8
+TRAINING_CSV = 'training_data/training-latest.csv'
+TRAINING_STORE_DIR = 'training_data/training-latest'
 
 
 class Race:
+    """One race. Slotted and without the raw event log (see `log`), since a full history holds a lot of them.
+
+    `mice_names` is a tuple in lane order, `mice_name_ids` the matching util.MouseNames values (-1 for names it
+    does not know) and `lanes` maps each name to its lane index.
+    """
+
+    __slots__ = (
+        'id', '__v', '_event_starts_at', 'staging_at', 'betting_opens_at', 'starts_at', 'completed_at', 'reset',
+        'cancelled', 'completed', 'pending', 'elapsed_time', 'mice_names', 'mice_name_ids', 'lanes', 'winner_name',
+        'winner_name_id', 'winner_position_ndx', 'runner_up_name',
+    )
+
+    # (attribute, API field) of every timestamp a race carries.
+    TIMESTAMP_FIELDS = (
+        ('_event_starts_at', 'eventStart'),
+        ('staging_at', 'staging'),
+        ('betting_opens_at', 'bettingOpens'),
+        ('starts_at', 'raceStarts'),
+        ('completed_at', 'raceComplete'),
+    )
+
     def __init__(self, **kwargs):
+        for attr, field in self.TIMESTAMP_FIELDS:
+            setattr(self, attr, util.format_timestamp(kwargs.get(field, None)))
+
+        if self.completed_at and self.starts_at:
+            delta = self.completed_at - self.starts_at
+            elapsed_time = delta.seconds + delta.microseconds/1000000
+        else:
+            elapsed_time = None
+        self._init_fields(kwargs, elapsed_time)
+
+    @classmethod
+    def from_dicts(cls, race_dicts):
+        """Build races from a list of API dicts, parsing each timestamp field as one column (util.parse_timestamps)
+        instead of one string at a time."""
+        race_dicts = list(race_dicts)
+        columns = {attr: util.parse_timestamps([race_meta.get(field, None) for race_meta in race_dicts])
+                   for attr, field in cls.TIMESTAMP_FIELDS}
+        elapsed_times = util.elapsed_seconds(columns['starts_at'], columns['completed_at'])
+        elapsed_times = [None if np.isnan(elapsed) else elapsed for elapsed in elapsed_times.tolist()]
+        # datetime64[us] -> datetime in bulk; NaT becomes None.
+        columns = {attr: column.astype(object).tolist() for attr, column in columns.items()}
+
+        races = []
+        for race_meta, timestamps, elapsed_time in zip(race_dicts, zip(*columns.values()), elapsed_times):
+            race = cls.__new__(cls)
+            for attr, timestamp in zip(columns, timestamps):
+                setattr(race, attr, timestamp)
+            race._init_fields(race_meta, elapsed_time)
+            races.append(race)
+        return races
+
+    def _init_fields(self, kwargs, elapsed_time):
         self.id = kwargs['_id']
-        self.log = kwargs['log']
         self.__v = kwargs['__v']
 
-        self._event_starts_at = util.format_timestamp(kwargs.get('eventStart', None))
-        self.staging_at = util.format_timestamp(kwargs.get('staging', None))
-        self.betting_opens_at = util.format_timestamp(kwargs.get('bettingOpens', None))
-        self.starts_at = util.format_timestamp(kwargs.get('raceStarts', None))
-
-        self.completed_at = util.format_timestamp(kwargs.get('raceComplete', None))
         self.reset = kwargs['raceIsReset']
         self.cancelled = kwargs['raceCancelled']
 
         self.completed = True if self.completed_at and not self.reset and not self.cancelled else False
-        if self.completed_at and self.starts_at:
-            delta = self.completed_at - self.starts_at
-            self.elapsed_time = delta.seconds + delta.microseconds/1000000
-        else:
-            self.elapsed_time = None
+        self.pending = not (self.completed or self.reset or self.cancelled)
+        self.elapsed_time = elapsed_time
 
-        self.mice_names = [name.lower().replace('-', '_') for name in kwargs['mice']]
+        self.mice_names = util.mouse_lineup(tuple(kwargs['mice']))
+        self.mice_name_ids = util.lineup_name_ids(self.mice_names)
+        self.lanes = util.lineup_lanes(self.mice_names)
         self.winner_name = kwargs.get('winnerName', None)
         if self.winner_name is not None:
-            self.winner_name = self.winner_name.lower().replace('-', '_')
-            self.winner_name_id = getattr(util.MouseNames, self.winner_name).value
-            self.winner_position_ndx = self.mice_names.index(self.winner_name)
+            self.winner_name = util.normalize_mouse_name(self.winner_name)
+            self.winner_name_id = util.mouse_name_id(self.winner_name)
+            self.winner_position_ndx = self.lanes[self.winner_name]
 
         self.runner_up_name = kwargs.get('runnerUpName', None)
         if isinstance(self.runner_up_name, str):
             self.runner_up_name = self.runner_up_name.lower()
-            if self.runner_up_name is 'null':
+            if self.runner_up_name == 'null':
                 self.runner_up_name = None
 
+    @property
+    def status(self):
+        """What a later copy of the race from the API can change."""
+        return self.pending, self.completed, self.reset, self.cancelled, self.winner_name
+
+    @property
+    def log(self):
+        """The race's raw event log, read from the race store when asked for; races do not keep it in memory."""
+        return util.get_race_log(self.id)
+
 
 class MouseKeeper(dict):
     def get(self, mouse_name, default=None) -> Mouse:
@@ -80,16 +153,88 @@ class MiceRaceSystem:
         # we must associate it to four different mice (Mouse objects).
         self.mice = MouseKeeper({mouse['name'].replace('-', '_'): Mouse(**mouse) for mouse in self.mice_metadata})
         self.races = []
+        self.race_ids = set()
+        self.lane_tally = LaneTally()
+        self.ratings = RatingEngine()
         http_races = util.get_all_races(use_cache=self.use_cache, num_refresh_pages=self.num_refresh_pages)
         http_races.reverse()
-        for race_meta in http_races[NUM_SKIP_INITIAL_RACES:]:
-            race = Race(**race_meta)
-            self.races.append(race)
+        for race in Race.from_dicts(http_races[NUM_SKIP_INITIAL_RACES:]):
+            self._add_race(race)
+
+    def _add_race(self, race):
+        self.races.append(race)
+        self.race_ids.add(race.id)
+        self.lane_tally.add_race(race)
+        self.ratings.add_race(race)
+        for lane, mouse_name in enumerate(race.mice_names):
+            if mouse_name not in self.mice:
+                self.dead_mice.add(mouse_name)
+            else:
+                self.mice[mouse_name].add_race(race, lane)
+
+    def ingest(self, race_dicts):
+        """Apply the races in `race_dicts` (raw API dicts, any order) to the system in place.
+
+        Unseen races are added, and a seen race whose status changed (pending to completed, reset or cancelled, or a
+        corrected result) replaces the stale copy. Races are kept in start order, so everything from the earliest
+        replaced race or late arrival on is taken back and re-added; for a poll of the newest races that is a
+        handful at the end. Returns the races that are new or updated.
+        """
+        known, unseen = [], []
+        for race_meta in race_dicts:
+            (known if race_meta['_id'] in self.race_ids else unseen).append(race_meta)
+        fresh = {race.id: race for race in Race.from_dicts(unseen)}
+        positions = self._tail_positions({race_meta['_id'] for race_meta in known})
+        for race in Race.from_dicts(known):
+            if race.status != self.races[positions[race.id]].status:
+                fresh[race.id] = race
+        if not fresh:
+            return []
+
+        rollback = min(positions[race.id] if race.id in positions else self._insert_position(race._event_starts_at)
+                       for race in fresh.values())
+        replay = [race for race in self._remove_races(rollback) if race.id not in fresh] + list(fresh.values())
+        replay.sort(key=lambda race: race._event_starts_at)
+        for race in replay:
+            self._add_race(race)
+        return [race for race in replay if race.id in fresh]
+
+    def _tail_positions(self, race_ids):
+        """{race id: index in self.races} for `race_ids`, searching back from the latest race."""
+        positions = {}
+        for ndx in range(len(self.races) - 1, -1, -1):
+            if len(positions) == len(race_ids):
+                break
+            if self.races[ndx].id in race_ids:
+                positions[self.races[ndx].id] = ndx
+        return positions
+
+    def _insert_position(self, event_starts_at):
+        ndx = len(self.races)
+        while ndx and self.races[ndx - 1]._event_starts_at > event_starts_at:
+            ndx -= 1
+        return ndx
+
+    def _remove_races(self, start):
+        """Take back self.races[start:] from the system, the mice, the lane tally and the ratings. Returns them."""
+        removed = self.races[start:]
+        del self.races[start:]
+        per_mouse = defaultdict(int)
+        for race in removed:
+            self.race_ids.discard(race.id)
             for mouse_name in race.mice_names:
-                if mouse_name not in self.mice:
-                    self.dead_mice.add(mouse_name)
-                else:
-                    self.mice[mouse_name].add_race(race)
+                per_mouse[mouse_name] += 1
+        for mouse_name, num_races in per_mouse.items():
+            if mouse_name in self.mice:
+                self.mice[mouse_name].remove_races(num_races)
+        self.lane_tally.truncate(len(self.lane_tally) - sum(map(LaneTally.counts_race, removed)))
+        self.ratings.truncate(start)
+        return removed
+
+    def poll(self, num_pages=1, fetcher=None):
+        """Fetch the newest `num_pages` pages of races (see util.refresh_latest_races) and ingest them. Returns the
+        races that are new or updated."""
+        return self.ingest(util.refresh_latest_races(num_pages, fetcher))
 
     @property
     def num_actual_races(self):
@@ -100,31 +245,135 @@ class MiceRaceSystem:
         return self.races[-1]
 
 
+def extend_history_digest(history_digest, race):
+    """The digest of a replayed history after `race` was added to it: chained over every race's id, status and
+    completion time, so a corrected, dropped or late race changes the digest of every history from it on."""
+    return hashlib.sha1(f'{history_digest}\n{race.id} {race.status} {race.completed_at}'.encode()).hexdigest()
+
+
 class HistoricalMiceRaceSystem:
-    def __init__(self, num_primer_races, **kwargs):
-        self.mice_metadata = util.get_mice_data()
+    def __init__(self, num_primer_races, mice_metadata=None, races=None,
+                 checkpoint_dir=None, checkpoint_every=None, **kwargs):
+        """Replays history up to `num_primer_races`.
+
+        `mice_metadata` and `races` (already filtered and sorted, e.g. another system's `_true_races`) skip the
+        HTTP fetch, so a copy of a system can be rebuilt at any race offset.
+
+        With `checkpoint_dir`, replay starts from the nearest checkpoint at or before `num_primer_races` instead of
+        race zero, and with `checkpoint_every` a checkpoint is saved there every that many races.
+        """
+        self.mice_metadata = util.get_mice_data() if mice_metadata is None else mice_metadata
         self.mice = MouseKeeper({mouse['name']: Mouse(**mouse) for mouse in self.mice_metadata})
         self.dead_mice = set()
-        self._true_races = [Race(**race_meta) for race_meta in
-                            util.get_all_races(use_cache=False, num_refresh_pages=100)]
-        self._true_races = [r for r in self._true_races if r.completed_at and r.winner_name and len(r.winner_name) and not any(mn for mn in r.mice_names if mn in self.dead_mice)]
-        self._true_races.sort(key=lambda r: r.completed_at)
+        if races is None:
+            self._true_races = self.replay_races(
+                Race.from_dicts(util.get_all_races(use_cache=False, num_refresh_pages=100)), self.dead_mice)
+        else:
+            self._true_races = races
 
         self.num_primer_races = num_primer_races
         self.current_race_offset = 0
         self.races = []
-
+        self.history_digest = ''
+        self.lane_tally = LaneTally()
+        self.ratings = RatingEngine()
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_every = checkpoint_every
+
+        if self.checkpoint_dir is not None:
+            self.restore_checkpoint(max_offset=self.num_primer_races)
         while self.current_race_offset < self.num_primer_races:
             self.ingest_new_race()
 
+    @staticmethod
+    def replay_races(races, dead_mice=()):
+        """The races a replay walks through: completed ones with a winner, in completion order."""
+        races = [r for r in races if r.completed_at and r.winner_name and len(r.winner_name) and not any(mn for mn in r.mice_names if mn in dead_mice)]
+        races.sort(key=lambda r: r.completed_at)
+        return races
+
     def ingest_new_race(self):
         self.races.append(self._true_races[self.current_race_offset])
         self.current_race_offset += 1
-        for mouse_name in self.races[-1].mice_names:
+        self.history_digest = extend_history_digest(self.history_digest, self.races[-1])
+        self.lane_tally.add_race(self.races[-1])
+        self.ratings.add_race(self.races[-1])
+        for lane, mouse_name in enumerate(self.races[-1].mice_names):
             if mouse_name not in self.mice:
                 self.dead_mice.add(mouse_name)
             else:
-                self.mice[mouse_name].add_race(self.races[-1])
+                self.mice[mouse_name].add_race(self.races[-1], lane)
+
+        if self.checkpoint_every and self.current_race_offset % self.checkpoint_every == 0:
+            self.save_checkpoint()
+
+    def _races_digest(self, history_digest):
+        """Fingerprint of a replayed history (its history_digest) and of the leaderboard's mice, so a checkpoint is
+        never applied to a different history or a different set of mice."""
+        return hashlib.sha1('\n'.join([*sorted(self.mice), history_digest]).encode()).hexdigest()
+
+    def _checkpoint_path(self, offset):
+        return os.path.join(self.checkpoint_dir, f'replay-{offset:08d}.pickle')
+
+    def save_checkpoint(self):
+        """Snapshot the replay state at the current race offset.
+
+        Races are not pickled: each mouse stores offsets into `_true_races` next to its columnar RaceHistory, so a
+        snapshot is small and loads with one pickle.load plus a list rebuild.
+
+        Sharded build workers replay the same races, so several processes may reach the same offset: each writes its
+        own temp file, and a checkpoint that already exists is left as it is.
+        """
+        path = self._checkpoint_path(self.current_race_offset)
+        if os.path.exists(path):
+            return
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        race_offsets = {id(race): ndx for ndx, race in enumerate(self.races)}
+        state = {
+            'version': CHECKPOINT_VERSION,
+            'current_race_offset': self.current_race_offset,
+            'history_digest': self.history_digest,
+            'races_digest': self._races_digest(self.history_digest),
+            'dead_mice': self.dead_mice,
+            'lane_tally': self.lane_tally,
+            'ratings': self.ratings,
+            'mice': {name: mouse.checkpoint_state(race_offsets) for name, mouse in self.mice.items()},
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.checkpoint_dir, prefix=os.path.basename(path) + '.', suffix='.tmp')
+        with os.fdopen(fd, 'wb') as outfile:
+            pickle.dump(state, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def restore_checkpoint(self, max_offset, min_offset=0):
+        """Load the latest valid checkpoint with min_offset <= offset <= max_offset. Returns whether one was loaded."""
+        offsets = sorted((int(os.path.basename(path)[len('replay-'):-len('.pickle')])
+                          for path in glob(os.path.join(self.checkpoint_dir, 'replay-*.pickle'))), reverse=True)
+        offsets = [offset for offset in offsets if min_offset <= offset <= min(max_offset, self.num_actual_races)]
+        # Digest of every prefix a checkpoint could cover, chained in one pass.
+        history_digests, history_digest = {}, ''
+        for offset, race in enumerate(self._true_races[:max(offsets, default=0)], 1):
+            history_digest = extend_history_digest(history_digest, race)
+            history_digests[offset] = history_digest
+        for offset in offsets:
+            with open(self._checkpoint_path(offset), 'rb') as infile:
+                state = pickle.load(infile)
+            if state['version'] != CHECKPOINT_VERSION or \
+                    state['races_digest'] != self._races_digest(history_digests.get(offset, '')):
+                continue
+
+            self.current_race_offset = offset
+            self.history_digest = state['history_digest']
+            self.races = self._true_races[:offset]
+            self.dead_mice = state['dead_mice']
+            self.lane_tally = state['lane_tally']
+            self.ratings = state['ratings']
+            # Leaderboard fields (site rating, ...) come from the current leaderboard, only the histories from the
+            # checkpoint.
+            self.mice = MouseKeeper({mouse['name']: Mouse.from_checkpoint_state(mouse, state['mice'][mouse['name']],
+                                                                                self.races)
+                                     for mouse in self.mice_metadata})
+            return True
+        return False
 
     @property
     def num_actual_races(self):
@@ -140,122 +389,241 @@ class StatsAgent:
                  use_cache=False,
                  num_refresh_pages=1,
                  training=False,
-                 num_primer_races=NUM_SKIP_INITIAL_RACES, **kwargs):
-
-        if training:
+                 num_primer_races=NUM_SKIP_INITIAL_RACES,
+                 system=None,
+                 model_path='models/model-latest.h5',
+                 feature_cache_path=None, **kwargs):
+
+        if system is not None:
+            self.system = system
+        elif training:
             self.system = HistoricalMiceRaceSystem(
-                use_cache=use_cache, num_refresh_pages=num_refresh_pages, num_primer_races=num_primer_races)
+                use_cache=use_cache, num_refresh_pages=num_refresh_pages, num_primer_races=num_primer_races, **kwargs)
         else:
             self.system = MiceRaceSystem(
                 use_cache=use_cache, num_refresh_pages=num_refresh_pages, target_mice_names=[], **kwargs)
 
         self.num_primer_races = num_primer_races
+        self.feature_cache_path = feature_cache_path
+        # Training writes every train_columns.txt column; prediction computes only what the model takes.
+        self.feature_schema = FeatureSchema.from_file() if training else FeatureSchema.for_model(model_path)
         #TODO: ADD BACK#self.model = load_model('models/model-latest.h5')
-        self.model = load_model('models/model-latest.h5')
+        # A .npz exported with inference.export_model runs on the NumPy runtime instead of TensorFlow.
+        self.model = load_predictor(model_path) if model_path is not None else None
+
+    def sorted_mice(self, race):
+        """The race's mice in mouse_0..mouse_3 order (highest site rating first), as in get_mice_stats."""
+        mice = [self.system.mice.get(mouse_name) for mouse_name in race.mice_names]
+        return sorted(mice, key=lambda mouse: mouse.site_rating, reverse=True)
+
+    def get_race_features(self):
+        """The train_columns.txt row for the latest race, as a float vector (missing values are NaN)."""
+        race = self.system.latest_race
+        PROFILER.begin_race(race.id)
+        lane_ratios = self.lane_win_ratios() if self.feature_schema.uses_lane_win_ratios else {}
+        race_ratings = self.system.ratings.latest() if self.feature_schema.uses_ratings else None
+        return self.feature_schema.row(race, self.sorted_mice(race), lane_ratios, race_ratings)
+
+    def predict_batch(self, rows):
+        """Class probabilities, one row per race, for a 2D block of feature rows (get_race_features rows or model
+        inputs, missing values NaN), in a single model call."""
+        rows = np.atleast_2d(np.asarray(rows, dtype=np.float32))
+        if rows.shape[1] != len(self.feature_schema.feature_columns):
+            rows = self.feature_schema.model_input(rows)
+        x_data = np.nan_to_num(rows, nan=MISSING_VALUE)
+        return self.model.predict(x_data[:, :, np.newaxis], verbose=0)
+
+    def predict_latest_race(self):
+        """Win probability per mouse name for the latest race (the model's classes are lane positions)."""
+        predict = self.predict_batch(self.get_race_features())
+        return dict(zip(self.system.latest_race.mice_names, [round(float(p), 2) for p in predict[0]]))
 
     def predict_current_race(self):
-        output_dict = OrderedDict()
-        race_stats = self.get_mice_stats(self.system.latest_race.mice_names)
-
-        now = datetime.utcnow()
-        output_dict['completed_at_year'] = getattr(self.system.latest_race.completed_at, 'year', now.year)
-        output_dict['completed_at_month'] = getattr(self.system.latest_race.completed_at, 'month', now.month)
-        output_dict['completed_at_day'] = getattr(self.system.latest_race.completed_at, 'day', now.day)
-        if hasattr(self.system.latest_race.completed_at, 'weekday'):
-            output_dict['completed_at_weekday'] = self.system.latest_race.completed_at.weekday()
-        else:
-            output_dict['completed_at_weekday'] = now.weekday()
-
-        output_dict['completed_at_hour'] = getattr(self.system.latest_race.completed_at, 'hour', now.hour)
-        output_dict['completed_at_minute'] = getattr(self.system.latest_race.completed_at, 'minute', now.minute)
-
-        for mouse_num, mouse_stats in enumerate(race_stats):
-            for k, v in mouse_stats.items():
-                output_dict[f"mouse_{mouse_num}_{k}"] = v
-
-        all_stats = [output_dict]
-        df = pd.DataFrame(all_stats).fillna(value=0)
-        names_1 =\
-            [list(df['mouse_0_name'])[0],
-             list(df['mouse_1_name'])[0],
-             list(df['mouse_2_name'])[0],
-             list(df['mouse_3_name'])[0]]
-
-        df = df.drop(
-            columns=['mouse_0_name',
-                     'mouse_1_name',
-                     'mouse_2_name',
-                     'mouse_3_name'])
-
-        race_stats_np_arr = df.to_numpy(dtype=float)
-        race_stats_np_arr = np.expand_dims(race_stats_np_arr, axis=2)
-
-        predict = self.model.predict(race_stats_np_arr, verbose=0)
-        print(dict(zip(self.system.latest_race.mice_names, [round(p, 2) for p in predict[0]]))))
+        print(self.predict_latest_race())
 
         if self.system.latest_race.completed:
             print(self.system.latest_race.winner_name, self.system.latest_race.winner_position_ndx)
 
 
-    def build_training_data(self):
-        csv_headers_written = False
+    def training_fieldnames(self):
+        return (['mice', 'winner_name', 'winner_position_ndx', 'race_id'] +
+                [f"mouse_{mouse_num}_name" for mouse_num in range(4)] +
+                self.feature_schema.columns)
 
-        shutil.copy('training_data/training-latest.csv', 'training_data/training-data-backup.csv')
-        with open(f'training_data/training-latest.csv', 'w+') as csv_out:
-            dw = DictWriter(csv_out, fieldnames=[])
-            all_stats = []
-            for ctr in range(self.num_primer_races, self.system.num_actual_races):
+    def training_rows(self, start, stop):
+        """Yield (race, mice, feature row) for race offsets [start, stop), ingesting each race as it goes.
+
+        With a `feature_cache_path`, rows already in the FeatureCache are read instead of computed, and new ones are
+        added to it.
+        """
+        cache, cached = None, {}
+        if self.feature_cache_path is not None:
+            cache = FeatureCache(self.feature_schema.columns, self.feature_cache_path)
+            cached = cache.get_many(race.id for race in self.system._true_races[max(start - 1, 0):stop])
+        try:
+            for ctr in range(start, stop):
                 if ctr % 100 == 0:
                     print(f'processed {ctr} races')
-                if not any(mn for mn in self.system.latest_race.mice_names if mn in self.system.dead_mice):
-                    output_dict = OrderedDict()
-                    race_stats = self.get_mice_stats(self.system.latest_race.mice_names)
-
-                    output_dict['mice'] = self.system.latest_race.mice_names
-                    output_dict['winner_name'] = self.system.latest_race.winner_name
-                    output_dict['winner_name_id'] = self.system.latest_race.winner_name_id
-                    output_dict['winner_position_ndx'] = self.system.latest_race.winner_position_ndx
-                    output_dict['race_id'] = self.system.latest_race.id
-
-                    output_dict['completed_at_year'] = self.system.latest_race.completed_at.year
-                    output_dict['completed_at_month'] = self.system.latest_race.completed_at.month
-                    output_dict['completed_at_day'] = self.system.latest_race.completed_at.day
-                    output_dict['completed_at_weekday'] = self.system.latest_race.completed_at.weekday()
-                    output_dict['completed_at_hour'] = self.system.latest_race.completed_at.hour
-                    output_dict['completed_at_minute'] = self.system.latest_race.completed_at.minute
-
-                    for mouse_num, mouse_stats in enumerate(race_stats):
-                        for k, v in mouse_stats.items():
-                            output_dict[f"mouse_{mouse_num}_{k}"] = v
-
-                    if not csv_headers_written:
-                        dw.fieldnames = list(output_dict.keys())
-                        dw.writeheader()
-                        dw.writerow(output_dict)
-                        csv_headers_written = True
-                        all_stats.append(output_dict)
-                    else:
-                        all_stats.append(output_dict)
-                        dw.writerow(output_dict)
+                race = self.system.latest_race
+                if not any(mn for mn in race.mice_names if mn in self.system.dead_mice):
+                    mice = self.sorted_mice(race)
+                    yield race, mice, self._training_row(race, mice, cache, cached.get(race.id))
 
                 self.system.ingest_new_race()
-
-    def lane_win_ratios(self):
-        races_by_lane = defaultdict(int)
-        for race in self.system.races:
-            if race.completed and race.winner_name is not None:
-                if race.mice_names.index(race.winner_name) == 0:
-                    races_by_lane['blue'] += 1
-                elif race.mice_names.index(race.winner_name) == 1:
-                    races_by_lane['red'] += 1
-                elif race.mice_names.index(race.winner_name) == 2:
-                    races_by_lane['green'] += 1
-                else:
-                    races_by_lane['yellow'] += 1
-
-        races_by_lane = {k: round(v/float(sum(races_by_lane.values())), 5) for k, v in races_by_lane.items()}
-        return races_by_lane
-
+        finally:
+            if cache is not None:
+                cache.close()
+
+    def _training_row(self, race, mice, cache, cached):
+        inputs = race_inputs(mice, self.system.history_digest) if cache is not None else None
+        if cached is not None and cached[0] == inputs:
+            return cached[1]
+        PROFILER.begin_race(race.id)
+        race_ratings = self.system.ratings.latest() if self.feature_schema.uses_ratings else None
+        race_features = self.feature_schema.row(race, mice, self.lane_win_ratios(), race_ratings)
+        if cache is not None:
+            cache.put(race.id, inputs, race_features)
+        return race_features
+
+    def write_training_rows(self, csv_out, start, stop):
+        """Write the CSV rows for race offsets [start, stop)."""
+        dw = DictWriter(csv_out, fieldnames=self.training_fieldnames())
+        for race, mice, race_features in self.training_rows(start, stop):
+            output_dict = OrderedDict()
+            output_dict['mice'] = list(race.mice_names)
+            output_dict['winner_name'] = race.winner_name
+            output_dict['winner_position_ndx'] = race.winner_position_ndx
+            output_dict['race_id'] = race.id
+            for mouse_num, mouse in enumerate(mice):
+                output_dict[f"mouse_{mouse_num}_name"] = mouse.name
+
+            for k, v in zip(self.feature_schema.columns, race_features.tolist()):
+                output_dict[k] = None if np.isnan(v) else v
+
+            dw.writerow(output_dict)
+
+    def training_blocks(self, start, stop, block_rows=DEFAULT_BLOCK_ROWS):
+        """Yield (features, labels, race_ids) arrays of up to `block_rows` rows for race offsets [start, stop).
+
+        Features are the schema's model inputs as float32 (missing values stay NaN), labels are winner_position_ndx.
+        """
+        features = np.empty((block_rows, len(self.feature_schema.feature_columns)), dtype=FEATURE_DTYPE)
+        labels, race_ids = [], []
+        for race, mice, race_features in self.training_rows(start, stop):
+            features[len(labels)] = self.feature_schema.model_input(race_features)
+            labels.append(race.winner_position_ndx)
+            race_ids.append(race.id)
+            if len(labels) == block_rows:
+                yield features.copy(), labels, race_ids
+                labels, race_ids = [], []
+        if labels:
+            yield features[:len(labels)].copy(), labels, race_ids
+
+    def build_training_data(self, num_workers=1, resume=False, output_format='csv'):
+        """Write training_data/training-latest.csv, or with `output_format` 'npy' the columnar store in
+        training_data/training-latest/ (see feature_store.FeatureStoreWriter).
+
+        With `num_workers` > 1 the race range is split into contiguous shards. Each worker rebuilds the system at
+        its shard's first race (from the nearest checkpoint, then a cheap replay) and returns the shard's rows;
+        shards are written back in race order, so the output is identical to a serial build.
+
+        With `resume`, an interrupted build is picked up from the latest checkpoint the existing output already covers.
+
+        With profiling on (profiling.PROFILER, or MICERACE_PROFILE=1), per-feature timings are dumped to PROFILE_FILE.
+        """
+        PROFILER.reset()
+        if output_format == 'csv':
+            csv_path = TRAINING_CSV
+            if resume:
+                self._resume_training_csv(csv_path)
+            else:
+                shutil.copy(csv_path, 'training_data/training-data-backup.csv')
+                with open(csv_path, 'w+') as csv_out:
+                    DictWriter(csv_out, fieldnames=self.training_fieldnames()).writeheader()
+            with open(csv_path, 'a') as csv_out:
+                self._write_training_output(csv_out.write, num_workers, output_format,
+                                            lambda start, stop: self.write_training_rows(csv_out, start, stop))
+        elif output_format == 'npy':
+            store = FeatureStoreWriter(TRAINING_STORE_DIR, self.feature_schema.feature_columns, append=resume)
+            if resume:
+                store.truncate(self._resume_point(store.race_ids()))
+
+            def write_blocks(blocks):
+                for block in blocks:
+                    store.write(*block)
+
+            self._write_training_output(write_blocks, num_workers, output_format,
+                                        lambda start, stop: write_blocks(self.training_blocks(start, stop)))
+            store.close()
+        else:
+            raise Exception(f"Unknown training data format {output_format}!")
+
+        if PROFILER.enabled:
+            print(f'feature timings written to {PROFILER.dump(PROFILE_FILE)}')
+
+    def _write_training_output(self, write_shard, num_workers, output_format, write_serial):
+        start, stop = self.system.current_race_offset, self.system.num_actual_races
+        if num_workers <= 1:
+            write_serial(start, stop)
+            return
+
+        num_shards = min(num_workers * TRAINING_SHARDS_PER_WORKER, max(stop - start, 1))
+        bounds = np.linspace(start, stop, num_shards + 1).astype(int).tolist()
+        shards = [(shard_start, shard_stop, output_format, self.feature_cache_path)
+                  for shard_start, shard_stop in zip(bounds[:-1], bounds[1:])]
+        initargs = (self.system.mice_metadata, self.system._true_races,
+                    self.system.checkpoint_dir, self.system.checkpoint_every, PROFILER.enabled)
+        with Pool(num_workers, initializer=_init_training_worker, initargs=initargs) as pool:
+            for shard_output, shard_profile in pool.imap(_build_training_shard, shards):
+                write_shard(shard_output)
+                if shard_profile is not None:
+                    PROFILER.merge(shard_profile)
+
+    def _resume_point(self, written_race_ids):
+        """Move the system to the latest checkpoint covered by the rows already written.
+
+        Returns how many of those rows to keep; the rest are rebuilt from the restored race on.
+        """
+        race_offsets = {race.id: ndx for ndx, race in enumerate(self.system._true_races)}
+        # Each row describes the race ingested just before it, so it was written at that race's offset + 1.
+        written_offsets = [race_offsets[race_id] + 1 for race_id in written_race_ids]
+
+        next_offset = written_offsets[-1] + 1 if written_offsets else self.system.current_race_offset
+        if self.system.checkpoint_dir is not None:
+            self.system.restore_checkpoint(max_offset=next_offset, min_offset=self.system.current_race_offset)
+
+        return sum(1 for offset in written_offsets if offset < self.system.current_race_offset)
+
+    def _resume_training_csv(self, csv_path):
+        """Resume from the CSV's complete rows and cut off the rest."""
+        race_id_ndx = self.training_fieldnames().index('race_id')
+
+        race_ids, row_ends = [], []
+        with open(csv_path, 'rb') as csv_in:
+            position = len(csv_in.readline())
+            header_end = position
+            for line in csv_in:
+                if not line.endswith(b'\n'):
+                    break
+                position += len(line)
+                race_ids.append(next(csv.reader([line[:1024].decode()]))[race_id_ndx])
+                row_ends.append(position)
+
+        kept = self._resume_point(race_ids)
+        with open(csv_path, 'r+b') as csv_out:
+            csv_out.truncate(row_ends[kept - 1] if kept else header_end)
+
+    @timed('lane_win_ratios')
+    def lane_win_ratios(self, num_races=None, time_delta=None):
+        """Share of wins per lane color over the system's decided races, optionally only the last `num_races` of
+        them and/or those completed within `time_delta` of the latest race's start."""
+        since_us = None
+        if time_delta is not None:
+            since_us = util.to_epoch_us(self.system.latest_race._event_starts_at - time_delta)
+        lane_tally = self.system.lane_tally
+        return lane_tally.ratios(lane_tally.window_start(num_races=num_races, since_us=since_us))
+
+    @timed('get_mice_stats')
     def get_mice_stats(self, target_mice_names=None):
         intervals = [
             ('1h', timedelta(hours=1)),
@@ -282,6 +650,7 @@ class StatsAgent:
         ]
         if target_mice_names is None:
             target_mice_names = self.system.mice.keys()
+        PROFILER.begin_race(self.system.latest_race.id)
 
         mice_stats = []
         for mouse_name in target_mice_names:
@@ -306,7 +675,6 @@ class StatsAgent:
                 **dict(zip(['35_race_wins', '35_race_loss'], mouse.win_ratio_last_n_races(35))),
                 **dict(zip(['50_race_wins', '50_race_loss'], mouse.win_ratio_last_n_races(50))),
                 **dict(zip(['75_race_wins', '75_race_loss'], mouse.win_ratio_last_n_races(75))),
-                **dict(zip(['75_race_wins', '75_race_loss'], mouse.win_ratio_last_n_races(75))),
                 **dict(zip(['100_race_wins', '100_race_loss'], mouse.win_ratio_last_n_races(100))),
                 **dict(zip(['125_race_wins', '125_race_loss'], mouse.win_ratio_last_n_races(125))),
                 **dict(zip(['150_race_wins', '150_race_loss'], mouse.win_ratio_last_n_races(150))),
@@ -349,15 +717,45 @@ def predict_current_race():
     stats_agent = StatsAgent(
         use_cache=True, training=False, num_refresh_pages=20, num_primer_races=NUM_SKIP_INITIAL_RACES)
     stats_agent.predict_current_race()
+    if PROFILER.enabled:
+        print(f"feature timings written to {PROFILER.dump(PREDICTION_PROFILE_FILE)}")
+
+
+def build_training_data(num_workers=1, resume=False, output_format='csv'):
+    stats_agent = StatsAgent(use_cache=True, training=True, num_primer_races=NUM_SKIP_INITIAL_RACES,
+                             checkpoint_dir=CHECKPOINT_DIR, checkpoint_every=CHECKPOINT_EVERY, model_path=None,
+                             feature_cache_path=FEATURE_CACHE_FILE)
+    stats_agent.build_training_data(num_workers=num_workers, resume=resume, output_format=output_format)
+
 
+_training_worker_kwargs = {}
 
-def build_training_data():
-    stats_agent = StatsAgent(use_cache=True, training=True, num_primer_races=NUM_SKIP_INITIAL_RACES)
-    stats_agent.build_training_data()
+
+def _init_training_worker(mice_metadata, races, checkpoint_dir, checkpoint_every, profile):
+    _training_worker_kwargs.update(mice_metadata=mice_metadata, races=races,
+                                   checkpoint_dir=checkpoint_dir, checkpoint_every=checkpoint_every)
+    if profile:
+        PROFILER.enable()
+
+
+def _build_training_shard(shard):
+    """(shard output, the shard's profiler report or None)."""
+    start, stop, output_format, feature_cache_path = shard
+    PROFILER.reset()
+    system = HistoricalMiceRaceSystem(num_primer_races=start, **_training_worker_kwargs)
+    stats_agent = StatsAgent(system=system, num_primer_races=start, model_path=None,
+                             feature_cache_path=feature_cache_path)
+    if output_format == 'npy':
+        output = list(stats_agent.training_blocks(start, stop))
+    else:
+        csv_out = io.StringIO()
+        stats_agent.write_training_rows(csv_out, start, stop)
+        output = csv_out.getvalue()
+    return output, PROFILER.report() if PROFILER.enabled else None
 
 
 def eyeball_current_race_stats():
-    stats_agent = StatsAgent(use_cache=True, training=False, num_primer_races=NUM_SKIP_INITIAL_RACES)
+    stats_agent = StatsAgent(use_cache=True, training=False, num_primer_races=NUM_SKIP_INITIAL_RACES, model_path=None)
     stats = stats_agent.get_mice_stats(stats_agent.system.races[0].mice_names)
     print(json.dumps(stats, indent=2))
     with open('latest-stats.json', 'w+') as outfile:
@@ -365,10 +763,7 @@ def eyeball_current_race_stats():
 
 
 if __name__ == '__main__':
-    if sys.argv[0] == 'predict':
-        predict_current_race()
-    elif sys.argv[1] == 'train':
-        build_training_data()
-    else:
-        eyeball_current_race_stats()
+    # Kept for `python -m micerace.race [predict|train]`; `python -m micerace --help` lists every command.
+    from micerace.__main__ import main
+    main(['build' if arg == 'train' else arg for arg in sys.argv[1:]] or ['stats'])
 
@@ -0,0 +1,137 @@
+import os
+import json
+import pickle
+import sqlite3
+
+RACE_STORE_FILE = 'pickles/races.sqlite3'
+LEGACY_PICKLE_FILE = 'pickles/races.pickle'
+BACKUP_DIR = 'pickles'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS races (
+    id TEXT PRIMARY KEY,
+    event_start TEXT,
+    version INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS races_event_start ON races (event_start);
+CREATE INDEX IF NOT EXISTS races_version ON races (version);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class RaceStore:
+    """Raw race dicts from the API, keyed by `_id`, in a SQLite file.
+
+    Writes only touch the races that are new or changed, and every write batch is stamped with a new version, so a
+    backup only has to copy the rows written since the previous one. Reads stream rows in `eventStart` order off
+    the index.
+    """
+
+    def __init__(self, path=RACE_STORE_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM races').fetchone()[0]
+
+    def _meta(self, key, default=0):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def _set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    @property
+    def version(self):
+        return self._meta('version')
+
+    def known_ids(self, race_ids):
+        """The subset of `race_ids` already in the store."""
+        race_ids = list(race_ids)
+        known = set()
+        for offset in range(0, len(race_ids), 500):
+            chunk = race_ids[offset:offset + 500]
+            known.update(row[0] for row in self.conn.execute(
+                f"SELECT id FROM races WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+        return known
+
+    def put_many(self, races):
+        """Insert new races and overwrite changed ones. Returns how many of `races` were already stored."""
+        races = list(races)
+        num_known = len(self.known_ids(race['_id'] for race in races))
+        with self.conn:
+            version = self.version + 1
+            changes_before = self.conn.total_changes
+            self.conn.executemany(
+                'INSERT INTO races (id, event_start, version, data) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (id) DO UPDATE SET event_start = excluded.event_start, version = excluded.version, '
+                'data = excluded.data WHERE races.data != excluded.data',
+                ((race['_id'], race.get('eventStart'), version, json.dumps(race, sort_keys=True)) for race in races))
+            if self.conn.total_changes > changes_before:
+                self._set_meta('version', version)
+        return num_known
+
+    def get(self, race_id):
+        row = self.conn.execute('SELECT data FROM races WHERE id = ?', (race_id,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def iter_races(self, reverse=False, since_version=0):
+        """Stream race dicts in `eventStart` order (newest first with `reverse`)."""
+        order = 'DESC' if reverse else 'ASC'
+        for (data,) in self.conn.execute(
+                f'SELECT data FROM races WHERE version > ? ORDER BY event_start {order}', (since_version,)):
+            yield json.loads(data)
+
+    def all_races(self, reverse=False):
+        return list(self.iter_races(reverse=reverse))
+
+    def import_pickle(self, pickle_path=LEGACY_PICKLE_FILE):
+        """One-time migration from the old {_id: race} pickle cache."""
+        with open(pickle_path, 'rb') as infile:
+            self.put_many(pickle.load(infile).values())
+
+    def backup(self, backup_dir=BACKUP_DIR):
+        """Write the races stored or changed since the last backup to a JSON-lines delta file named after the
+        versions it covers, `races-delta-<from>-<to>.jsonl`.
+
+        Replaying every delta in name order rebuilds the store. Returns the file's path, or None if nothing changed.
+        """
+        last_backup_version = self._meta('backup_version')
+        version = self.version
+        if version == last_backup_version:
+            return None
+
+        path = os.path.join(backup_dir, f'races-delta-{last_backup_version:08d}-{version:08d}.jsonl')
+        with open(path, 'x') as outfile:
+            for race in self.iter_races(since_version=last_backup_version):
+                outfile.write(json.dumps(race, sort_keys=True) + '\n')
+        with self.conn:
+            self._set_meta('backup_version', version)
+        return path
+
+    def restore_backup(self, path):
+        with open(path) as infile:
+            self.put_many(json.loads(line) for line in infile if line.strip())
+
+
+def open_race_store(path=RACE_STORE_FILE, legacy_pickle_path=LEGACY_PICKLE_FILE):
+    """Open the race store, migrating the old pickle cache into it the first time."""
+    is_new = not os.path.exists(path)
+    store = RaceStore(path)
+    if is_new and os.path.exists(legacy_pickle_path):
+        store.import_pickle(legacy_pickle_path)
+    return store
@@ -0,0 +1,63 @@
+import numpy as np
+
+from .history import Column, NUM_LANES
+from .util import calc_elo_win_prob
+
+INITIAL_RATING = 1500.0
+K_FACTOR = 24.0
+# Rating points per factor of 10 in the odds, as in chess Elo; calc_elo_win_prob works in units of this.
+ELO_SCALE = 400.0
+
+
+def win_probabilities(ratings):
+    """Each mouse's chance to win a race against the others, by multi-player Elo (see util.calc_elo_win_prob)."""
+    scaled = [rating / ELO_SCALE for rating in ratings]
+    return [calc_elo_win_prob(scaled[:ndx] + scaled[ndx + 1:], own) for ndx, own in enumerate(scaled)]
+
+
+class RatingEngine:
+    """Elo ratings of every mouse, updated in O(1) per race as races are added in order.
+
+    Each race keeps its mice's ratings and win probabilities from *before* the race, by lane, so the strength
+    feature of a race never knows its result or anything after it (unlike the leaderboard's current `rating`).
+    Races without a winner are recorded but move no ratings.
+    """
+
+    def __init__(self, k_factor=K_FACTOR, initial_rating=INITIAL_RATING):
+        self.k_factor = k_factor
+        self.initial_rating = initial_rating
+        self.ratings = {}
+        self.pre_race = Column(np.float64, width=NUM_LANES)
+        self.win_probs = Column(np.float64, width=NUM_LANES)
+        self._race_mice = []
+
+    def __len__(self):
+        return len(self._race_mice)
+
+    def rating(self, mouse_name):
+        return self.ratings.get(mouse_name, self.initial_rating)
+
+    def add_race(self, race):
+        mice_names = race.mice_names
+        pre_race = [self.rating(mouse_name) for mouse_name in mice_names]
+        probs = win_probabilities(pre_race)
+        self.pre_race.append(pre_race)
+        self.win_probs.append(probs)
+        self._race_mice.append(mice_names)
+        if race.completed and race.winner_name is not None:
+            for mouse_name, rating, prob in zip(mice_names, pre_race, probs):
+                self.ratings[mouse_name] = rating + self.k_factor * ((mouse_name == race.winner_name) - prob)
+
+    def truncate(self, num_races):
+        """Forget every race after the first `num_races`, restoring the ratings from before them."""
+        pre_race = self.pre_race.values
+        for ndx in range(len(self) - 1, num_races - 1, -1):
+            for mouse_name, rating in zip(self._race_mice[ndx], pre_race[ndx].tolist()):
+                self.ratings[mouse_name] = rating
+        del self._race_mice[num_races:]
+        self.pre_race.truncate(num_races)
+        self.win_probs.truncate(num_races)
+
+    def latest(self):
+        """Ratings and win probabilities of the latest race's mice from before it, as a (2, lanes) array."""
+        return np.stack([self.pre_race.last, self.win_probs.last])
@@ -0,0 +1,142 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from micerace.race import StatsAgent, NUM_SKIP_INITIAL_RACES
+from micerace import util
+from micerace.fetch import RaceFetcher
+from micerace.profiling import PROFILER
+from micerace.config import DEFAULT_HOST, DEFAULT_PORT, POLL_SECONDS
+
+NUM_POLL_PAGES = 1
+# A poll that takes longer than this gives up until the next one; predictions never wait on it.
+POLL_TIMEOUT_SECONDS = 5
+
+
+class PredictionService:
+    """Keeps a StatsAgent (model plus MiceRaceSystem) warm and re-predicts as soon as a new race shows up.
+
+    A background thread polls the newest page(s) of races and ingests only what changed, so by the time a client
+    asks, the prediction for the latest race is usually already cached. Pages are fetched outside the lock, so a slow
+    upstream only delays the next update, never a prediction.
+    """
+
+    def __init__(self, stats_agent, poll_seconds=POLL_SECONDS, num_poll_pages=NUM_POLL_PAGES):
+        self.stats_agent = stats_agent
+        self.poll_seconds = poll_seconds
+        self.num_poll_pages = num_poll_pages
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._fetcher = RaceFetcher(util.HISTORICAL_RACES_URL, concurrency=num_poll_pages,
+                                    timeout=POLL_TIMEOUT_SECONDS)
+        self._prediction = None
+        self._stop = threading.Event()
+        self._poller = None
+
+    @property
+    def system(self):
+        return self.stats_agent.system
+
+    def refresh(self):
+        """Fetch the newest races and ingest the new or updated ones. Returns how many there were.
+
+        Refreshes run one at a time, so an older fetch is never ingested after a newer one.
+        """
+        with self._fetch_lock:
+            race_dicts = util.refresh_latest_races(self.num_poll_pages, self._fetcher)
+            with self._lock:
+                new_races = self.system.ingest(race_dicts)
+                if new_races or self._prediction is None:
+                    self._prediction = self._predict()
+        return len(new_races)
+
+    def _predict(self):
+        started = time.perf_counter()
+        race = self.system.latest_race
+        probabilities = self.stats_agent.predict_latest_race()
+        return {
+            'race_id': race.id,
+            'betting_opens_at': race.betting_opens_at.isoformat() if race.betting_opens_at else None,
+            'pending': race.pending,
+            'probabilities': probabilities,
+            'predict_ms': round((time.perf_counter() - started) * 1000, 2),
+        }
+
+    def prediction(self, refresh=False):
+        if refresh:
+            self.refresh()
+        with self._lock:
+            if self._prediction is None:
+                self._prediction = self._predict()
+            return self._prediction
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                num_new = self.refresh()
+                if num_new:
+                    util.LOGGER.info(f"Ingested {num_new} races, latest {self.system.latest_race.id}")
+            except Exception:
+                util.LOGGER.exception('Polling for new races failed')
+
+    def start(self):
+        self._poller = threading.Thread(target=self._poll, name='race-poller', daemon=True)
+        self._poller.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._poller is not None:
+            self._poller.join()
+        self._fetcher.close()
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """GET /predict (add ?refresh=1 to poll first), GET /health and, with profiling on, GET /profile."""
+
+    service = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/predict':
+            body = self.service.prediction(refresh='refresh=1' in url.query)
+        elif url.path == '/profile':
+            body = PROFILER.report()
+        elif url.path == '/health':
+            body = {'num_races': self.service.system.num_actual_races,
+                    'latest_race_id': self.service.system.latest_race.id}
+        else:
+            self.send_error(404)
+            return
+
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        util.LOGGER.debug(format % args)
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, poll_seconds=POLL_SECONDS):
+    stats_agent = StatsAgent(
+        use_cache=True, training=False, num_refresh_pages=20, num_primer_races=NUM_SKIP_INITIAL_RACES)
+    service = PredictionService(stats_agent, poll_seconds=poll_seconds)
+    service.refresh()
+    service.start()
+
+    handler = type('Handler', (PredictionHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    util.LOGGER.info(f"Serving predictions on http://{host}:{port}/predict")
+    try:
+        server.serve_forever()
+    finally:
+        service.stop()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    serve()
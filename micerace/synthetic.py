@@ -0,0 +1,82 @@
+import random
+from datetime import datetime, timedelta
+
+from micerace.util import MouseNames, MouseColors
+
+DEFAULT_SEED = 0
+DEFAULT_START = datetime(2018, 1, 1)
+RESET_RATE = 0.01
+CANCEL_RATE = 0.01
+# Lane 0 (blue) wins a little more often, like the real track's lane bias.
+LANE_WEIGHTS = (1.15, 1.0, 0.95, 0.9)
+
+
+def _api_name(name):
+    """'papa_grey' -> 'Papa-Grey', the spelling the API used."""
+    return '-'.join(part.capitalize() for part in name.split('_'))
+
+
+def _api_timestamp(ts):
+    return ts.isoformat(timespec='milliseconds') + 'Z'
+
+
+def generate_leaderboard(num_mice=len(MouseNames), seed=DEFAULT_SEED):
+    """Leaderboard dicts shaped like util.get_mice_data's, for the first `num_mice` MouseNames."""
+    rnd = random.Random(seed)
+    colors = [color.name for color in MouseColors]
+    return [{
+        'name': mouse_name.name,
+        'family': str(rnd.randint(1, 9)),
+        'rating': rnd.randint(800, 1600),
+        'color': rnd.choice(colors),
+    } for mouse_name in list(MouseNames)[:num_mice]]
+
+
+def generate_races(num_races, leaderboard=None, seed=DEFAULT_SEED, start=DEFAULT_START, num_pending=1):
+    """`num_races` race dicts with the API's schema, oldest first, the same for the same arguments.
+
+    Winners are drawn from each mouse's rating times a lane bias; about RESET_RATE / CANCEL_RATE of the races are
+    reset / cancelled and the last `num_pending` races have not been run yet.
+    """
+    rnd = random.Random(seed)
+    leaderboard = generate_leaderboard(seed=seed) if leaderboard is None else leaderboard
+    names = [mouse['name'] for mouse in leaderboard]
+    strengths = {mouse['name']: mouse['rating'] / 1000.0 for mouse in leaderboard}
+
+    race_dicts = []
+    event_start = start
+    for race_num in range(num_races):
+        event_start += timedelta(seconds=rnd.randint(120, 600))
+        staging = event_start + timedelta(seconds=5)
+        betting_opens = staging + timedelta(seconds=10)
+        race_starts = betting_opens + timedelta(seconds=60)
+        mice = rnd.sample(names, 4)
+
+        outcome = rnd.random()
+        pending = race_num >= num_races - num_pending
+        reset = not pending and outcome < RESET_RATE
+        cancelled = not pending and RESET_RATE <= outcome < RESET_RATE + CANCEL_RATE
+        completed = not pending and not cancelled
+        weights = [strengths[name] * lane_weight for name, lane_weight in zip(mice, LANE_WEIGHTS)]
+        winner, runner_up = None, None
+        if completed and not reset:
+            winner = rnd.choices(mice, weights=weights)[0]
+            runner_up = rnd.choice([name for name in mice if name != winner])
+        race_complete = race_starts + timedelta(milliseconds=rnd.randint(8000, 20000)) if completed else None
+
+        race_dicts.append({
+            '_id': '%024x' % (seed * 10**9 + race_num),
+            'log': [],
+            '__v': 0,
+            'eventStart': _api_timestamp(event_start),
+            'staging': _api_timestamp(staging),
+            'bettingOpens': _api_timestamp(betting_opens),
+            'raceStarts': _api_timestamp(race_starts),
+            'raceComplete': _api_timestamp(race_complete) if race_complete else None,
+            'raceIsReset': reset,
+            'raceCancelled': cancelled,
+            'mice': [_api_name(name) for name in mice],
+            'winnerName': _api_name(winner) if winner else None,
+            'runnerUpName': _api_name(runner_up) if runner_up else None,
+        })
+    return race_dicts
@@ -1,48 +1,195 @@
 import os
-import shutil
-from datetime import datetime
-from random import shuffle
+import json
+import time
+import argparse
+import multiprocessing
 
 import numpy as np
-import pandas as pd
 from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import Dense, Dropout, Activation, Flatten, Embedding, SpatialDropout1D, LSTM, LeakyReLU
-from tensorflow.keras.layers import Conv1D, MaxPooling1D, MaxPooling2D
-from tensorflow.keras.utils import to_categorical
+from tensorflow.keras.layers import Dense, Dropout, Flatten, Conv1D, MaxPooling1D
+from tensorflow.keras.utils import to_categorical, Sequence
+from tensorflow.keras.callbacks import EarlyStopping
 from tensorflow.keras.optimizers import Adam
-from tensorflow.keras import optimizers
-from tensorflow.keras import regularizers
+
+from micerace.features import FeatureSchema, model_manifest_path, MISSING_VALUE
+from micerace.feature_store import FeatureStore, store_from_csv
 
 NUM_CLASSES = 4
+BATCH_SIZE = 40
+MAX_EPOCHS = 100
+PATIENCE = 5
+NUM_FOLDS = 4
+# The first fold trains on at least this share of the races.
+MIN_TRAIN_FRACTION = 0.5
+TRAINING_CSV = 'training_data/training-latest.csv'
+TRAINING_STORE_DIR = 'training_data/training-latest'
+MODEL_PATH = 'models/model-latest.h5'
+
+
+class TrainingBatches(Sequence):
+    """Batches of (features, one-hot winner) gathered from the memory-mapped feature store by row index.
+
+    Only the index array is shuffled (once per epoch), so peak memory is one batch of float32 rows however large the
+    store is.
+    """
+
+    def __init__(self, store, labels, indices, batch_size=BATCH_SIZE, shuffle=True):
+        super().__init__()
+        self.store = store
+        self.labels = labels
+        self.indices = np.array(indices, dtype=np.int64)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(np.ceil(len(self.indices) / self.batch_size))
+
+    def __getitem__(self, batch_num):
+        batch = self.indices[batch_num * self.batch_size:(batch_num + 1) * self.batch_size]
+        x_data = self.store.take(batch)
+        x_data[np.isnan(x_data)] = MISSING_VALUE
+        y_data = to_categorical(self.labels[batch], num_classes=NUM_CLASSES)
+        return np.expand_dims(x_data, axis=2), y_data
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.indices)
+
+
+# Hyperparameter candidates for build_model; the first is the original architecture.
+CANDIDATES = [
+    {'filters': 64, 'kernel_size': 3, 'dense_units': 100, 'dropout': 0.5, 'learning_rate': 1e-3},
+    {'filters': 32, 'kernel_size': 3, 'dense_units': 100, 'dropout': 0.5, 'learning_rate': 1e-3},
+    {'filters': 64, 'kernel_size': 5, 'dense_units': 50, 'dropout': 0.5, 'learning_rate': 1e-3},
+    {'filters': 64, 'kernel_size': 3, 'dense_units': 100, 'dropout': 0.3, 'learning_rate': 3e-4},
+]
+
+
+def build_model(num_features, filters=64, kernel_size=3, dense_units=100, dropout=0.5, learning_rate=1e-3):
+    model = Sequential()
+    model.add(Conv1D(filters=filters, kernel_size=kernel_size, activation='relu', input_shape=(num_features, 1)))
+    model.add(Conv1D(filters=filters, kernel_size=kernel_size, activation='relu'))
+    model.add(Dropout(dropout))
+    model.add(MaxPooling1D(pool_size=2))
+    model.add(Flatten())
+    model.add(Dense(dense_units, activation='relu'))
+    model.add(Dense(NUM_CLASSES, activation='softmax'))
+    model.compile(loss='categorical_crossentropy', optimizer=Adam(learning_rate=learning_rate), metrics=['accuracy'])
+    return model
+
+
+def open_store():
+    if os.path.exists(os.path.join(TRAINING_STORE_DIR, 'manifest.json')):
+        return FeatureStore(TRAINING_STORE_DIR)
+    return store_from_csv(TRAINING_CSV, TRAINING_STORE_DIR, FeatureSchema.from_file().feature_columns)
+
+
+def walk_forward_folds(num_rows, num_folds=NUM_FOLDS, min_train_fraction=MIN_TRAIN_FRACTION):
+    """(train rows, validation rows) per fold. Rows are in race order, so every fold trains on the races before its
+    validation block and never sees a later one; the training window grows by one block per fold."""
+    bounds = np.linspace(int(num_rows * min_train_fraction), num_rows, num_folds + 1).astype(int)
+    return [(np.arange(0, start), np.arange(start, stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def fit(store, labels, train_rows, validation_rows, params, max_epochs=MAX_EPOCHS, patience=PATIENCE):
+    """Train a build_model(**params) until the validation loss stops improving; the best epoch's weights are kept."""
+    model = build_model(len(store.columns), **params)
+    history = model.fit(TrainingBatches(store, labels, train_rows),
+                        validation_data=TrainingBatches(store, labels, validation_rows, shuffle=False),
+                        epochs=max_epochs, verbose=0,
+                        callbacks=[EarlyStopping(monitor='val_loss', patience=patience, restore_best_weights=True)])
+    best_epoch = int(np.argmin(history.history['val_loss']))
+    return model, {
+        'epochs': len(history.history['val_loss']),
+        'best_epoch': best_epoch + 1,
+        'val_loss': float(history.history['val_loss'][best_epoch]),
+        'val_accuracy': float(history.history['val_accuracy'][best_epoch]),
+    }
+
+
+def _init_fold_worker(num_threads):
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def _run_fold(task):
+    """Metrics of one (candidate, fold) pair; the worker maps the feature store itself instead of receiving it."""
+    candidate_num, params, fold_num, train_rows, validation_rows = task
+    started = time.perf_counter()
+    store = FeatureStore(TRAINING_STORE_DIR)
+    _, metrics = fit(store, store.labels(), train_rows, validation_rows, params)
+    return {'candidate': candidate_num, 'fold': fold_num, 'train_rows': len(train_rows),
+            'validation_rows': len(validation_rows), **metrics, 'seconds': time.perf_counter() - started}
+
+
+def cross_validate(num_rows, candidates=CANDIDATES, num_folds=NUM_FOLDS, num_workers=1):
+    """Walk-forward metrics for every candidate and fold, trained `num_workers` at a time.
+
+    Workers are spawned rather than forked (TensorFlow does not survive a fork) and split the cores between them.
+    """
+    folds = walk_forward_folds(num_rows, num_folds)
+    tasks = [(candidate_num, params, fold_num, train_rows, validation_rows)
+             for candidate_num, params in enumerate(candidates)
+             for fold_num, (train_rows, validation_rows) in enumerate(folds)]
+    num_threads = max(1, (os.cpu_count() or 1) // max(num_workers, 1))
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(max(num_workers, 1), initializer=_init_fold_worker, initargs=(num_threads,)) as pool:
+        return pool.map(_run_fold, tasks, chunksize=1)
+
+
+def metrics_table(results, candidates):
+    """One line per (candidate, fold), then each candidate's mean over the folds, best first."""
+    lines = [f"{'cand':>4s} {'fold':>4s} {'train':>8s} {'valid':>7s} {'epochs':>6s} {'best':>4s} "
+             f"{'val_loss':>9s} {'val_acc':>8s} {'secs':>7s}"]
+    for r in sorted(results, key=lambda r: (r['candidate'], r['fold'])):
+        lines.append(f"{r['candidate']:4d} {r['fold']:4d} {r['train_rows']:8d} {r['validation_rows']:7d} "
+                     f"{r['epochs']:6d} {r['best_epoch']:4d} {r['val_loss']:9.4f} {r['val_accuracy']:8.4f} "
+                     f"{r['seconds']:7.1f}")
+    lines.append('')
+    for candidate_num, val_loss, val_accuracy in summarize(results):
+        lines.append(f'candidate {candidate_num}: mean val_loss {val_loss:.4f}, mean val_acc {val_accuracy:.4f}, '
+                     f'{candidates[candidate_num]}')
+    return lines
+
+
+def summarize(results):
+    """(candidate, mean validation loss, mean validation accuracy), lowest loss first."""
+    by_candidate = {}
+    for r in results:
+        by_candidate.setdefault(r['candidate'], []).append(r)
+    return sorted(((candidate_num, float(np.mean([r['val_loss'] for r in rs])),
+                    float(np.mean([r['val_accuracy'] for r in rs])))
+                   for candidate_num, rs in by_candidate.items()), key=lambda summary: summary[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Select and train the race model with walk-forward validation.')
+    parser.add_argument('--workers', type=int, default=1, help='folds trained at once')
+    parser.add_argument('--folds', type=int, default=NUM_FOLDS)
+    parser.add_argument('--candidates', type=int, default=len(CANDIDATES), help='try only the first N candidates')
+    args = parser.parse_args()
+
+    store = open_store()
+    labels = store.labels()
+    candidates = CANDIDATES[:args.candidates]
+    results = cross_validate(len(store), candidates, num_folds=args.folds, num_workers=args.workers)
+    for line in metrics_table(results, candidates):
+        print(line)
+
+    # The final model trains on everything but the newest fold, which it early-stops on.
+    best_params = candidates[summarize(results)[0][0]]
+    train_rows, validation_rows = walk_forward_folds(len(store), args.folds)[-1]
+    model, metrics = fit(store, labels, train_rows, validation_rows, best_params)
+    print(f'final model: {best_params} {metrics}')
+
+    # The manifest lets StatsAgent compute just the columns this model takes.
+    os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
+    model.save(MODEL_PATH)
+    with open(model_manifest_path(MODEL_PATH), 'w+') as outfile:
+        json.dump({'columns': store.columns}, outfile)
+
 
-df = pd.read_csv('training_data/training-latest.csv')
-winners = df['winner_position_ndx']
-
-clean_df = df.drop(
-    columns=['winner_position_ndx',
-             'mice',
-             'winner_name',
-             'winner_name_id',
-             'race_id',
-             'mouse_0_name',
-             'mouse_1_name',
-             'mouse_2_name',
-             'mouse_3_name'])
-
-clean_df = clean_df.fillna(value=-1).sample(frac=1).sample(frac=1)
-
-x_data = clean_df.to_numpy(dtype=float)
-x_data = np.expand_dims(x_data, axis=2)
-y_data = winners.to_numpy(dtype=int)
-y_data = to_categorical(y_data, num_classes=4)
-
-model = Sequential()
-model.add(Conv1D(filters=64, kernel_size=3, activation='relu', input_shape=x_data.shape[1:]))
-model.add(Conv1D(filters=64, kernel_size=3, activation='relu'))
-model.add(Dropout(0.5))
-model.add(MaxPooling1D(pool_size=2))
-model.add(Flatten())
-model.add(Dense(100, activation='relu'))
-model.add(Dense(NUM_CLASSES, activation='softmax'))
-model.compile(loss='categorical_crossentropy', optimizer='adam', metrics=['accuracy'])
-model.fit(x_data, y_data, batch_size=40, epochs=100, validation_split=0.2, shuffle=True)
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,20 @@
 import os
-import pickle
 import json
 import sys
+import asyncio
 import logging
-import math
 from enum import Enum
-from datetime import datetime
-from multiprocessing import Pool
+from functools import lru_cache
+from datetime import datetime, timedelta
 from random import randint
 
+import numpy as np
 from retry import retry
 import requests
 
+from .race_store import open_race_store
+from .fetch import RaceFetcher, fetch_all_races, fetch_new_races
+
 
 _handler = logging.StreamHandler(stream=sys.stdout)
 _handler.setLevel(logging.DEBUG)
@@ -22,16 +25,42 @@ BASE_URL = 'https://micerace.com'
 HISTORICAL_RACES_URL = os.path.join(BASE_URL, 'games', 'allgames')
 RACE_URL = os.path.join(BASE_URL, 'race')
 LEADERBOARD_URL = os.path.join(RACE_URL, 'leaders')
-NUM_HTTP_WORKERS = 3
-
-
-class NoMoreRacesException(Exception):
-    pass
+NUM_HTTP_WORKERS = 8
+EPOCH = datetime(1970, 1, 1)
 
 
 def format_timestamp(ts):
     if ts is not None:
-        return datetime.strptime(ts[:-1] + '000', '%Y-%m-%dT%H:%M:%S.%f')
+        try:
+            return datetime.fromisoformat(ts[:-1])
+        except ValueError:
+            return datetime.strptime(ts[:-1] + '000', '%Y-%m-%dT%H:%M:%S.%f')
+
+
+def parse_timestamps(timestamps):
+    """Parse API timestamps ('2019-03-01T12:34:56.789Z' or None) into one datetime64[us] array, None as NaT.
+
+    NumPy parses the whole column at once; if any value is not plain ISO 8601, falls back to format_timestamp.
+    """
+    try:
+        return np.array([ts[:-1] if ts is not None else 'NaT' for ts in timestamps], dtype='datetime64[us]')
+    except ValueError:
+        return np.array([format_timestamp(ts) if ts is not None else 'NaT' for ts in timestamps],
+                        dtype='datetime64[us]')
+
+
+def elapsed_seconds(starts_at, completed_at):
+    """Element-wise Race.elapsed_time for datetime64[us] columns: timedelta.seconds plus its microseconds as a
+    fraction, NaN where either end is missing."""
+    delta_us = (completed_at - starts_at).astype(np.int64)
+    remainder_us = np.mod(delta_us, 86400 * 10**6)
+    elapsed = remainder_us // 10**6 + (remainder_us % 10**6) / 1000000
+    return np.where(np.isnat(starts_at) | np.isnat(completed_at), np.nan, elapsed)
+
+
+def to_epoch_us(ts):
+    """Microseconds since the epoch for a naive (UTC) datetime."""
+    return (ts - EPOCH) // timedelta(microseconds=1)
 
 
 class MouseColors(Enum):
@@ -86,66 +115,81 @@ class MouseNames(Enum):
     squeak = 36
 
 
-def calc_elo_win_prob(opponent_elos, winner_elo):
-    numerator = 0
-    for elo in opponent_elos:
-        numerator += 1/(1 + 10**(elo - winner_elo))
-    denominator = ((len(opponent_elos)+1)*(len(opponent_elos)))/2)
-    return numerator/denominator
+MOUSE_NAME_IDS = {mouse_name.name: mouse_name.value for mouse_name in MouseNames}
 
 
-@retry(requests.RequestException, tries=3, delay=1, backoff=1, jitter=1)
-def get_all_races(use_cache, num_refresh_pages=5):
-    all_races = {}
-    # Get the total number of races the site contains.
-    latest_races, num_total_races, _ = _get_historical_races_by_page(1)
+@lru_cache(maxsize=None)
+def normalize_mouse_name(name):
+    """'Papa-Grey' -> 'papa_grey', the spelling used for MouseNames members and Mouse.name."""
+    return sys.intern(name.lower().replace('-', '_'))
 
-    # Get the number of races contained in a page.
-    page_size = len(latest_races)
 
-    # Derive the number of pages of data:
-    num_pages = int(math.ceil((num_total_races / page_size)))
+def mouse_name_id(name):
+    return MOUSE_NAME_IDS[name]
 
-    num_races_seen = 0
-    if use_cache:
-        all_races = pickle.load(open('pickles/races.pickle', 'rb'))
-        for page_num in range(num_refresh_pages):
-            races, _, _ = _get_historical_races_by_page(page_num)
-            for race in races:
 
-                if race['_id'] in all_races:
-                    num_races_seen += 1
-                all_races.update({race['_id']: race})
+# Races share a handful of lineups, so the per-lineup tuples and lookups below are built once and shared.
+@lru_cache(maxsize=None)
+def mouse_lineup(raw_names):
+    return tuple(normalize_mouse_name(name) for name in raw_names)
 
-            if num_races_seen >= page_size:
-                break
 
-    else:
-        # For each page, collect the race data from the HTTP endpoint:
-        for races, _, page_num in Pool(NUM_HTTP_WORKERS).imap(_get_historical_races_by_page, range(1, num_pages+1)):
-            for race in races:
-                all_races.update({race['_id']: race})
+@lru_cache(maxsize=None)
+def lineup_name_ids(mice_names):
+    return tuple(MOUSE_NAME_IDS.get(name, -1) for name in mice_names)
 
-    # Keep a backup ~5% of the time.
-    if randint(1, 20) == 5:
-        with open('pickles/races-{}.pickle'.format(datetime.strftime(datetime.utcnow(), '%Y-%m-%d-%H-%M-%S')), 'wb+') as outfile:
-            pickle.dump(all_races, outfile)
 
-    with open('pickles/races.pickle', 'wb+') as outfile:
-        pickle.dump(all_races, outfile)
+@lru_cache(maxsize=None)
+def lineup_lanes(mice_names):
+    return {name: lane for lane, name in enumerate(mice_names)}
 
-    return sorted(all_races.values(), key=lambda r: r['eventStart'], reverse=True)
 
+def get_race_log(race_id):
+    """The raw event log of a stored race (None if the race is not in the store)."""
+    with open_race_store() as race_store:
+        race = race_store.get(race_id)
+    return None if race is None else race.get('log')
 
-@retry(requests.RequestException, tries=3, delay=1, backoff=1, jitter=1)
-def _get_historical_races_by_page(page_num):
-    LOGGER.info("Request historical races via page {}".format(page_num))
-    resp = requests.get(HISTORICAL_RACES_URL, params={'pageIndex': page_num})
-    data = json.loads(resp.content.decode('utf-8'))
-    if not len(data):
-        e = NoMoreRacesException('Cannot find any races on page {}'.format(page_num))
-        LOGGER.exception('No races returned', exc_info=e)
-    return data['games'], data['total'], page_num
+
+def calc_elo_win_prob(opponent_elos, winner_elo):
+    numerator = 0
+    for elo in opponent_elos:
+        numerator += 1/(1 + 10**(elo - winner_elo))
+    denominator = ((len(opponent_elos)+1)*(len(opponent_elos)))/2
+    return numerator/denominator
+
+
+def get_all_races(use_cache, num_refresh_pages=5, url=HISTORICAL_RACES_URL):
+    """Refresh the race store from the site and return every stored race, newest first.
+
+    With `use_cache`, only the newest pages are fetched, down to the first page whose races are all stored already
+    and at most `num_refresh_pages` of them; otherwise every page is fetched.
+    """
+    with open_race_store() as race_store:
+        if use_cache:
+            races = fetch_new_races(url, race_store.known_ids, max_pages=num_refresh_pages,
+                                    concurrency=NUM_HTTP_WORKERS)
+        else:
+            races = fetch_all_races(url, concurrency=NUM_HTTP_WORKERS)
+        race_store.put_many(races)
+
+        # Keep a backup ~5% of the time; it only holds the races stored since the previous one.
+        if randint(1, 20) == 5:
+            race_store.backup()
+
+        return race_store.all_races(reverse=True)
+
+
+def refresh_latest_races(num_pages=1, fetcher=None):
+    """The races of the newest `num_pages` pages, fetched with `fetcher` (a RaceFetcher, a new one by default) and
+    written to the race store."""
+    if fetcher is None:
+        with RaceFetcher(HISTORICAL_RACES_URL, concurrency=NUM_HTTP_WORKERS) as fetcher:
+            return refresh_latest_races(num_pages, fetcher)
+    races = asyncio.run(fetcher.fetch_pages(range(1, num_pages + 1)))
+    with open_race_store() as race_store:
+        race_store.put_many(races)
+    return races
 
 
 @retry(requests.RequestException, tries=3, delay=1, backoff=1, jitter=1)
@@ -0,0 +1,26 @@
+import pytest
+
+from micerace.race import HistoricalMiceRaceSystem, Race
+from micerace.synthetic import generate_leaderboard, generate_races
+
+NUM_SYNTHETIC_RACES = 800
+
+
+@pytest.fixture(scope='session')
+def leaderboard():
+    return generate_leaderboard()
+
+
+@pytest.fixture(scope='session')
+def true_races(leaderboard):
+    """A synthetic history as HistoricalMiceRaceSystem replays it: decided races in completion order."""
+    return HistoricalMiceRaceSystem.replay_races(Race.from_dicts(generate_races(NUM_SYNTHETIC_RACES, leaderboard)))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """A fresh working directory with the relative directories the build and the race store write to."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'training_data').mkdir()
+    (tmp_path / 'pickles').mkdir()
+    return tmp_path
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from micerace.backtest import RaceBets, simulate, strategy_grid, sweep
+
+
+def naive_simulate(probabilities, winners, odds, stake='flat', stake_size=1.0, kelly_fraction=0.5, min_prob=0.0,
+                   min_edge=0.0, bankroll=100.0):
+    """The strategy as a plain loop over the races."""
+    start = bankroll
+    path, num_bets, num_won, total_staked, broke = [], 0, 0, 0.0, False
+    for probs, winner, race_odds in zip(probabilities, winners, odds):
+        edges = [p * o - 1 for p, o in zip(probs, race_odds)]
+        lane = max(range(4), key=lambda ndx: (edges[ndx], -ndx))
+        prob, lane_odds, edge = probs[lane], race_odds[lane], edges[lane]
+        if prob >= min_prob and edge >= min_edge and not broke:
+            if stake == 'flat':
+                if bankroll < stake_size:
+                    broke = True
+                    path.append(bankroll)
+                    continue
+                amount = stake_size
+            else:
+                kelly = min(max(edge / max(lane_odds - 1, 1e-12), 0), 1)
+                amount = min(kelly * kelly_fraction, 1) * bankroll
+            num_bets += 1
+            total_staked += amount
+            if lane == winner:
+                num_won += 1
+                bankroll += amount * (lane_odds - 1)
+            else:
+                bankroll -= amount
+        path.append(bankroll)
+
+    peak, max_drawdown = start, 0.0
+    for value in [start] + path:
+        peak = max(peak, value)
+        max_drawdown = max(max_drawdown, 1 - value / peak)
+    return {
+        'final_bankroll': bankroll,
+        'profit': bankroll - start,
+        'roi': (bankroll - start) / total_staked if total_staked else 0.0,
+        'num_bets': num_bets,
+        'hit_rate': num_won / num_bets if num_bets else 0.0,
+        'total_staked': total_staked,
+        'max_drawdown': max_drawdown,
+    }
+
+
+@pytest.fixture(scope='module')
+def history():
+    rnd = np.random.default_rng(0)
+    num_races = 400
+    probabilities = rnd.dirichlet([2, 2, 2, 2], num_races)
+    winners = np.array([rnd.choice(4, p=probs) for probs in probabilities])
+    winners[rnd.random(num_races) < 0.02] = -1
+    odds = rnd.uniform(2.5, 6, (num_races, 4))
+    return probabilities, winners, odds
+
+
+STRATEGIES = strategy_grid(stake=['flat', 'kelly'], min_edge=[0.0, 0.2], min_prob=[0.0, 0.3]) + [
+    {'stake': 'flat', 'stake_size': 7.0, 'bankroll': 20.0},
+    {'stake': 'kelly', 'kelly_fraction': 3.0, 'bankroll': 10.0},
+]
+
+
+@pytest.mark.parametrize('strategy', STRATEGIES)
+@pytest.mark.parametrize('losing', [False, True])
+def test_simulate_matches_naive_loop(history, strategy, losing):
+    probabilities, winners, odds = history
+    if losing:
+        # Every bet loses, so flat staking runs out of money part of the way through.
+        winners = np.full(len(winners), -1)
+    result = simulate(RaceBets(probabilities, winners, odds), curve=True, **strategy)
+    expected = naive_simulate(probabilities, winners, odds, **strategy)
+    curve = result.pop('bankroll_curve')
+    assert result == pytest.approx(expected, rel=1e-9, abs=1e-9)
+    assert len(curve) == len(probabilities) and curve[-1] == pytest.approx(expected['final_bankroll'])
+
+
+def test_flat_bets_stop_when_broke(history):
+    probabilities, _, odds = history
+    result = simulate(RaceBets(probabilities, np.full(len(probabilities), -1), odds), stake_size=7.0, bankroll=20.0,
+                      curve=True)
+    assert result['num_bets'] == 2
+    assert result['final_bankroll'] == 6.0
+    assert (result['bankroll_curve'][1:] == 6.0).all()
+
+
+def test_sweep_in_workers_matches_serial(history):
+    probabilities, winners, odds = history
+    serial = sweep(probabilities, winners, STRATEGIES, odds=odds)
+    assert sweep(probabilities, winners, STRATEGIES, odds=odds, num_workers=2) == serial
+    assert [result['final_bankroll'] for result in serial] == \
+        sorted((result['final_bankroll'] for result in serial), reverse=True)
+
+
+def test_unknown_stake_method_fails(history):
+    with pytest.raises(Exception, match='Unknown stake method'):
+        simulate(RaceBets(*history), stake='martingale')
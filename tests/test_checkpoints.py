@@ -0,0 +1,116 @@
+import json
+import os
+from functools import partial
+
+import numpy as np
+import pytest
+
+from micerace import race
+from micerace.race import HistoricalMiceRaceSystem, StatsAgent
+
+NUM_PRIMER_RACES = 100
+HISTORY_COLUMNS = ('all_race_wins', 'completed_at', 'lane', 'won', 'decided', 'wins', 'lane_wins', 'lane_decided',
+                   'streak_first', 'streak_last', 'streak_length', 'streak_length_sum', 'win_time',
+                   'win_time_ms_sum', 'win_time_missing')
+
+
+def assert_same_replay(system, expected):
+    assert system.current_race_offset == expected.current_race_offset
+    assert [r.id for r in system.races] == [r.id for r in expected.races]
+    assert system.dead_mice == expected.dead_mice
+    for mouse_name, expected_mouse in expected.mice.items():
+        mouse = system.mice[mouse_name]
+        assert mouse.site_rating == expected_mouse.site_rating
+        assert [r.id for r in mouse.all_races] == [r.id for r in expected_mouse.all_races]
+        assert len(mouse.winning_races) == len(expected_mouse.winning_races)
+        assert mouse.history.streak == expected_mouse.history.streak
+        assert mouse.history.streak_lengths == expected_mouse.history.streak_lengths
+        for column in HISTORY_COLUMNS:
+            assert np.array_equal(getattr(mouse.history, column).values,
+                                  getattr(expected_mouse.history, column).values, equal_nan=True), column
+    assert np.array_equal(system.lane_tally.lane_wins.values, expected.lane_tally.lane_wins.values)
+    assert system.ratings.ratings == expected.ratings.ratings
+    assert np.array_equal(system.ratings.pre_race.values, expected.ratings.pre_race.values)
+
+
+def test_restore_matches_full_replay(workdir, leaderboard, true_races):
+    HistoricalMiceRaceSystem(num_primer_races=300, mice_metadata=leaderboard, races=true_races,
+                             checkpoint_dir='ck', checkpoint_every=50)
+    assert len(os.listdir('ck')) == 6
+    system = HistoricalMiceRaceSystem(num_primer_races=0, mice_metadata=leaderboard, races=true_races,
+                                      checkpoint_dir='ck')
+    assert system.restore_checkpoint(max_offset=320) and system.current_race_offset == 300
+
+    restored = HistoricalMiceRaceSystem(num_primer_races=320, mice_metadata=leaderboard, races=true_races,
+                                        checkpoint_dir='ck')
+    assert len(restored.races) == 320
+    assert_same_replay(restored, HistoricalMiceRaceSystem(num_primer_races=320, mice_metadata=leaderboard,
+                                                          races=true_races))
+
+    # Further races are ingested on top of the restored state like on a replayed one.
+    replayed = HistoricalMiceRaceSystem(num_primer_races=320, mice_metadata=leaderboard, races=true_races)
+    for _ in range(100):
+        restored.ingest_new_race()
+        replayed.ingest_new_race()
+    assert_same_replay(restored, replayed)
+
+
+def test_checkpoint_takes_leaderboard_fields_and_rejects_other_histories(workdir, leaderboard, true_races):
+    HistoricalMiceRaceSystem(num_primer_races=100, mice_metadata=leaderboard, races=true_races,
+                             checkpoint_dir='ck', checkpoint_every=100)
+
+    rerated = [dict(mouse, rating=mouse['rating'] + 1) for mouse in leaderboard]
+    restored = HistoricalMiceRaceSystem(num_primer_races=100, mice_metadata=rerated, races=true_races,
+                                        checkpoint_dir='ck')
+    assert_same_replay(restored, HistoricalMiceRaceSystem(num_primer_races=100, mice_metadata=rerated,
+                                                          races=true_races))
+
+    system = HistoricalMiceRaceSystem(num_primer_races=0, mice_metadata=leaderboard, races=true_races[1:],
+                                      checkpoint_dir='ck')
+    assert not system.restore_checkpoint(max_offset=100)
+    system = HistoricalMiceRaceSystem(num_primer_races=0, mice_metadata=leaderboard[:-1], races=true_races,
+                                      checkpoint_dir='ck')
+    assert not system.restore_checkpoint(max_offset=100)
+
+
+def training_agent(leaderboard, true_races):
+    system = HistoricalMiceRaceSystem(num_primer_races=NUM_PRIMER_RACES, mice_metadata=leaderboard,
+                                      races=true_races, checkpoint_dir='ck', checkpoint_every=50)
+    return StatsAgent(system=system, training=True, num_primer_races=NUM_PRIMER_RACES, model_path=None)
+
+
+def read_files(path):
+    names = sorted(os.listdir(path)) if os.path.isdir(path) else ['']
+    output = {}
+    for name in names:
+        with open(os.path.join(path, name) if name else path, 'rb') as infile:
+            output[name] = infile.read()
+    return output
+
+
+def test_resume_csv_matches_full_build(workdir, leaderboard, true_races):
+    open(race.TRAINING_CSV, 'w').close()
+    training_agent(leaderboard, true_races).build_training_data()
+    full = read_files(race.TRAINING_CSV)['']
+
+    # Interrupted mid-row, past a few checkpoints.
+    with open(race.TRAINING_CSV, 'r+b') as csv_out:
+        csv_out.truncate(len(full) * 2 // 3)
+    training_agent(leaderboard, true_races).build_training_data(resume=True)
+    assert read_files(race.TRAINING_CSV)[''] == full
+
+
+def test_resume_feature_store_matches_full_build(workdir, leaderboard, true_races, monkeypatch):
+    monkeypatch.setattr(race, 'FeatureStoreWriter', partial(race.FeatureStoreWriter, block_rows=64))
+    training_agent(leaderboard, true_races).build_training_data(output_format='npy')
+    full = read_files(race.TRAINING_STORE_DIR)
+
+    # Interrupted after the manifest listed its fourth block.
+    manifest_path = os.path.join(race.TRAINING_STORE_DIR, 'manifest.json')
+    with open(manifest_path) as infile:
+        manifest = json.load(infile)
+    manifest['blocks'] = manifest['blocks'][:4]
+    with open(manifest_path, 'w') as outfile:
+        json.dump(manifest, outfile)
+    training_agent(leaderboard, true_races).build_training_data(resume=True, output_format='npy')
+    assert read_files(race.TRAINING_STORE_DIR) == full
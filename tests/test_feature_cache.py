@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from micerace import race
+from micerace.race import HistoricalMiceRaceSystem, Race, StatsAgent
+from micerace.feature_cache import FeatureCache
+from micerace.synthetic import generate_races
+
+NUM_PRIMER_RACES = 100
+NUM_RACES = 400
+CACHE_FILE = 'feature-cache.sqlite3'
+
+
+def build(leaderboard, true_races, feature_cache_path=CACHE_FILE):
+    """(CSV bytes, how many rows were computed rather than read from the cache)."""
+    system = HistoricalMiceRaceSystem(num_primer_races=NUM_PRIMER_RACES, mice_metadata=leaderboard, races=true_races)
+    stats_agent = StatsAgent(system=system, training=True, num_primer_races=NUM_PRIMER_RACES, model_path=None,
+                             feature_cache_path=feature_cache_path)
+    computed = []
+    row = stats_agent.feature_schema.row
+    stats_agent.feature_schema.row = lambda *args: computed.append(1) or row(*args)
+
+    open(race.TRAINING_CSV, 'w').close()
+    stats_agent.build_training_data()
+    with open(race.TRAINING_CSV, 'rb') as infile:
+        return infile.read(), len(computed)
+
+
+def replay(race_dicts):
+    return HistoricalMiceRaceSystem.replay_races(Race.from_dicts(race_dicts))
+
+
+@pytest.fixture(scope='module')
+def race_dicts(leaderboard):
+    return generate_races(NUM_RACES, leaderboard)
+
+
+@pytest.fixture(scope='module')
+def true_races(race_dicts):
+    return replay(race_dicts)
+
+
+def test_cached_build_matches_fresh_build(workdir, leaderboard, true_races):
+    fresh, num_rows = build(leaderboard, true_races, feature_cache_path=None)
+    assert build(leaderboard, true_races) == (fresh, num_rows)
+    # Everything is cached now.
+    assert build(leaderboard, true_races) == (fresh, 0)
+
+
+@pytest.mark.parametrize('change', ['dropped', 'late', 'corrected'])
+def test_earlier_race_change_recomputes_every_later_row(workdir, leaderboard, race_dicts, change):
+    true_races = replay(race_dicts)
+    build(leaderboard, true_races)
+
+    offset = 300
+    ndx = next(ndx for ndx, race_dict in enumerate(race_dicts) if race_dict['_id'] == true_races[offset].id)
+    changed = list(race_dicts)
+    if change == 'dropped':
+        del changed[ndx]
+    elif change == 'late':
+        # Finished at the same time as the race at `offset`, so it replays right before it.
+        changed.insert(ndx, dict(changed[ndx], _id='f' * 24))
+    else:
+        winner = next(name for name in changed[ndx]['mice'] if name != changed[ndx]['winnerName'])
+        changed[ndx] = dict(changed[ndx], winnerName=winner)
+    changed = replay(changed)
+
+    fresh, num_rows = build(leaderboard, changed, feature_cache_path=None)
+    cached, num_computed = build(leaderboard, changed)
+    assert cached == fresh
+    # The row of every race from the changed one on is recomputed, none before it. Rows are written for the races
+    # from NUM_PRIMER_RACES - 1 to the second to last.
+    assert num_computed == len(changed) - 1 - offset
+    assert num_rows > num_computed
+
+
+def test_site_rating_change_recomputes_that_mouses_rows(workdir, leaderboard, true_races):
+    build(leaderboard, true_races)
+
+    rerated = [dict(mouse, rating=mouse['rating'] + 1) if ndx == 0 else mouse for ndx, mouse in enumerate(leaderboard)]
+    fresh, _ = build(rerated, true_races, feature_cache_path=None)
+    cached, num_computed = build(rerated, true_races)
+    assert cached == fresh
+    mouse_name = leaderboard[0]['name']
+    assert num_computed == sum(1 for r in true_races[NUM_PRIMER_RACES - 1:-1] if mouse_name in r.mice_names)
+
+
+def test_other_version_is_dropped(workdir, leaderboard, true_races):
+    build(leaderboard, true_races)
+    columns = race.FeatureSchema.from_file().columns
+    with FeatureCache(columns, CACHE_FILE) as cache:
+        assert len(cache) == len(true_races) - NUM_PRIMER_RACES
+        row_race_id = true_races[NUM_PRIMER_RACES].id
+        inputs, row = cache.get_many([row_race_id])[row_race_id]
+        assert row.dtype == np.float64 and len(row) == len(columns)
+    with FeatureCache(columns[:-1], CACHE_FILE) as cache:
+        assert len(cache) == 0
+
+
+def test_checkpoint_of_a_changed_history_is_not_restored(workdir, leaderboard, true_races):
+    HistoricalMiceRaceSystem(num_primer_races=200, mice_metadata=leaderboard, races=true_races,
+                             checkpoint_dir='ck', checkpoint_every=100)
+    changed = list(true_races)
+    del changed[150]
+    system = HistoricalMiceRaceSystem(num_primer_races=0, mice_metadata=leaderboard, races=changed,
+                                      checkpoint_dir='ck')
+    assert system.restore_checkpoint(max_offset=200) and system.current_race_offset == 100
+    expected = HistoricalMiceRaceSystem(num_primer_races=100, mice_metadata=leaderboard, races=changed)
+    assert system.history_digest == expected.history_digest
@@ -0,0 +1,118 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from micerace.feature_store import FeatureStore, FeatureStoreWriter, MANIFEST_FILE, store_from_csv
+
+COLUMNS = ['a', 'b', 'c']
+BLOCK_ROWS = 16
+
+
+def random_rows(num_rows, seed=0):
+    rnd = np.random.default_rng(seed)
+    features = rnd.normal(size=(num_rows, len(COLUMNS))).astype(np.float32)
+    features[rnd.random(features.shape) < 0.1] = np.nan
+    labels = rnd.integers(0, 4, num_rows)
+    race_ids = ['%024x' % (seed * 10**6 + ndx) for ndx in range(num_rows)]
+    return features, labels, race_ids
+
+
+def write(path, chunks, **kwargs):
+    writer = FeatureStoreWriter(path, COLUMNS, block_rows=BLOCK_ROWS, **kwargs)
+    for chunk in chunks:
+        writer.write(*chunk)
+    writer.close()
+    return writer
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST_FILE)) as infile:
+        return json.load(infile)
+
+
+def read_all(path):
+    """(features, labels, race ids) of every block the manifest lists, in order."""
+    blocks = read_manifest(path)['blocks']
+    features, labels, race_ids = ([np.load(os.path.join(path, block[kind])) for block in blocks]
+                                  for kind in ('features', 'labels', 'race_ids'))
+    return np.concatenate(features), np.concatenate(labels), np.concatenate(race_ids).tolist()
+
+
+def test_write_round_trip(tmp_path):
+    features, labels, race_ids = random_rows(100)
+    # Chunks of uneven sizes, some spanning block boundaries.
+    bounds = [0, 3, 20, 21, 60, 100]
+    write(tmp_path, [(features[a:b], labels[a:b], race_ids[a:b]) for a, b in zip(bounds[:-1], bounds[1:])])
+
+    manifest = read_manifest(tmp_path)
+    assert manifest['columns'] == COLUMNS
+    assert [block['rows'] for block in manifest['blocks']] == [16] * 6 + [4]
+    read_features, read_labels, read_race_ids = read_all(tmp_path)
+    np.testing.assert_array_equal(read_features, features)
+    np.testing.assert_array_equal(read_labels, labels)
+    assert read_race_ids == race_ids
+
+
+@pytest.mark.parametrize('num_rows', [0, 16, 37, 99])
+def test_truncate_then_append(tmp_path, num_rows):
+    features, labels, race_ids = random_rows(100)
+    write(tmp_path, [(features, labels, race_ids)])
+
+    more_features, more_labels, more_race_ids = random_rows(30, seed=1)
+    writer = FeatureStoreWriter(tmp_path, COLUMNS, block_rows=BLOCK_ROWS, append=True)
+    assert writer.race_ids() == race_ids
+    writer.truncate(num_rows)
+    assert writer.num_rows == num_rows
+    writer.write(more_features, more_labels, more_race_ids)
+    writer.close()
+
+    read_features, read_labels, read_race_ids = read_all(tmp_path)
+    np.testing.assert_array_equal(read_features, np.concatenate([features[:num_rows], more_features]))
+    np.testing.assert_array_equal(read_labels, np.concatenate([labels[:num_rows], more_labels]))
+    assert read_race_ids == race_ids[:num_rows] + more_race_ids
+    # Blocks past the truncation point are rewritten, not left behind under a different count.
+    assert all(block['rows'] == BLOCK_ROWS for block in read_manifest(tmp_path)['blocks'][:-1])
+
+
+def test_new_store_replaces_old_blocks(tmp_path):
+    write(tmp_path, [random_rows(100)])
+    features, labels, race_ids = random_rows(10, seed=2)
+    write(tmp_path, [(features, labels, race_ids)])
+    assert sorted(os.listdir(tmp_path)) == ['features-00000.npy', 'labels-00000.npy', 'manifest.json',
+                                            'race_ids-00000.npy']
+    assert read_all(tmp_path)[2] == race_ids
+
+
+def test_append_with_other_columns_fails(tmp_path):
+    write(tmp_path, [random_rows(10)])
+    with pytest.raises(Exception, match='different columns'):
+        FeatureStoreWriter(tmp_path, COLUMNS[:2], append=True)
+
+
+def test_take_gathers_rows_in_any_order(tmp_path):
+    features, labels, race_ids = random_rows(100)
+    write(tmp_path, [(features, labels, race_ids)])
+
+    store = FeatureStore(tmp_path)
+    assert len(store) == 100
+    indices = np.random.default_rng(0).permutation(100)[:60]
+    np.testing.assert_array_equal(store.take(indices), features[indices])
+    np.testing.assert_array_equal(store.take([99, 0, 99]), features[[99, 0, 99]])
+    np.testing.assert_array_equal(store.labels(), labels)
+    assert store.race_ids().tolist() == race_ids
+
+
+def test_store_from_csv(tmp_path):
+    features, labels, race_ids = random_rows(50)
+    csv_path = tmp_path / 'training.csv'
+    pd.DataFrame({'race_id': race_ids, 'winner_position_ndx': labels, 'ignored': 1,
+                  **{column: features[:, ndx] for ndx, column in enumerate(COLUMNS)}}).to_csv(csv_path, index=False)
+
+    store = store_from_csv(csv_path, tmp_path / 'store', COLUMNS, chunk_rows=BLOCK_ROWS)
+    assert store.columns == COLUMNS
+    np.testing.assert_array_equal(store.take(np.arange(50)), features)
+    np.testing.assert_array_equal(store.labels(), labels)
+    assert store.race_ids().tolist() == race_ids
@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+import numpy as np
+import pytest
+
+from micerace.history import GLOBAL_FEATURES, INTERVAL_FEATURES
+from micerace.mice import Mouse
+from micerace.race import Race
+from micerace.synthetic import generate_leaderboard, generate_races
+
+NUM_RACES = [5, 50, 500]
+LANE_NUM_RACES = [10, 100]
+TIME_DELTAS = [timedelta(hours=1), timedelta(hours=12), timedelta(days=3), timedelta(days=30)]
+
+
+@pytest.fixture(scope='module')
+def mice():
+    leaderboard = generate_leaderboard()
+    mice = {mouse['name']: Mouse(**mouse) for mouse in leaderboard}
+    for race in Race.from_dicts(generate_races(3000, leaderboard)):
+        for lane, mouse_name in enumerate(race.mice_names):
+            mice[mouse_name].add_race(race, lane)
+    return mice
+
+
+def expected_features(mouse):
+    """window_features' vector, put together from the per-stat Mouse methods."""
+    mouse.populate_global_stats()
+    wins_in_lane, losses_in_lane = mouse.current_lane_total_win_ratio()
+    features = [
+        mouse.lifetime_win_ratio,
+        *mouse.lane_win_vs_other_lane_ratio().values(),
+        wins_in_lane / max(wins_in_lane + losses_in_lane, 1),
+        mouse.current_repeat_wins, mouse.average_repeat_wins, mouse.max_repeat_wins,
+    ]
+    for n in NUM_RACES:
+        won, lost = mouse.win_ratio_last_n_races(n)
+        features.append(won / max(won + lost, 1))
+    for n in LANE_NUM_RACES:
+        won, lost = mouse.current_lane_total_win_ratio(num_races=n)
+        features.append(won / max(won + lost, 1))
+    for time_delta in TIME_DELTAS:
+        stats = mouse.interval_stats(time_delta)
+        # The windowed current streak has no Mouse method; it is compared on its own below.
+        features += [
+            stats['win_ratio'], stats['wins'], stats['losses'],
+            stats['wins_in_lane'] / max(stats['wins_in_lane'] + stats['losses_in_lane'], 1), np.nan,
+            stats['avg_repeat_w'], stats['median_repeat_w'], stats['max_repeat_w'],
+            *[np.nan if stats[name] is None else stats[name] for name in ('min_t', 'max_t', 'mean_t', 'median_t')],
+            *stats['lane_win_ratio_vs_others'].values(),
+        ]
+    return np.array(features, dtype=np.float64)
+
+
+def test_window_features_match_mouse_methods(mice):
+    current_streak = [len(GLOBAL_FEATURES) + len(NUM_RACES) + len(LANE_NUM_RACES) + ndx * len(INTERVAL_FEATURES) +
+                      INTERVAL_FEATURES.index('current_repeat_wins') for ndx in range(len(TIME_DELTAS))]
+    for mouse in mice.values():
+        features = mouse.history.window_features(mouse.all_races[-1]._event_starts_at, mouse.current_lane, NUM_RACES,
+                                                 LANE_NUM_RACES, TIME_DELTAS)
+        expected = expected_features(mouse)
+        assert len(features) == len(expected)
+        compared = np.ones(len(features), dtype=bool)
+        compared[current_streak] = False
+        np.testing.assert_allclose(features[compared], expected[compared], rtol=1e-12, err_msg=mouse.name)
+
+        # Over the whole history the windowed current streak is the mouse's current streak.
+        start = mouse.history.window_start(0)
+        assert mouse.history.repeat_wins(start)[0] == mouse.current_repeat_wins
+
+
+def test_window_features_skip_unused_families(mice):
+    mouse = next(iter(mice.values()))
+    now = mouse.all_races[-1]._event_starts_at
+    everything = mouse.history.window_features(now, mouse.current_lane, NUM_RACES, LANE_NUM_RACES, TIME_DELTAS)
+    only_wins = mouse.history.window_features(now, mouse.current_lane, NUM_RACES, LANE_NUM_RACES, TIME_DELTAS,
+                                              frozenset(['win_counts']))
+    computed = ~np.isnan(only_wins)
+    assert computed.any() and not computed.all()
+    np.testing.assert_array_equal(only_wins[computed], everything[computed])
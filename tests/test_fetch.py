@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+import requests
+
+from micerace import util
+from micerace.fetch import LocalRaceServer, RaceFetcher, MAX_TRIES, fetch_all_races, fetch_new_races
+from micerace.race_store import open_race_store
+from micerace.synthetic import generate_races
+
+PAGE_SIZE = 50
+
+
+@pytest.fixture
+def races():
+    # Newest first, like the API.
+    return list(reversed(generate_races(1000)))
+
+
+@pytest.fixture
+def server(races):
+    with LocalRaceServer(races, page_size=PAGE_SIZE) as server:
+        yield server
+
+
+def known_ids_except(races, num_new):
+    known = {race['_id'] for race in races[num_new:]}
+    return lambda race_ids: known.intersection(race_ids)
+
+
+def test_fetch_all_races(server, races):
+    assert fetch_all_races(server.url, concurrency=4) == races
+    assert server.num_requests == len(races) // PAGE_SIZE
+
+
+@pytest.mark.parametrize('num_new, num_requests', [(0, 1), (2, 3), (60, 3), (400, 15)])
+def test_fetch_new_races_stops_at_first_known_page(server, races, num_new, num_requests):
+    fetched = fetch_new_races(server.url, known_ids_except(races, num_new))
+    # Everything down to and including the first fully known page, and nothing past it.
+    num_pages = -(-num_new // PAGE_SIZE) + 1
+    assert fetched == races[:num_pages * PAGE_SIZE]
+    assert server.num_requests == num_requests
+
+
+def test_fetch_new_races_max_pages(server, races):
+    fetched = fetch_new_races(server.url, lambda race_ids: set(), max_pages=5)
+    assert fetched == races[:5 * PAGE_SIZE]
+    assert server.num_requests == 5
+
+
+def test_fetch_pages(server, races):
+    with RaceFetcher(server.url, concurrency=2) as fetcher:
+        assert asyncio.run(fetcher.fetch_pages([3, 1])) == races[100:150] + races[:50]
+
+
+def test_refresh_latest_races_writes_the_store(server, races, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'pickles').mkdir()
+    monkeypatch.setattr(util, 'HISTORICAL_RACES_URL', server.url)
+
+    assert util.refresh_latest_races(num_pages=2) == races[:100]
+    with open_race_store() as race_store:
+        assert race_store.known_ids(race['_id'] for race in races[:100]) == {race['_id'] for race in races[:100]}
+    assert util.get_race_log(races[0]['_id']) == races[0]['log']
+
+
+def test_failed_page_is_retried(races):
+    with LocalRaceServer(races, page_size=PAGE_SIZE, failures={3: 2}) as server:
+        with RaceFetcher(server.url, concurrency=4, tries=3, backoff_seconds=0.01) as fetcher:
+            assert asyncio.run(fetcher.fetch_all()) == races
+        assert server.num_requests == len(races) // PAGE_SIZE + 2
+
+
+def test_get_all_races_gives_up_after_the_fetchers_tries(races, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'pickles').mkdir()
+    with LocalRaceServer(races, page_size=PAGE_SIZE, failures={3: MAX_TRIES}) as server:
+        with pytest.raises(requests.HTTPError):
+            util.get_all_races(use_cache=False, url=server.url)
+        # Page 3 was tried MAX_TRIES times and no page was fetched again on top of that.
+        assert server.num_requests == len(races) // PAGE_SIZE + MAX_TRIES - 1
@@ -0,0 +1,105 @@
+import random
+import statistics
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from micerace.history import RaceHistory
+from micerace.util import to_epoch_us
+
+COLUMNS = ('all_race_wins', 'completed_at', 'lane', 'won', 'decided', 'wins', 'lane_wins', 'lane_decided',
+           'streak_first', 'streak_last', 'streak_length', 'streak_length_sum', 'win_time', 'win_time_ms_sum',
+           'win_time_missing')
+START = datetime(2020, 1, 1)
+
+
+class FakeRace:
+    """The parts of a Race that RaceHistory.add_race reads."""
+
+    def __init__(self, race_num, completed, winner_name, elapsed_time):
+        self.completed = completed
+        self.completed_at = START + timedelta(minutes=race_num)
+        self.winner_name = winner_name
+        self.elapsed_time = elapsed_time
+
+
+def random_race(race_num, rnd):
+    """(race, lane, won) for a mouse that wins about half of the decided races."""
+    completed = rnd.random() < 0.9
+    winner_name = None if rnd.random() < 0.15 else 'winner'
+    race = FakeRace(race_num, completed, winner_name, round(rnd.uniform(8, 20), 3))
+    return race, rnd.randrange(4), completed and winner_name is not None and rnd.random() < 0.5
+
+
+def build(races):
+    history = RaceHistory()
+    for race, lane, won in races:
+        history.add_race(race, lane, won)
+    return history
+
+
+def reference_streaks(races):
+    """Lengths of the win streaks, closed ones first, and the length of the open one; undecided races break none."""
+    closed, streak = [], 0
+    for race, _, won in races:
+        if won:
+            streak += 1
+        elif race.completed and race.winner_name is not None and streak:
+            closed.append(streak)
+            streak = 0
+    return closed, streak
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_truncate_matches_rebuild(seed):
+    rnd = random.Random(seed)
+    for _ in range(40):
+        races = [random_race(race_num, rnd) for race_num in range(rnd.randint(1, 80))]
+        history = build(races)
+        for _ in range(3):
+            races = races[:rnd.randint(0, len(races))]
+            history.truncate(len(races), sum(race.completed for race, _, _ in races))
+            expected = build(races)
+            assert history.streak == expected.streak
+            assert history.streak_lengths == expected.streak_lengths
+            assert history.streak_total == expected.streak_total
+            for column in COLUMNS:
+                assert np.array_equal(getattr(history, column).values, getattr(expected, column).values,
+                                      equal_nan=True), column
+
+            added = [random_race(len(races) + race_num, rnd) for race_num in range(rnd.randint(0, 10))]
+            for race, lane, won in added:
+                history.add_race(race, lane, won)
+            races += added
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_win_time_stats(seed):
+    rnd = random.Random(seed)
+    races = [random_race(race_num, rnd) for race_num in range(300)]
+    history = build(races)
+    for minutes in (0, 50, 150, 290):
+        cutoff = START + timedelta(minutes=minutes)
+        times = [race.elapsed_time for race, _, won in races if won and race.completed_at >= cutoff]
+        stats = history.win_time_stats(to_epoch_us(cutoff))
+        assert stats == {
+            'min_t': min(times),
+            'max_t': max(times),
+            'mean_t': round(statistics.mean(times), 2),
+            'median_t': round(statistics.median(times), 2),
+        }
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_global_repeat_wins(seed):
+    rnd = random.Random(seed)
+    races = [random_race(race_num, rnd) for race_num in range(300)]
+    closed, streak = reference_streaks(races)
+    lengths = closed + ([streak] if streak else [])
+
+    current, average, median, maximum = build(races).global_repeat_wins()
+    assert current == streak
+    assert average == pytest.approx(statistics.mean(lengths))
+    assert median == statistics.median(lengths)
+    assert maximum == max(lengths)
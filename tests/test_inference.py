@@ -0,0 +1,113 @@
+import json
+
+import numpy as np
+import pytest
+
+from micerace.inference import NumpyModel, score_store
+from micerace.features import MISSING_VALUE
+from micerace.feature_store import FeatureStore, FeatureStoreWriter
+
+NUM_FEATURES = 23
+
+
+def random_model(path, layers, seed=0):
+    """Save an export_model-style .npz of `layers` ((spec, weight shapes)) with random weights; returns the weights."""
+    rnd = np.random.default_rng(seed)
+    arrays, weights = {}, []
+    for ndx, (spec, shapes) in enumerate(layers):
+        spec['num_weights'] = len(shapes)
+        layer_weights = [rnd.normal(scale=0.3, size=shape).astype(np.float32) for shape in shapes]
+        arrays.update({f'{ndx}_{weight_ndx}': weight for weight_ndx, weight in enumerate(layer_weights)})
+        weights.append(layer_weights)
+    np.savez(path, layers=json.dumps([spec for spec, _ in layers]), input_shape=np.array([NUM_FEATURES, 1]),
+             **arrays)
+    return weights
+
+
+def train_py_layers(filters=8, kernel_size=3, dense_units=10):
+    """The layers of train.build_model, with their weight shapes."""
+    pooled = (NUM_FEATURES - 2 * (kernel_size - 1)) // 2
+    return [
+        ({'type': 'Conv1D', 'activation': 'relu'}, [(kernel_size, 1, filters), (filters,)]),
+        ({'type': 'Conv1D', 'activation': 'relu'}, [(kernel_size, filters, filters), (filters,)]),
+        ({'type': 'Dropout'}, []),
+        ({'type': 'MaxPooling1D', 'pool_size': 2, 'strides': 2}, []),
+        ({'type': 'Flatten'}, []),
+        ({'type': 'Dense', 'activation': 'relu'}, [(pooled * filters, dense_units), (dense_units,)]),
+        ({'type': 'Dense', 'activation': 'softmax'}, [(dense_units, 4), (4,)]),
+    ]
+
+
+def conv1d(x, kernel, bias):
+    """Valid, stride-1 Conv1D of one row, straight from its definition."""
+    out_len = len(x) - len(kernel) + 1
+    return np.array([[sum(x[pos + k, c] * kernel[k, c, f] for k in range(len(kernel)) for c in range(x.shape[1]))
+                      + bias[f] for f in range(kernel.shape[2])] for pos in range(out_len)])
+
+
+def reference_forward(row, weights):
+    """train.build_model's forward pass for one row, one layer at a time in float64."""
+    (k1, b1), (k2, b2), _, _, _, (d1, db1), (d2, db2) = weights
+    x = np.maximum(conv1d(row[:, np.newaxis].astype(np.float64), k1, b1), 0)
+    x = np.maximum(conv1d(x, k2, b2), 0)
+    x = np.array([np.maximum(x[2 * pos], x[2 * pos + 1]) for pos in range(len(x) // 2)])
+    x = np.maximum(x.reshape(-1) @ d1 + db1, 0)
+    logits = x @ d2 + db2
+    return np.exp(logits - logits.max()) / np.exp(logits - logits.max()).sum()
+
+
+def test_forward_pass_matches_hand_computed(tmp_path):
+    path = str(tmp_path / 'model.npz')
+    weights = random_model(path, train_py_layers())
+    x = np.random.default_rng(1).uniform(-1, 1, (37, NUM_FEATURES)).astype(np.float32)
+
+    model = NumpyModel(path)
+    expected = np.array([reference_forward(row, weights) for row in x])
+    np.testing.assert_allclose(model.predict(x), expected, atol=1e-5)
+    # Batching and the (rows, features, 1) Keras layout do not change the result.
+    np.testing.assert_allclose(model.predict(x[:, :, np.newaxis], batch_size=5), model.predict(x), atol=1e-6)
+    np.testing.assert_allclose(model.predict(x).sum(axis=1), 1, atol=1e-5)
+
+
+def test_other_layers(tmp_path):
+    path = str(tmp_path / 'model.npz')
+    weights = random_model(path, [
+        ({'type': 'Conv1D', 'activation': 'linear'}, [(2, 1, 3), (3,)]),
+        ({'type': 'LeakyReLU', 'alpha': 0.1}, []),
+        ({'type': 'MaxPooling1D', 'pool_size': 3, 'strides': 2}, []),
+        ({'type': 'Flatten'}, []),
+        ({'type': 'Dense', 'activation': 'linear'}, [(30, 4), (4,)]),
+        ({'type': 'Activation', 'activation': 'tanh'}, []),
+    ])
+    x = np.random.default_rng(2).uniform(-1, 1, (6, NUM_FEATURES)).astype(np.float32)
+
+    (kernel, bias), _, _, _, (dense, dense_bias), _ = weights
+    expected = []
+    for row in x:
+        h = conv1d(row[:, np.newaxis].astype(np.float64), kernel, bias)
+        h = np.where(h > 0, h, 0.1 * h)
+        h = np.array([h[2 * pos:2 * pos + 3].max(axis=0) for pos in range((len(h) - 3) // 2 + 1)])
+        expected.append(np.tanh(h.reshape(-1) @ dense + dense_bias))
+    np.testing.assert_allclose(NumpyModel(path).predict(x), np.array(expected), atol=1e-5)
+
+
+def test_wrong_input_shape_fails(tmp_path):
+    path = str(tmp_path / 'model.npz')
+    random_model(path, train_py_layers())
+    with pytest.raises(Exception, match='Expected input of shape'):
+        NumpyModel(path).predict(np.zeros((2, NUM_FEATURES + 1)))
+
+
+def test_score_store_fills_missing_values(tmp_path):
+    path = str(tmp_path / 'model.npz')
+    random_model(path, train_py_layers())
+    model = NumpyModel(path)
+    rnd = np.random.default_rng(3)
+    features = rnd.uniform(-1, 1, (50, NUM_FEATURES)).astype(np.float32)
+    features[rnd.random(features.shape) < 0.2] = np.nan
+
+    writer = FeatureStoreWriter(str(tmp_path / 'store'), [f'f{ndx}' for ndx in range(NUM_FEATURES)], block_rows=16)
+    writer.write(features, np.zeros(50), [str(ndx) for ndx in range(50)])
+    writer.close()
+    np.testing.assert_allclose(score_store(FeatureStore(str(tmp_path / 'store')), model, batch_size=7),
+                               model.predict(np.nan_to_num(features, nan=MISSING_VALUE)), atol=1e-6)
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from micerace import race, util
+from micerace.synthetic import generate_leaderboard, generate_races
+
+HISTORY_COLUMNS = ('all_race_wins', 'completed_at', 'lane', 'won', 'decided', 'wins', 'lane_wins', 'lane_decided',
+                   'streak_first', 'streak_last', 'streak_length', 'streak_length_sum', 'win_time',
+                   'win_time_ms_sum', 'win_time_missing')
+
+
+def pending(race_dict):
+    return dict(race_dict, raceComplete=None, winnerName=None, runnerUpName=None)
+
+
+def reset(race_dict):
+    return dict(race_dict, raceIsReset=True, winnerName=None, runnerUpName=None)
+
+
+def cancelled(race_dict):
+    return dict(race_dict, raceCancelled=True, raceComplete=None, winnerName=None, runnerUpName=None)
+
+
+@pytest.fixture
+def site(monkeypatch):
+    """The races the site would serve, oldest first; systems built in a test load whatever it holds then."""
+    site = {'races': []}
+    monkeypatch.setattr(util, 'get_mice_data', lambda *args, **kwargs: generate_leaderboard())
+    monkeypatch.setattr(util, 'get_all_races', lambda **kwargs: list(reversed(site['races'])))
+    monkeypatch.setattr(race, 'NUM_SKIP_INITIAL_RACES', 0)
+    return site
+
+
+def assert_same_system(live, site, races):
+    site['races'] = races
+    rebuilt = race.MiceRaceSystem(target_mice_names=[])
+    assert [r.id for r in live.races] == [r.id for r in rebuilt.races]
+    assert [r.status for r in live.races] == [r.status for r in rebuilt.races]
+
+    schema = race.FeatureSchema.from_file()
+    for mouse_name, expected in rebuilt.mice.items():
+        mouse = live.mice[mouse_name]
+        assert [r.id for r in mouse.all_races] == [r.id for r in expected.all_races]
+        for attr in ('completed_races', 'winning_races', 'losing_races', 'reset_races', 'cancelled_races'):
+            assert len(getattr(mouse, attr)) == len(getattr(expected, attr)), (mouse_name, attr)
+        history, expected_history = mouse.history, expected.history
+        assert history.streak == expected_history.streak
+        assert history.streak_lengths == expected_history.streak_lengths
+        assert history.streak_total == expected_history.streak_total
+        for column in HISTORY_COLUMNS:
+            assert np.array_equal(getattr(history, column).values, getattr(expected_history, column).values), \
+                (mouse_name, column)
+        if mouse.all_races:
+            assert np.array_equal(schema.mouse_vector(mouse, {}), schema.mouse_vector(expected, {}), equal_nan=True)
+
+    assert np.array_equal(live.lane_tally.lane_wins.values, rebuilt.lane_tally.lane_wins.values)
+    assert np.array_equal(live.lane_tally.winner_lane.values, rebuilt.lane_tally.winner_lane.values)
+    assert live.ratings.ratings == rebuilt.ratings.ratings
+    assert np.array_equal(live.ratings.pre_race.values, rebuilt.ratings.pre_race.values)
+    assert np.array_equal(live.ratings.win_probs.values, rebuilt.ratings.win_probs.values)
+
+
+def test_ingest_matches_rebuild(site):
+    race_dicts = generate_races(700, num_pending=0)
+    races = list(race_dicts[:500])
+    site['races'] = races
+    live = race.MiceRaceSystem(target_mice_names=[])
+
+    # Each race first shows up pending, then with its result; every seventh one is cancelled instead.
+    for ndx in range(500, 600):
+        live.ingest(races[-29:] + [pending(race_dicts[ndx])])
+        races.append(race_dicts[ndx] if ndx % 7 else cancelled(race_dicts[ndx]))
+        live.ingest(races[-30:])
+    assert_same_system(live, site, races)
+
+    # A race reset after the fact, and a cancelled race that turns out to have been run.
+    races[-40] = reset(races[-40])
+    races[588] = race_dicts[588]
+    assert live.ingest(races[-50:])
+    assert_same_system(live, site, races)
+
+    # Nothing changed: nothing to update.
+    assert live.ingest(races[-30:]) == []
+
+
+def test_ingest_late_arrival(site):
+    races = generate_races(600, num_pending=0)
+    site['races'] = races[:595] + races[596:]
+    live = race.MiceRaceSystem(target_mice_names=[])
+
+    assert live.ingest(races[-30:])
+    assert_same_system(live, site, races)
@@ -0,0 +1,69 @@
+from datetime import timedelta
+
+import pytest
+
+from micerace.history import LaneTally, LANE_COLORS
+from micerace.race import HistoricalMiceRaceSystem, Race, StatsAgent
+from micerace.synthetic import generate_races
+from micerace.util import to_epoch_us
+
+
+def reference_ratios(races):
+    """Share of wins per lane over the decided `races`, in the order the lanes first won, as the loop over every
+    race used to compute it."""
+    counts = {}
+    for race in races:
+        if race.completed and race.winner_name is not None:
+            color = LANE_COLORS[race.mice_names.index(race.winner_name)]
+            counts[color] = counts.get(color, 0) + 1
+    return {color: round(count / float(sum(counts.values())), 5) for color, count in counts.items()}
+
+
+@pytest.fixture(scope='module')
+def races():
+    # Includes pending, reset and cancelled races, which the tally skips.
+    return Race.from_dicts(generate_races(2000, num_pending=3))
+
+
+def tally(races):
+    lane_tally = LaneTally()
+    for race in races:
+        lane_tally.add_race(race)
+    return lane_tally
+
+
+@pytest.mark.parametrize('num_races', [None, 1, 7, 100, 5000])
+@pytest.mark.parametrize('time_delta', [None, timedelta(minutes=30), timedelta(hours=6), timedelta(days=30)])
+def test_windowed_ratios(races, num_races, time_delta):
+    lane_tally = tally(races)
+    decided = [race for race in races if LaneTally.counts_race(race)]
+    assert len(lane_tally) == len(decided)
+
+    window = decided[-num_races:] if num_races is not None else decided
+    since_us = None
+    if time_delta is not None:
+        since = races[-1]._event_starts_at - time_delta
+        since_us = to_epoch_us(since)
+        window = [race for race in window if race.completed_at >= since]
+    assert lane_tally.ratios(lane_tally.window_start(num_races=num_races, since_us=since_us)) == \
+        reference_ratios(window)
+
+
+def test_truncate_matches_rebuild(races):
+    lane_tally = tally(races)
+    for num_races in (1500, 700, 0):
+        lane_tally.truncate(num_races)
+        expected = tally([race for race in races if LaneTally.counts_race(race)][:num_races])
+        assert lane_tally.ratios() == expected.ratios()
+        assert (lane_tally.lane_wins.values == expected.lane_wins.values).all()
+        assert (lane_tally.completed_at.values == expected.completed_at.values).all()
+
+
+def test_stats_agent_lane_win_ratios(leaderboard, true_races):
+    system = HistoricalMiceRaceSystem(num_primer_races=400, mice_metadata=leaderboard, races=true_races)
+    stats_agent = StatsAgent(system=system, model_path=None)
+    assert stats_agent.lane_win_ratios() == reference_ratios(system.races)
+    assert stats_agent.lane_win_ratios(num_races=50) == reference_ratios(system.races[-50:])
+    since = system.latest_race._event_starts_at - timedelta(hours=12)
+    assert stats_agent.lane_win_ratios(time_delta=timedelta(hours=12)) == \
+        reference_ratios([race for race in system.races if race.completed_at >= since])
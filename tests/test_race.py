@@ -0,0 +1,41 @@
+import pytest
+
+from micerace.race import Race
+from micerace.synthetic import generate_races
+
+MISSING = object()
+
+
+def race_fields(race):
+    # '__v' is name-mangled like any private attribute.
+    return {attr: getattr(race, '_Race' + attr if attr.startswith('__') else attr, MISSING)
+            for attr in Race.__slots__}
+
+
+def edge_cases(race_dict):
+    """Variations of one API dict on what the bulk parser handles differently from one-at-a-time parsing."""
+    return [
+        dict(race_dict, raceComplete=None),
+        dict(race_dict, staging=None, bettingOpens=None),
+        # Finished before it started: timedelta.seconds wraps around a day.
+        dict(race_dict, raceComplete=race_dict['raceStarts'][:10] + 'T00:00:00.000Z'),
+        # Other fractions of a second than the API's milliseconds.
+        dict(race_dict, raceStarts=race_dict['raceStarts'][:19] + 'Z',
+             raceComplete=race_dict['raceComplete'][:19] + '.5Z'),
+        dict(race_dict, winnerName=None, runnerUpName='null'),
+    ]
+
+
+def test_from_dicts_matches_one_at_a_time():
+    race_dicts = generate_races(500)
+    race_dicts += edge_cases(race_dicts[10])
+    assert race_dicts[10]['raceComplete'] is not None
+    assert [race_fields(race) for race in Race.from_dicts(race_dicts)] == \
+        [race_fields(Race(**race_dict)) for race_dict in race_dicts]
+
+
+@pytest.mark.parametrize('ndx', range(5))
+def test_from_dicts_edge_case_alone(ndx):
+    # Alone, each case is a whole column of its own instead of sharing one with plain timestamps.
+    race_dict = edge_cases(generate_races(500)[10])[ndx]
+    assert race_fields(Race.from_dicts([race_dict])[0]) == race_fields(Race(**race_dict))
@@ -0,0 +1,58 @@
+import pickle
+from glob import glob
+
+from micerace.race_store import RaceStore, open_race_store
+from micerace.synthetic import generate_races
+
+
+def test_put_many_counts_known_and_versions_only_changes(tmp_path):
+    races = generate_races(100)
+    with RaceStore(str(tmp_path / 'races.sqlite3')) as store:
+        assert store.put_many(races[:60]) == 0
+        assert store.version == 1
+        assert store.put_many(races) == 60
+        assert store.version == 2
+        # Nothing new or changed: no new version.
+        assert store.put_many(races[50:]) == 50
+        assert store.version == 2
+        assert len(store) == 100
+        assert store.all_races() == races
+        assert store.all_races(reverse=True) == races[::-1]
+
+
+def test_delta_backups_rebuild_the_store(tmp_path):
+    races = generate_races(101)
+    with RaceStore(str(tmp_path / 'races.sqlite3')) as store:
+        assert store.backup(str(tmp_path)) is None
+        store.put_many(races[:100])
+        first = store.backup(str(tmp_path))
+        # A second backup right away gets its own file instead of overwriting the first.
+        store.put_many(races[99:])
+        second = store.backup(str(tmp_path))
+        assert store.backup(str(tmp_path)) is None
+        expected = store.all_races()
+
+    assert first != second
+    with open(first) as infile:
+        assert len(infile.readlines()) == 100
+    with open(second) as infile:
+        assert len(infile.readlines()) == 1
+
+    with RaceStore(str(tmp_path / 'restored.sqlite3')) as restored:
+        for path in sorted(glob(str(tmp_path / 'races-delta-*.jsonl'))):
+            restored.restore_backup(path)
+        assert restored.all_races() == expected
+
+
+def test_open_race_store_migrates_the_pickle_once(tmp_path):
+    races = generate_races(20)
+    pickle_path = str(tmp_path / 'races.pickle')
+    with open(pickle_path, 'wb') as outfile:
+        pickle.dump({race['_id']: race for race in races}, outfile)
+
+    store_path = str(tmp_path / 'races.sqlite3')
+    with open_race_store(store_path, pickle_path) as store:
+        assert store.all_races() == races
+        store.put_many([dict(races[0], raceIsReset=True)])
+    with open_race_store(store_path, pickle_path) as store:
+        assert store.get(races[0]['_id'])['raceIsReset']
@@ -0,0 +1,62 @@
+import random
+
+import numpy as np
+import pytest
+
+from micerace.ratings import RatingEngine, win_probabilities, INITIAL_RATING, K_FACTOR
+from micerace.race import Race
+from micerace.synthetic import generate_races
+
+
+@pytest.fixture(scope='module')
+def races():
+    # Includes pending, reset and cancelled races, which move no ratings.
+    return Race.from_dicts(generate_races(1500, num_pending=3))
+
+
+def engine_for(races):
+    engine = RatingEngine()
+    for race in races:
+        engine.add_race(race)
+    return engine
+
+
+def test_ratings_follow_multiplayer_elo(races):
+    engine = engine_for(races)
+    ratings = {}
+    for ndx, race in enumerate(races):
+        before = [ratings.get(mouse_name, INITIAL_RATING) for mouse_name in race.mice_names]
+        probs = win_probabilities(before)
+        assert sum(probs) == pytest.approx(1)
+        np.testing.assert_allclose(engine.pre_race.values[ndx], before)
+        np.testing.assert_allclose(engine.win_probs.values[ndx], probs)
+        if race.completed and race.winner_name is not None:
+            for mouse_name, rating, prob in zip(race.mice_names, before, probs):
+                ratings[mouse_name] = rating + K_FACTOR * ((mouse_name == race.winner_name) - prob)
+    assert engine.ratings.keys() == ratings.keys()
+    for mouse_name, rating in ratings.items():
+        assert engine.rating(mouse_name) == pytest.approx(rating)
+    np.testing.assert_allclose(engine.latest(), [engine.pre_race.values[-1], engine.win_probs.values[-1]])
+
+
+def test_truncate_matches_rebuild(races):
+    rnd = random.Random(0)
+    engine = engine_for(races)
+    num_races = len(races)
+    for _ in range(10):
+        num_races = rnd.randint(0, num_races)
+        engine.truncate(num_races)
+        expected = engine_for(races[:num_races])
+        assert len(engine) == num_races
+        # Mice first seen in a removed race are back at the initial rating rather than unknown.
+        for mouse_name in engine.ratings.keys() | expected.ratings.keys():
+            assert engine.rating(mouse_name) == expected.rating(mouse_name)
+        np.testing.assert_array_equal(engine.pre_race.values, expected.pre_race.values)
+        np.testing.assert_array_equal(engine.win_probs.values, expected.win_probs.values)
+
+        # Re-adding the races reproduces the full engine.
+        added = rnd.randint(0, len(races) - num_races)
+        for race in races[num_races:num_races + added]:
+            engine.add_race(race)
+        num_races += added
+        np.testing.assert_array_equal(engine.pre_race.values, engine_for(races[:num_races]).pre_race.values)
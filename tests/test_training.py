@@ -0,0 +1,52 @@
+import os
+from functools import partial
+
+import pytest
+
+from micerace import race
+from micerace.race import HistoricalMiceRaceSystem, StatsAgent
+from micerace.feature_store import FeatureStore
+
+NUM_PRIMER_RACES = 100
+
+
+def training_agent(leaderboard, true_races, **kwargs):
+    system = HistoricalMiceRaceSystem(num_primer_races=NUM_PRIMER_RACES, mice_metadata=leaderboard,
+                                      races=true_races, **kwargs)
+    return StatsAgent(system=system, training=True, num_primer_races=NUM_PRIMER_RACES, model_path=None)
+
+
+def build(leaderboard, true_races, output_format, num_workers, **kwargs):
+    """The bytes of every file the build wrote, by path relative to the output."""
+    if output_format == 'csv':
+        open(race.TRAINING_CSV, 'w').close()
+    training_agent(leaderboard, true_races, **kwargs).build_training_data(num_workers=num_workers,
+                                                                          output_format=output_format)
+    if output_format == 'csv':
+        with open(race.TRAINING_CSV, 'rb') as infile:
+            return {'csv': infile.read()}
+    output = {}
+    for name in sorted(os.listdir(race.TRAINING_STORE_DIR)):
+        with open(os.path.join(race.TRAINING_STORE_DIR, name), 'rb') as infile:
+            output[name] = infile.read()
+    return output
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'npy'])
+def test_sharded_build_matches_serial(workdir, leaderboard, true_races, output_format, monkeypatch):
+    # Small blocks, so shards end mid-block.
+    monkeypatch.setattr(race, 'FeatureStoreWriter', partial(race.FeatureStoreWriter, block_rows=64))
+    serial = build(leaderboard, true_races, output_format, num_workers=1)
+    sharded = build(leaderboard, true_races, output_format, num_workers=3)
+    assert sharded == serial
+    if output_format == 'npy':
+        assert len(FeatureStore(race.TRAINING_STORE_DIR)) == len(true_races) - NUM_PRIMER_RACES
+
+
+def test_sharded_build_with_checkpoints(workdir, leaderboard, true_races):
+    serial = build(leaderboard, true_races, 'csv', num_workers=1)
+    # Every worker replays from race 0 into the same fresh directory, so they reach the same offsets together.
+    checkpointed = build(leaderboard, true_races, 'csv', num_workers=8, checkpoint_dir='ck', checkpoint_every=25)
+    assert checkpointed == serial
+    checkpoints = sorted(os.listdir('ck'))
+    assert checkpoints == [f'replay-{offset:08d}.pickle' for offset in range(25, len(true_races), 25)]